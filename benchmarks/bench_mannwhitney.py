@@ -0,0 +1,74 @@
+"""
+Compares the per-tag Mann-Whitney loop (df_mannwhitney) with the batch engine (df_mannwhitney_batch).
+Before the timings, check_parity asserts that the batch p-values match scipy.stats.mannwhitneyu on synthetic
+data, on both sides of scipy's exact/asymptotic switch (min(n1, n2) <= 8) and with and without ties.
+
+Run from the repository root:
+    python -m benchmarks.bench_mannwhitney
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+
+from pipeline.star_schema import read_normalized
+from pipeline.storage import list_tables
+from statistical_tests.statistical_tests import df_mannwhitney, df_mannwhitney_batch, mannwhitney_incidence
+
+
+path_normalized = 'outputs/normalize_posts'
+column_target = 'Curtidas'
+
+
+def check_parity(sizes=(5, 9, 16, 17, 40), seed=0):
+    """ Every split of n posts into a tag group of n1 = 1..n-1 posts, with distinct values and with ties """
+    rng = np.random.default_rng(seed)
+    p_value_columns = ['P-Value - ts', 'P-Value - greater', 'P-Value - less']
+    alternatives = ['two-sided', 'greater', 'less']
+    checked = 0
+    for n in sizes:
+        for values in [rng.permutation(n).astype(float), rng.integers(0, 4, n).astype(float)]:
+            columns = [rng.permutation(n)[:n1] for n1 in range(1, n)]
+            rows = np.concatenate(columns)
+            tags = np.repeat(np.arange(len(columns)), [len(column) for column in columns])
+            incidence = sparse.csc_matrix((np.ones(len(rows)), (rows, tags)), shape=(n, len(columns)))
+            batch = pd.DataFrame(mannwhitney_incidence(values, incidence, np.arange(len(columns))))
+
+            for j, column in enumerate(columns):
+                with_tag = np.zeros(n, dtype=bool)
+                with_tag[column] = True
+                expected = [stats.mannwhitneyu(values[with_tag], values[~with_tag], alternative=alternative).pvalue
+                            for alternative in alternatives]
+                np.testing.assert_allclose(batch.loc[j, p_value_columns].to_numpy(dtype=float), expected,
+                                           rtol=1e-9, atol=1e-12, err_msg=f"n={n}, n1={len(column)}, values={values}")
+                checked += 1
+    print(f"p-values match scipy.stats.mannwhitneyu in {checked} tests")
+
+
+def run(file):
+    df = read_normalized(f'{path_normalized}/{file}', columns=['ID', column_target]).long()
+    df = df[[column_target, 'ID', 'Class']].drop_duplicates()
+
+    start = time.perf_counter()
+    df_dummies = pd.concat([df, pd.get_dummies(df['Class'])], axis=1)
+    df_loop = pd.DataFrame(df_mannwhitney(df_dummies, column_target))
+    time_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_batch = pd.DataFrame(df_mannwhitney_batch(df, column_target))
+    time_batch = time.perf_counter() - start
+
+    p_value_columns = ['P-Value - ts', 'P-Value - greater', 'P-Value - less']
+    same_tags = df_loop['Class'].equals(df_batch['Class'])
+    max_diff = np.abs(df_loop[p_value_columns].to_numpy() - df_batch[p_value_columns].to_numpy()).max()
+    same_classification = df_loop['Classification'].equals(df_batch['Classification'])
+    print(f"{file:<40} tags: {len(df_batch):>5}  loop: {time_loop:8.3f}s  batch: {time_batch:7.4f}s  "
+          f"speedup: {time_loop / time_batch:7.1f}x  same tags: {same_tags}  "
+          f"max p-value diff: {max_diff:.2e}  same classification: {same_classification}")
+
+
+if __name__ == "__main__":
+    check_parity()
+    for file in list_tables(path_normalized, '2. Normalized-'):
+        run(file)
@@ -0,0 +1,59 @@
+"""
+Compares the original pairwise overlap matrix (pandas loop) with the sparse backend.
+
+Run from the repository root:
+    python -m benchmarks.bench_overlap_matrix
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from clustering.overlap_clustering import (create_overlapping_matrix, create_overlapping_matrix_sparse,
+                                           overlap_metric1, overlap_metric2)
+
+
+path_normalized = 'outputs/normalize_posts'
+path_statistical = 'outputs/statistical_tests/classes'
+
+
+def load_dataset(name):
+    df_posts_tags = pd.read_csv(f'{path_normalized}/2. Normalized-{name}.csv')[['ID', 'Class']].drop_duplicates()
+    df_stats = pd.read_csv(f'{path_statistical}/4. Statistical_Test-{name}.csv')
+    df_stats = df_stats[df_stats['Classification'].isin(['greater', 'less'])].reset_index(drop=True)
+    df_stats = df_stats[['Class']].assign(**{'Increases Likes': df_stats['Classification'] == 'greater'})
+    return df_posts_tags, df_stats
+
+
+def run(name):
+    df_posts_tags, df_stats = load_dataset(name)
+    selected_tags = df_stats['Class']
+
+    for metric in (1, 2):
+        if metric == 1:
+            overlap_fn = overlap_metric1
+        else:
+            def overlap_fn(tagA, tagB, df):
+                return overlap_metric2(tagA, tagB, df, df_stats)
+
+        start = time.perf_counter()
+        df_loop = create_overlapping_matrix(df_posts_tags, selected_tags, overlap_fn)
+        time_loop = time.perf_counter() - start
+
+        start = time.perf_counter()
+        df_sparse = create_overlapping_matrix_sparse(df_posts_tags, selected_tags, metric, df_stats)
+        time_sparse = time.perf_counter() - start
+
+        identical = np.array_equal(df_loop.to_numpy(dtype=float), df_sparse.to_numpy())
+        print(f"{name:<22} metric {metric}  tags: {len(selected_tags):>4}  "
+              f"pandas: {time_loop:8.3f}s  sparse: {time_sparse:8.4f}s  "
+              f"speedup: {time_loop / time_sparse:8.1f}x  identical: {identical}")
+
+
+if __name__ == "__main__":
+    datasets = sorted(file.replace('2. Normalized-', '').replace('.csv', '')
+                      for file in os.listdir(path_normalized) if file.endswith('.csv'))
+    for name in datasets:
+        if os.path.isfile(f'{path_statistical}/4. Statistical_Test-{name}.csv'):
+            run(name)
@@ -0,0 +1,108 @@
+"""
+Peak memory and time of the old one-hot path (dense pd.get_dummies over the (post, tag) rows)
+against the sparse path used by the pipeline, for the two stages that encoded the tags:
+- statistical tests:    get_dummies + df_mannwhitney          vs  process_file (incidence matrix)
+- qualitative analysis: dense get_dummies_df + describe_class  vs  save_result_class
+
+The per-tag loop of df_mannwhitney takes seconds per tag (scipy computes the exact distribution for
+the small groups), so only its first 'dense_tags' tags are run and the time is extrapolated to all
+the tags. The dense matrix is always built in full.
+
+Each path runs in a new process and its peak resident memory is reported above the memory of a
+process that only imported the modules (it includes the numpy/pandas buffers and scipy's own state).
+
+Run from the repository root, after the p1 pipeline (needs the normalized posts and the statistical tests):
+    python -m benchmarks.bench_sparse_onehot [dataset ...]   (default: all the datasets)
+"""
+import contextlib
+import io
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from pipeline.star_schema import read_normalized
+from pipeline.storage import list_tables, read_table
+from qualitative_analysis.qualitative_analysis import describe_class, get_dummies_df, save_result_class
+from statistical_tests.statistical_tests import df_mannwhitney, process_file
+
+
+path_normalized = 'outputs/normalize_posts'
+path_statistical = 'outputs/statistical_tests/classes'
+column_target = 'Curtidas'
+dense_tags = 20
+
+
+def _measured(function, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(function, *args):
+    """ (result, seconds, peak resident memory in MB) of function(*args), run in a new process """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_measured, function, *args).result()
+
+
+def baseline():
+    return 1.0
+
+
+def dense_statistics(dataset, output):
+    """ Returns the extrapolation factor of the time (all tags / tags tested) """
+    df = read_normalized(f'{path_normalized}/2. Normalized-{dataset}', columns=['ID', column_target]).long()
+    df = df[[column_target, 'ID', 'Class']].drop_duplicates()
+    df = pd.concat([df, pd.get_dummies(df['Class'])], axis=1)
+    n_tags = len(df.columns) - 3
+    df_mannwhitney(df.iloc[:, :3 + dense_tags], column_target)
+    return n_tags / min(n_tags, dense_tags)
+
+
+def dense_qualitative(dataset, output):
+    df_class = read_table(f'{path_statistical}/4. Statistical_Test-{dataset}')
+    df_comp = read_normalized(f'{path_normalized}/2. Normalized-{dataset}', columns=['ID', column_target]).long()
+    df_comp = df_comp[df_comp['Class'].isin(df_class['Class'])]
+    df_class = df_class[df_class['Class'].isin(df_comp['Class'])]
+    describe_class(get_dummies_df(df_comp, sparse_columns=False), df_class, column_target)
+    return 1.0
+
+
+def sparse_statistics(dataset, output):
+    process_file(f'{path_normalized}/2. Normalized-{dataset}', output, column_target)
+    return 1.0
+
+
+def sparse_qualitative(dataset, output):
+    save_result_class(f'{path_statistical}/4. Statistical_Test-{dataset}',
+                      f'{path_normalized}/2. Normalized-{dataset}', f'{output}/6. Qualitative', column_target)
+    return 1.0
+
+
+def run(dataset, output, memory_base):
+    stages = [
+        ("statistical tests", dense_statistics, sparse_statistics),
+        ("qualitative analysis", dense_qualitative, sparse_qualitative),
+    ]
+    for title, dense, sparse in stages:
+        scale, time_dense, memory_dense = measure(dense, dataset, output)
+        _, time_sparse, memory_sparse = measure(sparse, dataset, output)
+        time_dense *= scale
+        print(f"{dataset:<22} {title:<21} dense: {time_dense:8.2f}s{'*' if scale > 1 else ' '} "
+              f"{memory_dense - memory_base:7.1f} MB   sparse: {time_sparse:7.3f}s {memory_sparse - memory_base:7.1f} MB   "
+              f"speedup: {time_dense / time_sparse:8.1f}x")
+
+
+if __name__ == "__main__":
+    datasets = sys.argv[1:] or [name.replace('2. Normalized-', '') for name in list_tables(path_normalized, '2. Normalized-')]
+    _, _, memory_base = measure(baseline)
+    print(f"Peak memory above the {memory_base:.0f} MB of a process with the modules loaded "
+          f"(* = time extrapolated from the first {dense_tags} tags)")
+    with tempfile.TemporaryDirectory() as output:
+        for dataset in datasets:
+            run(dataset, output, memory_base)
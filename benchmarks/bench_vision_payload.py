@@ -0,0 +1,68 @@
+"""
+Compares the bytes sent and the time per batch when the original image files are sent
+(as before) and when they are downscaled/re-encoded before submission (load_images).
+Uses the fake annotator, so no credentials or network are needed.
+
+Run from the repository root:
+    python -m benchmarks.bench_vision_payload [folder with .jpg files]
+
+Without a folder, synthetic phone-sized photos (4032x3024) are generated in a temporary folder.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from computer_vision.fake_vision import fake_annotator
+from computer_vision.submission import load_images, submit_batches, VISION_MAX_EDGE
+
+
+n_images = 40
+batch_size = 20
+latency = 0.2
+
+
+def synthetic_images(folder):
+    generator = np.random.default_rng(0)
+    y, x = np.mgrid[0:3024, 0:4032]
+    for i in range(n_images):
+        noise = generator.integers(0, 40, size=(3024, 4032, 3), dtype=np.uint8)
+        gradient = np.stack([(x + i * 50) % 256, (y + i * 30) % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+        Image.fromarray(gradient + noise).save(os.path.join(folder, f'{i}.jpg'), quality=95)
+
+
+def run(title, image_df, load):
+    tracemalloc.start()
+    start = time.perf_counter()
+    summary = submit_batches(
+        (image_df.iloc[i:i + batch_size] for i in range(0, len(image_df), batch_size)),
+        fake_annotator(latency=latency),
+        on_result=lambda results_df: None,
+        images_per_minute=None,
+        load=load,
+    )
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{title:<28} sent: {summary['bytes'] / 1024 ** 2:8.1f} MB  batches: {summary['batches']:3d}  "
+          f"time/batch: {np.mean(summary['batch_times']):6.2f}s  total: {elapsed:6.1f}s  "
+          f"peak python memory: {peak / 1024 ** 2:7.1f} MB")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as temporary:
+        folder = sys.argv[1] if len(sys.argv) > 1 else temporary
+        if len(sys.argv) <= 1:
+            print(f"Generating {n_images} synthetic photos...")
+            synthetic_images(folder)
+        files = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.jpg'))
+        image_df = pd.DataFrame({'ID': [str(i) for i in range(len(files))], 'File': files})
+
+        run("original files", image_df, partial(load_images, max_edge=None))
+        run(f"downscaled (max {VISION_MAX_EDGE}px)", image_df, load_images)
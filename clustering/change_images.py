@@ -1,42 +1,75 @@
 
+import numpy as np
 import pandas as pd
 import shutil
 import os
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from pipeline.star_schema import NormalizedPosts, read_normalized
+from pipeline.storage import read_table, save_table
+
+# Como as imagens de amostra são gravadas nas pastas dos clusters:
+# "copy" (cópia), "hardlink" (sem ocupar espaço; copia se a pasta de saída estiver em outro disco) ou "symlink"
+LINK_MODE = "copy"
+# Threads que copiam/ligam as imagens ao mesmo tempo
+COPY_THREADS = 8
 
 def search_path_mapping(perfil: str="Full") -> pd.DataFrame:
   """ Digits "Full" to all """
-  list_dir = os.listdir("outputs/mapping")
+  # Só os arquivos de mapeamento (a pasta também tem os índices das pastas de imagens e os grupos de duplicatas)
+  list_dir = [path for path in os.listdir("outputs/mapping") if path.startswith("1. Mapping-File-id-") and path.endswith(".csv")]
   if (perfil.title() != "Full"):
     list_dir = list(filter(lambda path: path.lower().find(perfil.lower()) >= 0, list_dir))
-  df = pd.DataFrame()
-  for path in list_dir:
-    df = pd.concat([df, pd.read_csv(f"outputs/mapping/{path}")])
+  frames = [pd.read_csv(f"outputs/mapping/{path}", dtype={'ID': str}) for path in list_dir]
+  df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['ID', 'File'])
   df["ID"] = df["ID"].apply(str)
   return df
 
 
+def load_mapping(perfil: str="Full") -> Dict[str, str]:
+  """ Dicionário ID do post -> caminho da imagem (a primeira imagem de cada ID) """
+  df = search_path_mapping(perfil).drop_duplicates("ID")
+  return dict(zip(df["ID"], df["File"]))
+
+
+def place_image(source: str, destination: str, link: str = LINK_MODE) -> None:
+  """ Grava 'source' em 'destination' como cópia, hard link ou link simbólico (ver LINK_MODE) """
+  if link != "copy" and os.path.lexists(destination):
+    os.remove(destination)
+  if link == "symlink":
+    os.symlink(os.path.abspath(source), destination)
+    return
+  if link == "hardlink":
+    try:
+      os.link(source, destination)
+      return
+    except OSError:
+      # outro disco/sistema de arquivos sem hard links: copia
+      pass
+  shutil.copyfile(source, destination)
+
+
 def copy_images_to_cluster_folders(
   n: int, path_input_clustering: str, path_input_normalized: str, output_folder: str,
-  column_name: str, path_output: str, names: List[str] = None, perfil: str=None
+  column_name: str, path_output: str, names: List[str] = None, perfil: str=None,
+  mapping: Dict[str, str] = None, link: str = LINK_MODE, threads: int = COPY_THREADS,
   ) -> None :
-  
-  if perfil == None:
-    mapping_df = search_path_mapping()
-  else:
-    mapping_df = search_path_mapping(perfil)
-  
-  if (path_input_normalized.endswith(".xlsx")):
-    posts_tags = pd.read_excel(path_input_normalized)
-  else:
-    posts_tags = pd.read_csv(path_input_normalized)
-    
-  posts_tags["ID"] = posts_tags["ID"].apply(str)
-  
-  if (path_input_clustering.endswith('.xlsx')):
-    df = pd.read_excel(path_input_clustering)
-  else:
-    df = pd.read_csv(path_input_clustering)
+  """
+    Grava até n imagens de amostra de cada cluster em '<path_output>/<output_folder>/<nome do cluster>',
+    com a tabela das tags dos posts sorteados.
+    mapping: dicionário ID -> imagem (load_mapping); se não for informado, é montado a partir de outputs/mapping.
+             Passe o mesmo dicionário para todos os arquivos de cluster, para ler os mapeamentos uma vez só.
+    link: "copy", "hardlink" ou "symlink" (ver LINK_MODE)
+    threads: cópias feitas ao mesmo tempo
+  """
+  if mapping is None:
+    mapping = load_mapping() if perfil == None else load_mapping(perfil)
+
+  normalized = read_normalized(path_input_normalized)
+  post_ids = normalized.posts["ID"].astype(str).to_numpy()
+
+  df = read_table(path_input_clustering)
 
   output = f"{path_output}/{output_folder}"
 
@@ -45,34 +78,34 @@ def copy_images_to_cluster_folders(
   elif (len(names) < len(df[column_name].unique())):
     print("Number of incompatible clustering names")
     return False
-  
-  for index, cluster in enumerate(df[column_name].unique()):
-    qtn = n
-    output_cluster = f"{output}/{names[index]}"
-    # Cria o diretório de saída para o cluster, incluindo os pais, se necessário.
-    os.makedirs(output_cluster, exist_ok=True)
-
-    aux_df = posts_tags.loc[posts_tags["Class"].isin(df.loc[df[column_name] == cluster]["Class"])]
-    
-    if (qtn > aux_df.drop_duplicates("ID")["ID"].shape[0]):
-      qtn = aux_df.drop_duplicates("ID")["ID"].shape[0]
-    
-    result = pd.DataFrame(columns=aux_df.columns)
-    while (result['ID'].shape[0] < qtn):
-      n_retiradas = qtn - result['ID'].shape[0]
-      if (result.empty):
-        result = aux_df.sample(n_retiradas, random_state=1).copy()
-      else:
-        result = pd.concat([result, aux_df.sample(n_retiradas)])
-        
-      result.drop_duplicates('ID', inplace=True)
-      
-    for post_id in result["ID"]:
-      path_series = mapping_df.loc[mapping_df["ID"] == post_id]["File"]
-      if not path_series.empty:
-        image_path = path_series.values[0]
-        shutil.copyfile(image_path, f"{output_cluster}/{post_id}.jpg")
-      else:
-        print(f"AVISO: Imagem para o Post ID '{post_id}' não encontrada no mapeamento. Pulando a cópia.")
-    posts_tags.loc[posts_tags["ID"].isin(result["ID"])].to_csv(f"{output_cluster}/{cluster}.csv")
-    posts_tags.loc[posts_tags["ID"].isin(result["ID"])].to_excel(f"{output_cluster}/{cluster}.xlsx")
\ No newline at end of file
+
+  copies = []
+  with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+    for index, cluster in enumerate(df[column_name].unique()):
+      output_cluster = f"{output}/{names[index]}"
+      # Cria o diretório de saída para o cluster, incluindo os pais, se necessário.
+      os.makedirs(output_cluster, exist_ok=True)
+
+      # Posts com pelo menos uma tag do cluster (sem repetição), sorteados de uma vez
+      codes = normalized.encode(df.loc[df[column_name] == cluster]["Class"])
+      posts = np.unique(normalized.post_idx[np.isin(normalized.tag_idx, codes[codes >= 0])])
+      sample = pd.Series(posts).sample(min(n, len(posts)), random_state=1).to_numpy()
+
+      for post_id in post_ids[sample]:
+        image_path = mapping.get(post_id)
+        if image_path is not None:
+          extension = os.path.splitext(image_path)[1].lower() or ".jpg"
+          copies.append(executor.submit(place_image, image_path, f"{output_cluster}/{post_id}{extension}", link))
+        else:
+          print(f"AVISO: Imagem para o Post ID '{post_id}' não encontrada no mapeamento. Pulando a cópia.")
+
+      keep = np.isin(normalized.post_idx, sample)
+      sampled = NormalizedPosts(normalized.posts, normalized.post_idx[keep], normalized.tag_idx[keep], normalized.tags).long()
+      sampled["ID"] = sampled["ID"].astype(str)
+      save_table(sampled, f"{output_cluster}/{cluster}")
+
+    for future in copies:
+      try:
+        future.result()
+      except OSError as e:
+        print(f"AVISO: Não foi possível gravar a imagem de amostra: {e}")
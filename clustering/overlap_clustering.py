@@ -1,25 +1,42 @@
 import os
-
-# Set this environment variable to avoid a specific warning when running K-Means
-os.environ["OMP_NUM_THREADS"] = "1"
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 from matplotlib import pyplot as plt
 import numpy as np
-
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
+from scipy import sparse
+
+from scipy.cluster.hierarchy import cut_tree, linkage
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import squareform
+from sklearn.cluster import HDBSCAN, KMeans
+from sklearn.manifold import spectral_embedding
+from sklearn.metrics import pairwise_distances, silhouette_score
+from threadpoolctl import threadpool_limits
 from tqdm import tqdm
 
+from pipeline.parallel import run_parallel
+from pipeline.star_schema import read_normalized
+from pipeline.storage import list_tables, read_table, save_table, strip_extension
+
 
 # Seed used by the K-Means algorithm
 RAND_STATE = 11
 
+# K-Means restarts of the cluster size sweep and of the final clusterings (of the best sizes)
+SWEEP_REPETITIONS = 20
+FINAL_REPETITIONS = 100
+# Number of processes used to fit the cluster sizes of one dataset in parallel (1 = serial, None = all cores).
+# Each process fits with a single thread; the serial sweep lets K-Means use all the cores.
+SWEEP_WORKERS = 1
+
 
 # The constants below are for experimental features or for debugging
 OVERLAP_METRIC         = 1      # Tag overlap metric to be used. Options: 1 (default) or 2 (alternative)
 WEIGHTED_CLUSTERS      = False  # If True, clusterings will be calculated using weights proportional to the number of posts associated to each tag
 GENERATE_INERTIA_PLOTS = False  # If True, generates the plots for inertia scores (beyond the plots for silhoutte scores)
+OVERLAP_BACKEND        = "sparse"  # How the overlap matrix is computed. Options: "sparse" (default) or "pandas" (original pairwise loop)
+CLUSTERING_BACKEND     = "kmeans"  # How the tags are clustered. Options: "kmeans" (default), "spectral", "agglomerative" or "hdbscan" (see CLUSTERING_BACKENDS)
 
 
 
@@ -31,8 +48,8 @@ def clusterize_tags(file_tags_stats,
                     top_n_clusterings=3):
     '''
     Parameters:
-    - file_tags_stats:    CSV or XLS file with the results of the statistical tests per tag
-    - tags_per_post_file: CSV or XLS file with the tags associated with each post
+    - file_tags_stats:    table (see pipeline.storage) with the results of the statistical tests per tag
+    - tags_per_post_file: table with the tags associated with each post
     - output_dir:         directory where the output files will be saved
     - out_file_base_name: base name for files written by this function
     - cluster_size_range: range of cluster sizes to be explored
@@ -42,20 +59,16 @@ def clusterize_tags(file_tags_stats,
     print(f"####### File '{file_tags_stats}' #######\n")
 
     # (1) LOADS THE DATA
-    if file_tags_per_post.endswith('.xlsx'):
-        df_posts_tags = pd.read_excel(file_tags_per_post)
-    else:
-        df_posts_tags = pd.read_csv(file_tags_per_post)
-
-    if file_tags_stats.endswith('.xlsx'):
-        df_all_tags_stats = pd.read_excel(file_tags_stats)
-    else:
-        df_all_tags_stats = pd.read_csv(file_tags_stats)
+    # tags are handled by their integer codes (tag_idx) up to the output file, where the names are decoded
+    normalized = read_normalized(file_tags_per_post, columns=[])
+    df_posts_tags = pd.DataFrame({'ID': normalized.post_idx, 'Class': normalized.tag_idx})
+    df_all_tags_stats = read_table(file_tags_stats)
+    df_all_tags_stats['Class'] = normalized.encode(df_all_tags_stats['Class'])
 
     # creates the directory for plot images and defines the template for their file names
     plot_output_dir = f'{output_dir}/clustering_scores_plots'
     os.makedirs(plot_output_dir, exist_ok=True)
-    out_file_base_name = out_file_base_name[0:out_file_base_name.rfind(".")] # remove extension
+    out_file_base_name = strip_extension(out_file_base_name) # remove extension
     
     plot_filepath_template = f"{plot_output_dir}/##PLOTNAME##-{out_file_base_name}-##CLUSTERING##.png"
 
@@ -83,7 +96,9 @@ def clusterize_tags(file_tags_stats,
 
     # (3) CRIA A MATRIZ DE OVERLAPPING
     print(f"- Calculating overlappings with metric {OVERLAP_METRIC}...")
-    if OVERLAP_METRIC == 1:
+    if OVERLAP_BACKEND == "sparse":
+        df_tag_overlapping = create_overlapping_matrix_sparse(df_posts_tags, selected_tags, OVERLAP_METRIC, df_output_tags_stats)
+    elif OVERLAP_METRIC == 1:
         df_tag_overlapping = create_overlapping_matrix(df_posts_tags, selected_tags, overlap_metric1)
     else:
         # adapts the function overlap_metric2 to be used with create_overlapping_matrix
@@ -104,7 +119,8 @@ def clusterize_tags(file_tags_stats,
     
     df_tags_to_clusters, best_sizes = kmeans_clusterize(df_tag_overlapping, "Clustering Size ", 
                                                          cluster_size_range, top_n_clusterings,
-                                                         plot_filepath_template, weights=df_weights)
+                                                         plot_filepath_template, weights=df_weights, workers=SWEEP_WORKERS,
+                                                         backend=CLUSTERING_BACKEND)
     df_output_tags_stats = df_output_tags_stats.merge(df_tags_to_clusters, on='Class')
     
     # (5) CONTA AS QUANTIDADES DE POSTS DE CADA CLUSTER
@@ -126,17 +142,46 @@ def clusterize_tags(file_tags_stats,
     df_output_tags_stats = df_output_tags_stats.sort_values(by=columns_to_sort_by).reset_index(drop=True)
     
     # (7) SALVA ARQUIVOS DE SAÍDA
+    df_output_tags_stats['Class'] = normalized.tags[df_output_tags_stats['Class'].to_numpy()]
+    return save_table(df_output_tags_stats, clustering_table(output_dir, out_file_base_name))
+
+
+def clustering_table(output_dir, out_file_base_name):
+    '''
+    Output table of clusterize_tags() for a dataset (without extension); the name depends on
+    OVERLAP_METRIC and WEIGHTED_CLUSTERS.
+    '''
     if OVERLAP_METRIC == 1 and WEIGHTED_CLUSTERS == False:
-        out_file = f'5. Clusterings-{out_file_base_name}.csv'
+        out_file = f'5. Clusterings-{out_file_base_name}'
     elif WEIGHTED_CLUSTERS:
-        out_file = f'5. Clusterings-{out_file_base_name}-metric{OVERLAP_METRIC}-weighted.csv'
+        out_file = f'5. Clusterings-{out_file_base_name}-metric{OVERLAP_METRIC}-weighted'
     else:
-        out_file = f'5. Clusterings-{out_file_base_name}-metric{OVERLAP_METRIC}-unweighted.csv'
-    
-    df_output_tags_stats.to_csv(f'{output_dir}/{out_file}', index=False)
-    
-    out_file = out_file.replace('.csv', '.xlsx')
-    df_output_tags_stats.to_excel(f'{output_dir}/{out_file}', index=False)
+        out_file = f'5. Clusterings-{out_file_base_name}-metric{OVERLAP_METRIC}-unweighted'
+    return f'{output_dir}/{out_file}'
+
+
+def clusterize_tags_files(path_statistical, path_normalized, output_dir, cluster_size_range=range(3, 10+1),
+                          top_n_clusterings=3, workers=1, datasets=None):
+    '''
+    Runs clusterize_tags() for every '4. Statistical_Test-*' table in path_statistical,
+    paired with the '2. Normalized-*' file of the same dataset in path_normalized.
+    - workers:  number of processes to clusterize the datasets in parallel (None = all cores)
+    - datasets: if given, only these datasets are clusterized (e.g. ['full', 'facebook-lula'])
+    '''
+    paths_statisticals = [ path.replace("4. Statistical_Test-", "") for path in list_tables(path_statistical, "4. Statistical_Test-")]
+    if datasets is not None:
+        paths_statisticals = [ path for path in paths_statisticals if path in datasets ]
+
+    jobs = {}
+    for file in paths_statisticals:
+        jobs[file] = dict(file_tags_stats=f"{path_statistical}/4. Statistical_Test-{file}",
+                          file_tags_per_post=f"{path_normalized}/2. Normalized-{file}",
+                          output_dir=output_dir,
+                          out_file_base_name=file,
+                          cluster_size_range=cluster_size_range,
+                          top_n_clusterings=top_n_clusterings)
+
+    return run_parallel(clusterize_tags, jobs, workers, title='Clustering')
 
 
 def overlap_metric1(tagA, tagB, df):
@@ -193,89 +238,288 @@ def create_overlapping_matrix(df_posts_tags, selected_tags, overlap_fn):
     return df_tag_overlapping
 
 
+def build_incidence_matrix(df_posts_tags, tags):
+    """
+    Builds a sparse (posts x tags) 0/1 matrix from the 'ID'/'Class' pairs of df_posts_tags.
+    Rows cover every post in the dataframe (also the ones without any of the given tags),
+    and columns follow the order of 'tags'. Returns the matrix and the post IDs of the rows.
+    """
+    df_pairs = df_posts_tags[['ID', 'Class']].drop_duplicates()
+    post_codes, post_ids = pd.factorize(df_pairs['ID'])
+    tag_codes = pd.Index(tags).get_indexer(df_pairs['Class'])
+
+    in_tags = tag_codes >= 0
+    data = np.ones(in_tags.sum(), dtype=np.int64)
+    incidence = sparse.csr_matrix((data, (post_codes[in_tags], tag_codes[in_tags])),
+                                  shape=(len(post_ids), len(tags)))
+    return incidence, post_ids
+
+
+def create_overlapping_matrix_sparse(df_posts_tags, selected_tags, metric=1, df_statistical_test=None):
+    """
+    Same result as create_overlapping_matrix() with overlap_metric1 or overlap_metric2, but all
+    pairwise intersections come from a single sparse product of the incidence matrix.
+    Cell [tagA, tagB] holds |A & B| / |B|, where A and B are the sets of posts of each tag
+    (for metric 2, the complement set is used for tags that decrease likes).
+    """
+    incidence, post_ids = build_incidence_matrix(df_posts_tags, selected_tags)
+    intersections = (incidence.T @ incidence).toarray()     # |A & B| for every pair of tags
+    tag_sizes = np.diag(intersections).copy()              # |A|
+
+    if metric == 1:
+        set_intersections = intersections
+        set_sizes = tag_sizes
+    else:
+        # each set is written as 'offset + sign * incidence', i.e. the tag posts (0 + 1*x)
+        # or its complement among all posts (1 - 1*x), so the intersections expand to:
+        # |S_A & S_B| = N*o_A*o_B + o_A*s_B*|B| + o_B*s_A*|A| + s_A*s_B*|A & B|
+        increases = df_statistical_test.set_index('Class').loc[selected_tags, 'Increases Likes'].to_numpy(dtype=bool)
+        offset = np.where(increases, 0, 1)
+        sign = np.where(increases, 1, -1)
+        n_posts = len(post_ids)
+
+        set_intersections = (n_posts * np.outer(offset, offset)
+                             + np.outer(offset, sign * tag_sizes)
+                             + np.outer(sign * tag_sizes, offset)
+                             + np.outer(sign, sign) * intersections)
+        set_sizes = offset * n_posts + sign * tag_sizes
+
+    # empty sets (e.g. the complement of a "decreases likes" tag present in every post) get 0 instead of inf/nan
+    empty = set_sizes == 0
+    if empty.any():
+        print(f"- WARNING: {empty.sum()} tags with an empty post set get zero overlaps:",
+              list(np.asarray(selected_tags)[empty]))
+    overlapping = np.divide(set_intersections, set_sizes[np.newaxis, :],
+                            out=np.zeros(set_intersections.shape, dtype=np.float64),
+                            where=~empty[np.newaxis, :])
+    return pd.DataFrame(overlapping, columns=pd.Index(selected_tags), index=pd.Index(selected_tags))
+
+
 def align_clusterings(df_selected_tags_stats, clustering1_col, clustering2_col):
     """
     This function aligns the labels of 'clustering2' with those of 'clustering1'. 
-    It does so by replacing each label in 'clustering2' with the label of the cluster in 'clustering1' 
-    that has the maximum intersection. This is done without repeating a label from 'clustering1'. 
+    Each cluster of 'clustering2' gets the label of a cluster of 'clustering1', chosen by an optimal assignment
+    (Hungarian algorithm) that maximizes the total number of tags shared by the matched clusters, without
+    repeating a label from 'clustering1'. Clusters of 'clustering2' left without a match (or sharing no tag
+    with their match) get new labels, in decreasing order of size.
     Note that 'clustering1' remains unmodified during this process.
     """
-    def cluster_to_letter(cluster):
-        return chr(cluster + 65)
-    df_selected_tags_stats[clustering2_col] = df_selected_tags_stats[clustering2_col].apply(cluster_to_letter)
-
-    available_cluster1_ids = df_selected_tags_stats[clustering1_col].sort_values().unique().tolist()
-    next_unused_cluster_id = df_selected_tags_stats[clustering1_col].max() + 1
-
-    # analisa clusters do clustering2 por ordem decrescente de quantidade de tags
-    for c2 in df_selected_tags_stats[clustering2_col].value_counts().index: 
-        set_cluster_2 = df_selected_tags_stats[df_selected_tags_stats[clustering2_col] == c2]['Class']
-        max_intersection = 0
-        max_intersection_cluster_1 = -1
-        for c1 in available_cluster1_ids:
-            set_cluster_1 = df_selected_tags_stats[df_selected_tags_stats[clustering1_col] == c1]['Class']
-            set_intersection = np.intersect1d(set_cluster_1, set_cluster_2)
-            if len(set_intersection) > max_intersection:
-                max_intersection = len(set_intersection)
-                max_intersection_cluster_1 = c1
-        if max_intersection > 0:
-            df_selected_tags_stats.loc[:, clustering2_col].replace(c2, max_intersection_cluster_1, inplace=True)
-            # remove o cluster 1 da lista de clusters disponíveis
-            available_cluster1_ids.remove(max_intersection_cluster_1)
-        else:
-            df_selected_tags_stats.loc[:, clustering2_col].replace(c2, next_unused_cluster_id, inplace=True)
-            next_unused_cluster_id += 1
+    labels1, clusters1 = pd.factorize(df_selected_tags_stats[clustering1_col], sort=True)
+    labels2, clusters2 = pd.factorize(df_selected_tags_stats[clustering2_col], sort=True)
 
+    # contingency matrix: tags shared by each (cluster 2, cluster 1) pair
+    contingency = np.bincount(labels2 * len(clusters1) + labels1, minlength=len(clusters2) * len(clusters1))
+    contingency = contingency.reshape(len(clusters2), len(clusters1))
+    rows, columns = linear_sum_assignment(contingency, maximize=True)
+    matched = contingency[rows, columns] > 0
+
+    mapping = np.full(len(clusters2), -1, dtype=np.int64)
+    mapping[rows[matched]] = np.asarray(clusters1)[columns[matched]]
+
+    # clusters without a match, from the largest to the smallest
+    sizes = np.bincount(labels2, minlength=len(clusters2))
+    unmatched = np.flatnonzero(mapping < 0)
+    unmatched = unmatched[np.argsort(-sizes[unmatched], kind='stable')]
+    mapping[unmatched] = df_selected_tags_stats[clustering1_col].max() + 1 + np.arange(len(unmatched))
+
+    df_selected_tags_stats[clustering2_col] = mapping[labels2]
     return df_selected_tags_stats
 
 
-def kmeans_clusterize(df_tag_overlapping, clustering_label_prefix, cluster_size_range, top_n_clusters, plot_filepath_template, weights=None):
-    inertia_values = []
-    silhouette_scores = []
+def _fit_size(data, size, threads=None):
+    """
+    K-Means with 'size' clusters (SWEEP_REPETITIONS restarts, seeded with RAND_STATE).
+    threads: limit of threads of K-Means (None = no limit)
+    """
+    with threadpool_limits(limits=threads):
+        return KMeans(n_clusters=size, n_init=SWEEP_REPETITIONS, random_state=np.random.RandomState(RAND_STATE)).fit(data)
+
+
+def _same_partition(labels1, labels2):
+    """ True if both labelings split the rows in the same groups (up to the label names) """
+    pairs = len(np.unique(np.column_stack([labels1, labels2]), axis=0))
+    return pairs == len(np.unique(labels1)) == len(np.unique(labels2))
+
+
+def final_clustering(data, sweep_model, repetitions=FINAL_REPETITIONS):
+    """
+    K-Means with 'repetitions' restarts seeded with RAND_STATE, warm started from the sweep model of the same size.
+
+    The sweep model already holds the best of the first SWEEP_REPETITIONS restarts of that seed (its random state
+    was left right after them), so only the remaining restarts are fitted, continuing the same random sequence.
+    The result is the same as KMeans(n_init=repetitions, random_state=RAND_STATE), with the same rule to keep
+    the best restart (lower inertia and a different partition).
+    """
+    remaining = repetitions - sweep_model.n_init
+    if remaining <= 0:
+        return sweep_model
+    model = KMeans(n_clusters=sweep_model.n_clusters, n_init=remaining, random_state=sweep_model.random_state).fit(data)
+    if model.inertia_ < sweep_model.inertia_ and not _same_partition(model.labels_, sweep_model.labels_):
+        return model
+    return sweep_model
+
+
+# Clustering backends. Each one receives the overlap matrix rows ('data'), the Euclidean distances between them,
+# the cluster sizes to explore and the number of processes, and returns a ClusteringSweep.
+class ClusteringSweep:
+    """
+    Clusterings found by a backend, by number of clusters.
+    - labels:  size -> labels of the tags (one per row of the overlap matrix)
+    - inertia: size -> K-Means inertia (only for the 'kmeans' backend, for the inertia plots)
+    - refit:   function size -> final labels of a chosen size (default: the sweep labels)
+    """
+
+    def __init__(self, labels, inertia=None, refit=None):
+        self.labels = labels
+        self.inertia = inertia
+        self.refit = refit or (lambda size: self.labels[size])
+
+
+def kmeans_sweep(data, distances, cluster_size_range, workers=1):
+    """ K-Means over the rows of the overlap matrix, one fit per size; the best sizes are refitted (final_clustering) """
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(cluster_size_range)))
+    if workers == 1:
+        models = [_fit_size(data, size) for size in tqdm(cluster_size_range)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_fit_size, data, size, 1) for size in cluster_size_range]
+            models = [future.result() for future in tqdm(futures)]
+    models = dict(zip(cluster_size_range, models))
+    return ClusteringSweep(
+        labels={size: model.labels_ for size, model in models.items()},
+        inertia={size: model.inertia_ for size, model in models.items()},
+        refit=lambda size: final_clustering(data, models[size]).labels_,
+    )
+
+
+def overlap_affinity(data):
+    """ Symmetric affinity between the tags: the mean of the overlaps A->B and B->A (the matrix itself is not symmetric) """
+    return (data + data.T) / 2
+
 
+def spectral_sweep(data, distances, cluster_size_range, workers=1):
+    """
+    Spectral clustering on the symmetrized overlap affinity. The spectral embedding is computed once, with as many
+    eigenvectors as the largest size; each size runs K-Means on its first 'size' eigenvectors (as SpectralClustering does).
+    """
+    maps = spectral_embedding(overlap_affinity(data), n_components=max(cluster_size_range), drop_first=False,
+                              random_state=RAND_STATE)
+    labels = {}
+    for size in tqdm(cluster_size_range):
+        labels[size] = KMeans(n_clusters=size, n_init=SWEEP_REPETITIONS, random_state=RAND_STATE).fit(maps[:, :size]).labels_
+    return ClusteringSweep(labels)
+
+
+def agglomerative_sweep(data, distances, cluster_size_range, workers=1):
+    """
+    Average-linkage agglomerative clustering on the distance 1 - affinity. A single dendrogram is built
+    and cut at every size, instead of one fit per size.
+    """
+    dissimilarity = 1 - overlap_affinity(data)
+    np.fill_diagonal(dissimilarity, 0)
+    tree = linkage(squareform(np.clip(dissimilarity, 0, None), checks=False), method='average')
+    cuts = cut_tree(tree, n_clusters=list(cluster_size_range))
+    return ClusteringSweep({size: cuts[:, i] for i, size in enumerate(cluster_size_range)})
+
+
+def hdbscan_sweep(data, distances, cluster_size_range, workers=1):
+    """
+    HDBSCAN on the distance 1 - affinity. HDBSCAN chooses the number of clusters by itself, so it is run for
+    increasing min_cluster_size values (from 2 up to half of the tags), and the first clustering found for each
+    size in 'cluster_size_range' is kept. Larger values give fewer clusters, so the sweep stops as soon as every
+    size was found or the number of clusters falls below the smallest size. Tags left as noise join the cluster
+    of their nearest clustered tag.
+    """
+    dissimilarity = 1 - overlap_affinity(data)
+    np.fill_diagonal(dissimilarity, 0)
+    dissimilarity = np.clip(dissimilarity, 0, None)
+
+    labels = {}
+    for min_cluster_size in tqdm(range(2, max(2, len(data) // 2) + 1)):
+        found = HDBSCAN(min_cluster_size=min_cluster_size, metric='precomputed').fit(dissimilarity).labels_
+        noise = found < 0
+        if noise.all():
+            # no cluster at all: larger values will not find any either
+            break
+        if noise.any():
+            nearest = np.flatnonzero(~noise)[np.argmin(dissimilarity[np.ix_(noise, ~noise)], axis=1)]
+            found = found.copy()
+            found[noise] = found[nearest]
+        size = len(np.unique(found))
+        if size in cluster_size_range and size not in labels:
+            labels[size] = found
+        if size < min(cluster_size_range) or len(labels) == len(cluster_size_range):
+            break
+    return ClusteringSweep(labels)
+
+
+CLUSTERING_BACKENDS = {
+    "kmeans": kmeans_sweep,
+    "spectral": spectral_sweep,
+    "agglomerative": agglomerative_sweep,
+    "hdbscan": hdbscan_sweep,
+}
+
+
+def kmeans_clusterize(df_tag_overlapping, clustering_label_prefix, cluster_size_range, top_n_clusters, plot_filepath_template, weights=None,
+                      workers=1, backend="kmeans"):
+    """
+    Clusters the tags for every cluster size from 2 up to the range maximum with the given backend
+    (see CLUSTERING_BACKENDS; 'kmeans' fits in 'workers' processes, None = all cores) and keeps the
+    'top_n_clusters' sizes with the best silhouette scores (K-Means refits them with FINAL_REPETITIONS restarts).
+    The silhouette scores of all the backends use the Euclidean distances between the rows of the overlap
+    matrix, computed once.
+    """
     if weights is not None:
+        # the other backends read the matrix as an affinity in [0, 1], which the weights would break
+        if backend != "kmeans":
+            raise ValueError(f"Weighted clusters (WEIGHTED_CLUSTERS) are only supported by the 'kmeans' backend, not '{backend}'")
         df_tag_overlapping = df_tag_overlapping.mul(weights, axis=1)
 
     # to avoid the case where the number of clusters is greater than the number of tags
     cluster_max_size = min(max(cluster_size_range), len(df_tag_overlapping)-1)
     cluster_size_range = range(2, cluster_max_size+1)
 
-    print(f"- Exploring clustering sizes in {cluster_size_range}")
-    for size in tqdm(cluster_size_range):
-        kmeans = KMeans(n_clusters=size, n_init=20, random_state=RAND_STATE).fit(df_tag_overlapping)
-        inertia_values.append(kmeans.inertia_)
-        labels = kmeans.labels_
-        silhouette_avg = silhouette_score(df_tag_overlapping, labels)
-        silhouette_scores.append(silhouette_avg)
-        #print(f"  - cluster size: {size}, inertia: {kmeans.inertia_}, silhouette: {silhouette_avg}")
+    data = df_tag_overlapping.to_numpy(dtype=np.float64)
+    distances = pairwise_distances(data)
+
+    print(f"- Exploring clustering sizes in {cluster_size_range} ({backend})")
+    sweep = CLUSTERING_BACKENDS[backend](data, distances, cluster_size_range, workers)
+    cluster_sizes = sorted(sweep.labels)
+    if not cluster_sizes:
+        raise ValueError(f"The '{backend}' backend found no clustering with sizes in {cluster_size_range}")
+    silhouette_scores = [silhouette_score(distances, sweep.labels[size], metric='precomputed') for size in cluster_sizes]
     print()
 
-    if GENERATE_INERTIA_PLOTS:
+    plot_clustering = f"m{OVERLAP_METRIC}{'w' if WEIGHTED_CLUSTERS else ''}{'' if backend == 'kmeans' else '-' + backend}"
+    if GENERATE_INERTIA_PLOTS and sweep.inertia is not None:
         # plot the graph of cluster size vs. intertia
         plt.figure()
         plt.title('KMeans - Number fo clusters x Inertia')
-        plt.plot(cluster_size_range, inertia_values, '-o')
+        plt.plot(cluster_sizes, [sweep.inertia[size] for size in cluster_sizes], '-o')
         plt.xlabel('Cluster Size')
         plt.ylabel('Inertia')
-        plt.xticks(range(min(cluster_size_range), max(cluster_size_range)+1, 2))
-        out_filepath = plot_filepath_template.replace("##CLUSTERING##", f"m{OVERLAP_METRIC}{'w' if WEIGHTED_CLUSTERS else ''}") \
+        plt.xticks(range(min(cluster_sizes), max(cluster_sizes)+1, 2))
+        out_filepath = plot_filepath_template.replace("##CLUSTERING##", plot_clustering) \
                                                  .replace("##PLOTNAME##", "InertiaValues")
         plt.savefig(out_filepath)
 
     # plot the graph of cluster size vs. silhouette scores (bestter than intertia for choosing the number of clusters)
     plt.figure()
     plt.title(f'Number of Clusters x Silhouette Score')
-    plt.plot(cluster_size_range, silhouette_scores, '-x', label='Silhouette')
+    plt.plot(cluster_sizes, silhouette_scores, '-x', label='Silhouette')
     plt.xlabel('Cluster Size')
     plt.ylabel('Silhouette')
-    plt.xticks(range(min(cluster_size_range), max(cluster_size_range)+1, 2))
-    out_filepath = plot_filepath_template.replace("##CLUSTERING##", f"m{OVERLAP_METRIC}{'w' if WEIGHTED_CLUSTERS else ''}") \
+    plt.xticks(range(min(cluster_sizes), max(cluster_sizes)+1, 2))
+    out_filepath = plot_filepath_template.replace("##CLUSTERING##", plot_clustering) \
                                             .replace("##PLOTNAME##", "SilhouetteScore")
     plt.savefig(out_filepath)
 
     # creates clusterings with the best cluster sizes (by silhouette score)
     best_indexes = np.argsort(silhouette_scores)[::-1][:top_n_clusters]
-    best_cluster_sizes = np.array(cluster_size_range)[best_indexes]
+    best_cluster_sizes = np.array(cluster_sizes)[best_indexes]
     print("- Best cluster sizes are", best_cluster_sizes, "\n")
 
     df_tags_to_clusters = pd.DataFrame(columns=['Class'])
@@ -284,9 +528,7 @@ def kmeans_clusterize(df_tag_overlapping, clustering_label_prefix, cluster_size_
     for cluster_size in best_cluster_sizes:
         clustering_label = clustering_label_prefix + str(cluster_size)
         print(f"- Creating '{clustering_label}' with {cluster_size} clusters\n")
-        REPETITIONS = 100
-        best_model = KMeans(n_clusters=cluster_size, n_init=REPETITIONS).fit(df_tag_overlapping)
-        df_tags_to_clusters[clustering_label] = best_model.labels_   # labels dos clusters, ordenados pelas linhas do df_tag_overlapping
+        df_tags_to_clusters[clustering_label] = sweep.refit(cluster_size)   # labels dos clusters, ordenados pelas linhas do df_tag_overlapping
 
     return df_tags_to_clusters, best_cluster_sizes
 
@@ -310,12 +552,5 @@ if __name__ == "__main__":
     # Cria várias opções de clusterizações das tags com diferentes quantidades de "grupos"
     # São escolhidas as "top_n_clusterings" quantidades de maior sillhouette score
     # Também são geradas arquivos dos gráficos dos sillhouette scores para cada quantidade de grupos considerada
-    paths_statisticals = os.listdir(path_results_statistical)
-    paths_statisticals = [ path.replace("4. Statistical_Test-", "") for path in filter(lambda path: path.find(".csv") >= 0, paths_statisticals)]
-
-    for file in paths_statisticals:
-        clusterize_tags(f"{outputPath}/statistical_tests/classes/4. Statistical_Test-{file}", 
-                        f"{outputPath}/normalize_posts/2. Normalized-{file}",
-                        f"{outputPath}/clustering/", 
-                        file,
-                        top_n_clusterings=3)
+    clusterize_tags_files(path_results_statistical, f"{outputPath}/normalize_posts", f"{outputPath}/clustering/",
+                          top_n_clusterings=3, workers=None)
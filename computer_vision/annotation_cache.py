@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable
+
+# Cache local das respostas da API, por conteúdo da imagem + conjunto de features pedidas.
+# A mesma imagem publicada em outra rede (ou baixada com outro ID) não é enviada de novo.
+# None desliga o cache.
+VISION_CACHE_PATH = "outputs/vision_cache.sqlite"
+# Tamanho máximo das respostas guardadas; acima disso as menos usadas recentemente são apagadas
+VISION_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def cache_key(content: bytes, features: Iterable) -> str:
+    """ sha256 dos bytes da imagem + hash do conjunto de features (a ordem das features não importa) """
+    features_hash = hashlib.sha256(json.dumps(sorted(str(f) for f in features)).encode()).hexdigest()[:16]
+    return f"{hashlib.sha256(content).hexdigest()}-{features_hash}"
+
+
+class AnnotationCache:
+    """
+    Respostas da API (AnnotateImageResponse serializada) guardadas em SQLite.
+
+    Pode ser usado por várias threads ao mesmo tempo. 'hits' e 'misses' contam os acertos e
+    falhas desta execução; o total acumulado fica na tabela 'counters' do próprio banco.
+    """
+
+    def __init__(self, path: str, max_bytes: int = VISION_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS annotations "
+                "(key TEXT PRIMARY KEY, response BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS annotations_last_used ON annotations (last_used)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, name: str, amount: int) -> None:
+        self.connection.execute(
+            "INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """ Respostas guardadas para as chaves (as que não estão no cache ficam de fora) """
+        keys = list(keys)
+        found = {}
+        with self.lock, self.connection:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                found.update(self.connection.execute(
+                    f"SELECT key, response FROM annotations WHERE key IN ({placeholders})", chunk
+                ).fetchall())
+            now = time.time()
+            self.connection.executemany("UPDATE annotations SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            self._count('hits', len(found))
+            self._count('misses', len(keys) - len(found))
+        return found
+
+    def put_many(self, responses: Dict[str, bytes]) -> None:
+        if not responses:
+            return
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)",
+                [(key, response, len(response), now) for key, response in responses.items()],
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """ Apaga as respostas usadas há mais tempo até o cache ficar abaixo de 90% do tamanho máximo """
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM annotations").fetchone()[0]
+        if not self.max_bytes or total <= self.max_bytes:
+            return
+        removed = 0
+        for key, size in self.connection.execute("SELECT key, size FROM annotations ORDER BY last_used").fetchall():
+            if total - removed <= .9 * self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM annotations WHERE key = ?", (key,))
+            removed += size
+        self._count('evicted_bytes', removed)
+
+    def stats(self) -> Dict[str, int]:
+        """ Acertos/falhas desta execução, totais acumulados e tamanho atual do cache """
+        with self.lock:
+            counters = dict(self.connection.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM annotations").fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': counters.get('hits', 0),
+            'total_misses': counters.get('misses', 0),
+            'entries': entries,
+            'bytes': size,
+        }
@@ -0,0 +1,118 @@
+"""
+Registro dos backends de visão computacional. Todos têm a mesma interface: create(path_vision) devolve uma
+função que recebe um lote de imagens lidas (ver computer_vision.submission.load_images) e devolve as linhas
+ID/Class/Percent/Subclass. As tabelas de resultado não dependem do backend: '<outputs>/<folder>/1. Vision-<dataset>'.
+"""
+import os
+from functools import partial
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from computer_vision.submission import LoadedImage
+from pipeline.storage import table_exists
+
+Annotate = Callable[[List[LoadedImage]], pd.DataFrame]
+
+# Prefixo das tabelas de resultado da visão computacional (o mesmo para todos os backends)
+VISION_TABLE_PREFIX = "1. Vision-"
+# Prefixo usado antes do registro, só pelo Google: as tabelas já anotadas com esse nome continuam sendo usadas
+LEGACY_TABLE_PREFIX = "1. GoogleVision-"
+# Pasta com as respostas gravadas que o backend 'replay' devolve
+REPLAY_SOURCE = "outputs/Google"
+
+
+class VisionBackend:
+    """
+    name:         nome no registro (VISION_BACKENDS)
+    folder:       subpasta de saída (ex.: outputs/Google)
+    create:       função path_vision -> annotate (imports das bibliotecas do backend ficam aqui dentro)
+    rate_limited: se False, os lotes vão um por vez e sem limite de taxa (o backend paraleliza sozinho)
+    report:       função opcional chamada depois do envio (ex.: estatísticas do cache de respostas)
+    """
+
+    def __init__(self, name: str, folder: str, create: Callable[[str], Annotate], rate_limited: bool = True,
+                 report: Callable[[], None] = None):
+        self.name = name
+        self.folder = folder
+        self.create = create
+        self.rate_limited = rate_limited
+        self.report = report
+
+
+def _google(path_vision: str) -> Annotate:
+    # Import aqui: a biblioteca do Google só é necessária quando as imagens são enviadas para a API
+    from computer_vision.google_vision import annotate_images
+    from computer_vision.response_archive import ResponseArchive, archive_dir
+    # As respostas completas são arquivadas para permitir refazer a tabela offline (computer_vision/reextract.py)
+    return partial(annotate_images, archive=ResponseArchive(archive_dir(path_vision)))
+
+
+def _google_report() -> None:
+    from computer_vision.google_vision import get_cache
+    cache = get_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(
+            f"Cache de anotações: {stats['hits']} acertos, {stats['misses']} falhas nesta execução "
+            f"({stats['entries']} respostas, {stats['bytes'] / 1024 ** 2:.1f} MB)"
+        )
+
+
+def _local(path_vision: str) -> Annotate:
+    # Import aqui: onnxruntime/torch e OpenCV só são necessários para o anotador local
+    from computer_vision.local_vision import local_annotator
+    return local_annotator()
+
+
+def _fake(path_vision: str) -> Annotate:
+    from computer_vision.fake_vision import fake_annotator
+    return fake_annotator()
+
+
+def _replay(path_vision: str) -> Annotate:
+    from computer_vision.replay_vision import replay_annotator
+    # só as respostas do mesmo dataset ('rede-perfil') da tabela que está sendo anotada
+    return replay_annotator(REPLAY_SOURCE, [table_dataset(path_vision)])
+
+
+VISION_BACKENDS: Dict[str, VisionBackend] = {
+    backend.name: backend for backend in [
+        VisionBackend("google", "Google", _google, report=_google_report),
+        VisionBackend("local", "Local", _local, rate_limited=False),
+        VisionBackend("fake", "Fake", _fake),
+        VisionBackend("replay", "Replay", _replay),
+    ]
+}
+
+# Valores antigos do parâmetro 'vision' de send_imagens_API (2 = Amazon, que nunca funcionou)
+LEGACY_BACKEND_CODES = {1: "google", 3: "local"}
+
+
+def get_backend(name) -> VisionBackend:
+    """ Backend pelo nome (ou pelo código antigo: 1 = Google, 3 = local) """
+    name = LEGACY_BACKEND_CODES.get(name, name)
+    if name not in VISION_BACKENDS:
+        raise ValueError(f"Visão computacional '{name}' não disponível. Opções: {', '.join(VISION_BACKENDS)}")
+    return VISION_BACKENDS[name]
+
+
+def vision_table(folder: str, dataset: str) -> str:
+    """
+    Caminho (sem extensão) da tabela de resultados de 'dataset' na pasta do backend.
+    Se só existir a tabela com o nome antigo ('1. GoogleVision-*'), ela é usada, com o seu log e arquivo de respostas.
+    """
+    path = os.path.join(folder, VISION_TABLE_PREFIX + dataset)
+    legacy = os.path.join(folder, LEGACY_TABLE_PREFIX + dataset)
+    if not table_exists(path) and (table_exists(legacy) or os.path.exists(f"{legacy}.log.jsonl")):
+        return legacy
+    return path
+
+
+def table_dataset(path_vision: str) -> str:
+    """ Dataset ('rede-perfil') de uma tabela de resultados (vision_table), com o prefixo novo ou o antigo """
+    name = os.path.basename(path_vision)
+    for prefix in [VISION_TABLE_PREFIX, LEGACY_TABLE_PREFIX]:
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    raise ValueError(f"'{path_vision}' não é uma tabela de resultados da visão computacional ({VISION_TABLE_PREFIX}<dataset>)")
@@ -0,0 +1,256 @@
+"""
+Imagens quase duplicadas (o mesmo criativo publicado no facebook e no instagram, recomprimido ou redimensionado).
+
+Cada imagem dos arquivos de mapeamento ('1. Mapping-File-id-*') recebe um hash perceptual (pHash ou dHash),
+calculado em vários processos. Os hashes ficam em um índice por faixas de bits (HammingIndex), então a busca
+das imagens parecidas não compara cada imagem com todas as outras.
+
+A primeira imagem de cada grupo (na ordem dos arquivos de mapeamento) é o representante: só ela vai para a
+visão computacional, e as tags dela são copiadas para as outras imagens do grupo (copy_annotations).
+Os grupos ficam em '<outputs>/mapping/1. Duplicates.csv'.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageOps
+from scipy.fft import dctn
+
+from computer_vision.backends import vision_table
+from computer_vision.result_log import VISION_COLUMNS, VisionResultLog
+from pipeline.storage import read_table, table_exists
+
+# Hash perceptual: "phash" (DCT, mais robusto a recompressão e ajustes de cor) ou "dhash" (gradientes, mais rápido)
+DEDUP_HASH = "phash"
+# Lado do hash em bits (8 = hash de 64 bits)
+DEDUP_HASH_SIZE = 8
+# Distância de Hamming máxima (bits diferentes) entre uma imagem e o representante do seu grupo
+DEDUP_MAX_DISTANCE = 6
+# Processos usados para calcular os hashes; None usa todos os núcleos
+DEDUP_WORKERS = None
+
+DUPLICATES_COLUMNS = ['Dataset', 'ID', 'File', 'Hash', 'Representative Dataset', 'Representative', 'Distance']
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def phash(image: Image.Image, size: int = DEDUP_HASH_SIZE) -> int:
+    """ Sinal das frequências baixas da DCT da imagem em tons de cinza (size*4 pixels) em relação à mediana """
+    pixels = np.asarray(image.convert('L').resize((size * 4, size * 4), Image.LANCZOS), dtype=np.float64)
+    low = dctn(pixels, norm='ortho')[:size, :size]
+    return _bits_to_int(low > np.median(low))
+
+
+def dhash(image: Image.Image, size: int = DEDUP_HASH_SIZE) -> int:
+    """ Sinal da diferença entre pixels vizinhos de cada linha da imagem reduzida para (size+1) x size """
+    pixels = np.asarray(image.convert('L').resize((size + 1, size), Image.LANCZOS), dtype=np.float64)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+
+def image_hash(path: str, method: str = DEDUP_HASH, size: int = DEDUP_HASH_SIZE) -> int:
+    """ Hash perceptual do arquivo, ou None se a imagem não puder ser lida (arquivos inexistentes não geram aviso) """
+    try:
+        with Image.open(path) as image:
+            # JPEG: decodifica já em escala reduzida, o hash só usa uma miniatura
+            image.draft('RGB', (size * 8, size * 8))
+            return HASH_FUNCTIONS[method](ImageOps.exif_transpose(image), size)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Erro ao calcular o hash da imagem {path}: {e}")
+        return None
+
+
+def _hash_chunk(paths: List[str], method: str, size: int) -> List[int]:
+    return [image_hash(path, method, size) for path in paths]
+
+
+def hash_images(paths: List[str], method: str = DEDUP_HASH, size: int = DEDUP_HASH_SIZE, workers: int = DEDUP_WORKERS) -> List[int]:
+    """ Hashes dos arquivos (na mesma ordem), calculados em 'workers' processos """
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1 or len(paths) < 2:
+        return _hash_chunk(paths, method, size)
+    chunk = max(1, -(-len(paths) // (workers * 4)))
+    chunks = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_hash_chunk, chunks, [method] * len(chunks), [size] * len(chunks))
+        return [value for values in results for value in values]
+
+
+class HammingIndex:
+    """
+    Índice de hashes de 'bits' bits para a busca por distância de Hamming (multi-index hashing).
+    O hash é dividido em max_distance + 1 faixas; dois hashes a até max_distance bits de distância têm pelo menos
+    uma faixa idêntica (princípio da casa dos pombos). Cada faixa tem o seu dicionário valor -> itens, e a busca
+    só calcula a distância até os itens que coincidem em alguma faixa, não até todos.
+    """
+
+    def __init__(self, bits: int, max_distance: int):
+        self.max_distance = max_distance
+        bands = min(bits, max_distance + 1)
+        widths = [bits // bands + (1 if band < bits % bands else 0) for band in range(bands)]
+        shifts = np.cumsum([0] + widths[:-1]).tolist()
+        self.bands = [(shift, (1 << width) - 1) for shift, width in zip(shifts, widths)]
+        self.tables = [{} for _ in self.bands]
+        self.values = {}
+
+    def add(self, value: int, item: Any) -> None:
+        self.values[item] = value
+        for (shift, mask), table in zip(self.bands, self.tables):
+            table.setdefault((value >> shift) & mask, []).append(item)
+
+    def search(self, value: int) -> List[Tuple[int, Any]]:
+        """ (distância, item) de todos os hashes a até max_distance bits de 'value' """
+        candidates = set()
+        for (shift, mask), table in zip(self.bands, self.tables):
+            candidates.update(table.get((value >> shift) & mask, ()))
+        found = [(hamming(value, self.values[item]), item) for item in candidates]
+        return [(distance, item) for distance, item in found if distance <= self.max_distance]
+
+
+def group_hashes(
+    hashes: Iterable[int], max_distance: int = DEDUP_MAX_DISTANCE, bits: int = DEDUP_HASH_SIZE ** 2
+) -> Tuple[List[int], List[int]]:
+    """
+    bits: tamanho dos hashes em bits
+    Agrupa os hashes na ordem dada: cada hash vai para o representante mais próximo a até max_distance bits
+    (o mais antigo em caso de empate) ou vira um novo representante. Hashes None ficam sozinhos.
+    Retorna (índice do representante, distância até ele) de cada hash.
+    """
+    index = HammingIndex(bits, max_distance)
+    exact = {}
+    representatives, distances = [], []
+    for position, value in enumerate(hashes):
+        if value is None:
+            representatives.append(position)
+            distances.append(0)
+            continue
+        if value in exact:
+            representative, distance = exact[value]
+        else:
+            candidates = index.search(value) if max_distance > 0 else []
+            if candidates:
+                distance, representative = min(candidates)
+            else:
+                distance, representative = 0, position
+                index.add(value, position)
+            exact[value] = (representative, distance)
+        representatives.append(representative)
+        distances.append(distance)
+    return representatives, distances
+
+
+def find_duplicates(
+    mapping_files: Dict[str, str],
+    output_csv: str,
+    ids: Iterable[str] = None,
+    method: str = DEDUP_HASH,
+    max_distance: int = DEDUP_MAX_DISTANCE,
+    size: int = DEDUP_HASH_SIZE,
+    workers: int = DEDUP_WORKERS,
+) -> pd.DataFrame:
+    """
+    Grupos de imagens quase duplicadas de todos os arquivos de mapeamento juntos (entre redes e perfis).
+    mapping_files: dataset ('rede-perfil') -> arquivo de mapeamento (colunas ID e File), na ordem da anotação:
+                   o representante de cada grupo é anotado antes das suas cópias
+    ids: se informado, só essas imagens (ex.: os IDs dos metadados filtrados, os únicos enviados)
+    Grava em output_csv só as imagens dos grupos com mais de uma imagem, e retorna essa tabela.
+    """
+    frames = []
+    for dataset, mapping_csv in mapping_files.items():
+        if os.path.isfile(mapping_csv):
+            frame = pd.read_csv(mapping_csv, dtype={'ID': str})
+            frames.append(frame.assign(Dataset=dataset))
+    images = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['ID', 'File', 'Dataset'])
+    if ids is not None:
+        images = images.loc[images['ID'].isin(pd.Series(ids, dtype=str))]
+    images = images.drop_duplicates(['Dataset', 'ID']).reset_index(drop=True)
+
+    hashes = hash_images(images['File'].tolist(), method, size, workers)
+    representatives, distances = group_hashes(hashes, max_distance, size * size)
+
+    images['Hash'] = [None if value is None else f"{value:0{size * size // 4}x}" for value in hashes]
+    images['Representative Dataset'] = images['Dataset'].to_numpy()[representatives]
+    images['Representative'] = images['ID'].to_numpy()[representatives]
+    images['Distance'] = distances
+    group_sizes = pd.Series(representatives).map(pd.Series(representatives).value_counts())
+    duplicates = images.loc[group_sizes.to_numpy() > 1, DUPLICATES_COLUMNS].reset_index(drop=True)
+    duplicates.to_csv(output_csv, index=False)
+
+    missing = sum(value is None for value in hashes)
+    if missing:
+        print(f"AVISO: {missing} imagens não encontradas ou ilegíveis ficaram fora da detecção de quase duplicatas")
+    groups = len(duplicates[['Representative Dataset', 'Representative']].drop_duplicates())
+    print(f"Quase duplicatas: {len(duplicates) - groups} de {len(images)} imagens são cópias de outra imagem "
+          f"({groups} grupos); elas não serão enviadas para a visão computacional")
+    return duplicates
+
+
+def load_duplicates(path: str) -> pd.DataFrame:
+    return pd.read_csv(path, dtype={'ID': str, 'Representative': str, 'Dataset': str, 'Representative Dataset': str})
+
+
+def _is_copy(duplicates: pd.DataFrame) -> pd.Series:
+    return (duplicates['ID'] != duplicates['Representative']) | (duplicates['Dataset'] != duplicates['Representative Dataset'])
+
+
+def copies_of(duplicates: pd.DataFrame, dataset: str) -> pd.DataFrame:
+    """ Imagens de 'dataset' que são cópias de outra imagem (não são o representante do seu grupo) """
+    return duplicates.loc[_is_copy(duplicates) & (duplicates['Dataset'] == dataset)]
+
+
+def copy_annotations(copies: pd.DataFrame, folder: str, result_log: VisionResultLog) -> int:
+    """
+    Acrescenta a result_log as linhas dos representantes (lidas das tabelas '1. Vision-<dataset>' de 'folder'),
+    com o ID de cada cópia. Retorna a quantidade de cópias anotadas; as cópias cujo representante ainda não
+    tem anotação ficam para a próxima execução.
+    """
+    copied = []
+    for dataset, group in copies.groupby('Representative Dataset', sort=False):
+        path = vision_table(folder, dataset)
+        if not table_exists(path):
+            continue
+        rows = read_table(path, columns=VISION_COLUMNS)
+        rows['ID'] = rows['ID'].astype(str)
+        rows = rows.loc[rows['ID'].isin(group['Representative'])].rename(columns={'ID': 'Representative'})
+        copied.append(group[['ID', 'Representative']].merge(rows, on='Representative')[VISION_COLUMNS])
+    copied = pd.concat(copied, ignore_index=True) if copied else pd.DataFrame(columns=VISION_COLUMNS)
+
+    result_log.append(copied)
+    annotated = copied['ID'].nunique()
+    if annotated < len(copies):
+        print(f"AVISO: {len(copies) - annotated} quase duplicatas sem anotação do representante")
+    if annotated:
+        print(f"Quase duplicatas: tags copiadas para {annotated} imagens (sem envio)")
+    return annotated
+
+
+def refresh_copies(duplicates: pd.DataFrame, folder: str, datasets: Iterable[str] = None) -> int:
+    """
+    Copia de novo as linhas dos representantes para as suas cópias, no lugar das linhas copiadas antes
+    (ex.: depois de refazer as tabelas dos representantes com computer_vision.reextract).
+    datasets: se informado, só as cópias cujo representante é de um desses datasets ('rede-perfil')
+    Retorna a quantidade de cópias anotadas.
+    """
+    copies = duplicates.loc[_is_copy(duplicates)]
+    if datasets is not None:
+        copies = copies.loc[copies['Representative Dataset'].isin(list(datasets))]
+    annotated = 0
+    for dataset, group in copies.groupby('Dataset', sort=False):
+        result_log = VisionResultLog(vision_table(folder, dataset))
+        annotated += copy_annotations(group, folder, result_log)
+        # consolidate substitui as linhas antigas das cópias (mesmo ID) pelas novas
+        result_log.consolidate()
+    return annotated
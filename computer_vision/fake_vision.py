@@ -0,0 +1,56 @@
+import hashlib
+import random
+import threading
+import time
+from typing import Callable, List
+
+import pandas as pd
+
+from computer_vision.submission import LoadedImage
+
+# Vocabulário das tags geradas pelo anotador falso
+FAKE_CLASSES = [
+    'Person', 'Smile', 'Crowd', 'Flag', 'Font', 'Event', 'Gesture', 'Sky', 'Suit', 'Microphone',
+    'Happy', 'Tie', 'Building', 'Car', 'Poster', 'Stage', 'Tree', 'Hat', 'Glasses', 'Child',
+]
+
+
+class QuotaExceeded(Exception):
+    """ Imita o erro de cota da API (google.api_core.exceptions.ResourceExhausted) """
+    code = 429
+
+
+def fake_rows(file_id: str, content: bytes, tags: int = 5) -> List[dict]:
+    """ Tags determinísticas a partir do conteúdo da imagem (a mesma imagem gera sempre as mesmas tags) """
+    seed = int.from_bytes(hashlib.sha256(content).digest()[:8], 'big')
+    generator = random.Random(seed)
+    return [
+        {'ID': file_id, 'Class': label, 'Percent': round(generator.uniform(.5, 1), 4), 'Subclass': 'label'}
+        for label in generator.sample(FAKE_CLASSES, tags)
+    ]
+
+
+def fake_annotator(
+    latency: float = 0.5, quota_errors: int = 0, tags: int = 5
+) -> Callable[[List[LoadedImage]], pd.DataFrame]:
+    """
+    Anotador para testes locais, sem credenciais nem rede: mesmo formato de google_vision.annotate_images.
+
+    latency: tempo (s) de cada chamada, simulando a ida e volta da API
+    quota_errors: quantidade de chamadas (as primeiras) que falham com QuotaExceeded, para testar o backoff
+    tags: quantidade de tags por imagem
+    """
+    lock = threading.Lock()
+    calls = {'count': 0}
+
+    def annotate(images: List[LoadedImage]) -> pd.DataFrame:
+        with lock:
+            calls['count'] += 1
+            fail = calls['count'] <= quota_errors
+        time.sleep(latency)
+        if fail:
+            raise QuotaExceeded("Quota exceeded (fake)")
+        rows = [row for file_id, _, content in images for row in fake_rows(file_id, content, tags)]
+        return pd.DataFrame(rows, columns=['ID', 'Class', 'Percent', 'Subclass'])
+
+    return annotate
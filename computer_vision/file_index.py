@@ -0,0 +1,127 @@
+"""
+Índice persistente das imagens de uma pasta de entrada (ex.: inputs/facebook/lula), usado por
+computer_vision.tagging.create_file_id.
+
+A pasta é percorrida recursivamente com os.scandir, várias pastas ao mesmo tempo (threads). O índice guarda,
+para cada pasta, a data de modificação, as subpastas e as imagens (tamanho, data de modificação e ID do post).
+Na execução seguinte, as pastas com a mesma data de modificação não são listadas de novo (só recebem um stat),
+e o resultado diz quais imagens são novas, foram removidas ou foram alteradas desde a última vez.
+
+A data de uma pasta muda quando um arquivo é criado, removido ou renomeado nela, mas não quando um arquivo é
+sobrescrito. Use full=True em scan_images para conferir também cada arquivo das pastas sem alteração.
+"""
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Tuple
+
+import pandas as pd
+
+# Extensões das imagens mapeadas (comparadas sem diferenciar maiúsculas e minúsculas)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Threads que listam as pastas
+SCAN_THREADS = 8
+
+INDEX_VERSION = 1
+DELTA_COLUMNS = ['ID', 'File', 'Change']
+
+
+def post_id(name: str, perfil: str = '') -> str:
+    """ ID do post de uma imagem: o nome do arquivo sem a extensão e sem o @ do perfil """
+    return os.path.splitext(name)[0].replace(perfil, '')
+
+
+def _scan_directory(path: str, known: dict, extensions: Tuple[str, ...], perfil: str, full: bool) -> dict:
+    """ Registro de uma pasta: {'mtime_ns', 'subdirs', 'files': {nome: [tamanho, mtime_ns, ID]}} """
+    mtime_ns = os.stat(path).st_mtime_ns
+    if known is not None and known['mtime_ns'] == mtime_ns and not full:
+        return known
+
+    subdirs, files = [], {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns, post_id(entry.name, perfil)]
+    return {'mtime_ns': mtime_ns, 'subdirs': sorted(subdirs), 'files': files}
+
+
+def _walk(root: str, known: Dict[str, dict], extensions, perfil: str, full: bool, threads: int) -> Dict[str, dict]:
+    """ Registros de todas as pastas de 'root' (chave: caminho relativo, '.' para a própria root) """
+    directories = {}
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        def submit(relative):
+            path = root if relative == '.' else os.path.join(root, relative)
+            return executor.submit(_scan_directory, path, known.get(relative), extensions, perfil, full)
+
+        pending = {submit('.'): '.'}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative = pending.pop(future)
+                try:
+                    record = future.result()
+                except FileNotFoundError:
+                    # pasta removida durante a varredura
+                    continue
+                directories[relative] = record
+                for name in record['subdirs']:
+                    child = name if relative == '.' else os.path.join(relative, name)
+                    pending[submit(child)] = child
+    return directories
+
+
+def _files(root: str, directories: Dict[str, dict]) -> Dict[str, list]:
+    """ caminho do arquivo -> [tamanho, mtime_ns, ID] """
+    return {
+        (os.path.join(root, name) if relative == '.' else os.path.join(root, relative, name)): entry
+        for relative, record in directories.items()
+        for name, entry in record['files'].items()
+    }
+
+
+def scan_images(
+    root: str,
+    index_path: str,
+    perfil: str = '',
+    extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+    threads: int = SCAN_THREADS,
+    full: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Imagens de 'root' (recursivamente), usando e atualizando o índice gravado em index_path.
+    perfil: @ do perfil, retirado do nome dos arquivos para formar o ID do post (ver post_id)
+    Retorna (imagens, delta): imagens com as colunas ID/File (ordenadas pelo caminho) e o delta em relação ao
+    índice anterior, com as colunas ID/File/Change ('new', 'removed' ou 'modified').
+    """
+    previous = {}
+    if os.path.isfile(index_path):
+        with open(index_path, encoding='utf-8') as obj:
+            saved = json.load(obj)
+        header = {'version': INDEX_VERSION, 'root': root, 'perfil': perfil, 'extensions': list(extensions)}
+        # índice de outra pasta, perfil ou extensões: as pastas são todas listadas de novo
+        if all(saved.get(key) == value for key, value in header.items()):
+            previous = saved['directories']
+
+    directories = _walk(root, previous, tuple(extensions), perfil, full, threads) if os.path.isdir(root) else {}
+
+    old_files, new_files = _files(root, previous), _files(root, directories)
+    delta = [(entry[2], path, 'new') for path, entry in new_files.items() if path not in old_files]
+    delta += [(entry[2], path, 'removed') for path, entry in old_files.items() if path not in new_files]
+    delta += [
+        (entry[2], path, 'modified') for path, entry in new_files.items()
+        if path in old_files and old_files[path][:2] != entry[:2]
+    ]
+    delta = pd.DataFrame(delta, columns=DELTA_COLUMNS).sort_values(['Change', 'File'], ignore_index=True)
+
+    if directories != previous or not os.path.isfile(index_path):
+        temporary = f"{index_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as obj:
+            json.dump({'version': INDEX_VERSION, 'root': root, 'perfil': perfil, 'extensions': list(extensions),
+                       'directories': directories}, obj)
+        os.replace(temporary, index_path)
+
+    images = pd.DataFrame([(entry[2], path) for path, entry in sorted(new_files.items())], columns=['ID', 'File'])
+    return images, delta
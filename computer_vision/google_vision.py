@@ -1,82 +1,150 @@
 import pandas as pd
 from google.cloud import vision
-import io
 import os
-from typing import List
+import threading
+from typing import Callable, List
 from typing import Sequence # Adicionado para o código antigo
 
+from computer_vision.annotation_cache import AnnotationCache, VISION_CACHE_PATH, cache_key
+from computer_vision.response_archive import ResponseArchive
+from computer_vision.submission import LoadedImage, load_images
+
 GOOGLE_APPLICATION_CREDENTIALS='./caminho que aponta para json gerado na aplicacao do goole'
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = GOOGLE_APPLICATION_CREDENTIALS
 
-def process_images_batch(image_df: pd.DataFrame) -> pd.DataFrame:
+FEATURES = [
+    {"type_": vision.Feature.Type.LABEL_DETECTION},
+    {"type_": vision.Feature.Type.OBJECT_LOCALIZATION},
+    {"type_": vision.Feature.Type.FACE_DETECTION},
+    {"type_": vision.Feature.Type.TEXT_DETECTION},
+]
+
+# Menor probabilidade (Likelihood) de uma emoção/atributo do rosto para virar tag.
+# Para mudar a regra sem chamar a API de novo, altere aqui e rode computer_vision/reextract.py
+FACE_MIN_LIKELIHOOD = vision.Likelihood.POSSIBLE
+
+# Um único cliente para todos os lotes (o canal gRPC pode ser usado por várias threads)
+_client = None
+_cache = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> vision.ImageAnnotatorClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = vision.ImageAnnotatorClient()
+    return _client
+
+
+def response_rows(response: vision.AnnotateImageResponse, file_id: str) -> List[dict]:
+    """ Converte a resposta da API para uma imagem em linhas ID/Class/Percent/Subclass """
+    rows = []
+    for label in response.label_annotations:
+        rows.append({'ID': file_id, 'Class': label.description, 'Percent': label.score, 'Subclass': 'label'})
+    for obj in response.localized_object_annotations:
+        rows.append({'ID': file_id, 'Class': obj.name, 'Percent': obj.score, 'Subclass': 'object'})
+    for face in response.face_annotations:
+        face_details = {
+            "Joy": face.joy_likelihood, "Sorrow": face.sorrow_likelihood,
+            "Anger": face.anger_likelihood, "Surprise": face.surprise_likelihood,
+            "UnderExposed": face.under_exposed_likelihood, "Blurred": face.blurred_likelihood,
+            "Headwear": face.headwear_likelihood
+        }
+        for detail, likelihood in face_details.items():
+            # Adiciona a tag apenas se a probabilidade for FACE_MIN_LIKELIHOOD (POSSÍVEL) ou maior
+            if likelihood >= FACE_MIN_LIKELIHOOD:
+                 rows.append({'ID': file_id, 'Class': detail, 'Percent': face.detection_confidence, 'Subclass': 'face'})
+
+    if response.text_annotations:
+        rows.append({'ID': file_id, 'Class': response.text_annotations[0].description.replace('\n', ' '), 'Percent': 1.0, 'Subclass': 'text'})
+    return rows
+
+
+def get_cache() -> AnnotationCache:
+    """ Cache de respostas compartilhado (None se VISION_CACHE_PATH for None) """
+    global _cache
+    with _client_lock:
+        if _cache is None and VISION_CACHE_PATH:
+            _cache = AnnotationCache(VISION_CACHE_PATH)
+    return _cache
+
+
+def annotate_images(
+    images: List[LoadedImage], archive: ResponseArchive = None, acquire: Callable[[int], None] = None
+) -> pd.DataFrame:
     """
-    Processa um lote de imagens usando a API Google Vision e retorna um DataFrame com os resultados.
+    Envia um lote de imagens já lidas (ver computer_vision.submission.load_images) em uma única chamada
+    batch_annotate_images, usando o cliente compartilhado.
+    As imagens já anotadas antes (mesmo conteúdo e mesmas features, ver annotation_cache.py) não são enviadas:
+    as linhas são refeitas a partir da resposta guardada.
 
     Args:
-        image_df (pd.DataFrame): DataFrame contendo as colunas 'File' (caminho da imagem) e 'ID'.
+        archive: se informado, as respostas completas do lote são gravadas nele (ver response_archive.py)
+        acquire: limite de taxa (submission.RateLimiter.acquire), chamado com a quantidade de imagens que vão
+                 de fato para a API; um lote que veio todo do cache não espera pela cota
 
     Returns:
         pd.DataFrame: DataFrame com as colunas ['ID', 'Class', 'Percent', 'Subclass'].
     """
-    # --- INÍCIO DO NOVO CÓDIGO (PROCESSAMENTO EM LOTE) ---
-    client = vision.ImageAnnotatorClient()
-    features = [
-        {"type_": vision.Feature.Type.LABEL_DETECTION},
-        {"type_": vision.Feature.Type.OBJECT_LOCALIZATION},
-        {"type_": vision.Feature.Type.FACE_DETECTION},
-        {"type_": vision.Feature.Type.TEXT_DETECTION},
-    ]
-
-    requests = []
-    for index, row in image_df.iterrows():
-        path = row['File']
-        try:
-            with io.open(path, 'rb') as image_file:
-                content = image_file.read()
-            image = vision.Image(content=content)
-            request = vision.AnnotateImageRequest(image=image, features=features)
-            requests.append(request)
-        except FileNotFoundError:
-            print(f"Arquivo não encontrado, pulando: {path}")
-            continue
-        except Exception as e:
-            print(f"Erro ao ler o arquivo {path}: {e}")
-            continue
-    
-    if not requests:
-        return pd.DataFrame()
-
-    batch_response = client.batch_annotate_images(requests={"requests": requests})
+    cache = get_cache()
+    keys = [cache_key(content, FEATURES) for _, _, content in images]
+    serialized = cache.get_many(keys) if cache else {}
+    responses = {key: vision.AnnotateImageResponse.deserialize(serialized[key]) for key in serialized}
+    from_cache = sum(key in serialized for key in keys)
+
+    to_send = [(key, content) for key, (_, _, content) in zip(keys, images) if key not in responses]
+    to_send = list(dict(to_send).items())  # imagens repetidas no lote são enviadas uma vez só
+    if to_send:
+        if acquire is not None:
+            acquire(len(to_send))
+        requests = [
+            vision.AnnotateImageRequest(image=vision.Image(content=content), features=FEATURES)
+            for _, content in to_send
+        ]
+        batch_response = get_client().batch_annotate_images(requests={"requests": requests})
+        new_responses = {
+            key: response for (key, _), response in zip(to_send, batch_response.responses)
+        }
+        responses.update(new_responses)
+        new_serialized = {
+            key: vision.AnnotateImageResponse.serialize(response)
+            for key, response in new_responses.items() if not response.error.message
+        }
+        serialized.update(new_serialized)
+        if cache:
+            cache.put_many(new_serialized)
+    if from_cache:
+        print(f"{from_cache} de {len(images)} imagens do lote vieram do cache de anotações")
+
+    if archive is not None:
+        archive.write([(file_id, serialized[key]) for (file_id, _, _), key in zip(images, keys) if key in serialized])
 
     all_results = []
-    for i, response in enumerate(batch_response.responses):
+    for (file_id, path, _), key in zip(images, keys):
+        response = responses[key]
         if response.error.message:
-            print(f'Erro para a imagem {image_df.iloc[i]["File"]}: {response.error.message}')
+            print(f'Erro para a imagem {path}: {response.error.message}')
             continue
-
-        file_id = image_df.iloc[i]['ID']
-
-        for label in response.label_annotations:
-            all_results.append({'ID': file_id, 'Class': label.description, 'Percent': label.score, 'Subclass': 'label'})
-        for obj in response.localized_object_annotations:
-            all_results.append({'ID': file_id, 'Class': obj.name, 'Percent': obj.score, 'Subclass': 'object'})
-        for face in response.face_annotations:
-            face_details = {
-                "Joy": face.joy_likelihood, "Sorrow": face.sorrow_likelihood,
-                "Anger": face.anger_likelihood, "Surprise": face.surprise_likelihood,
-                "UnderExposed": face.under_exposed_likelihood, "Blurred": face.blurred_likelihood,
-                "Headwear": face.headwear_likelihood
-            }
-            for detail, likelihood in face_details.items():
-                # Adiciona a tag apenas se a probabilidade for POSSÍVEL ou maior
-                if likelihood >= vision.Likelihood.POSSIBLE:
-                     all_results.append({'ID': file_id, 'Class': detail, 'Percent': face.detection_confidence, 'Subclass': 'face'})
-
-        if response.text_annotations:
-            all_results.append({'ID': file_id, 'Class': response.text_annotations[0].description.replace('\n', ' '), 'Percent': 1.0, 'Subclass': 'text'})
+        all_results.extend(response_rows(response, file_id))
 
     return pd.DataFrame(all_results, columns=['ID', 'Class', 'Percent', 'Subclass'])
-    # --- FIM DO NOVO CÓDIGO ---
+
+
+def process_images_batch(image_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Processa um lote de imagens usando a API Google Vision e retorna um DataFrame com os resultados.
+
+    Args:
+        image_df (pd.DataFrame): DataFrame contendo as colunas 'File' (caminho da imagem) e 'ID'.
+
+    Returns:
+        pd.DataFrame: DataFrame com as colunas ['ID', 'Class', 'Percent', 'Subclass'].
+    """
+    images = load_images(image_df)
+    if not images:
+        return pd.DataFrame()
+    return annotate_images(images)
 
 
 """
@@ -0,0 +1,283 @@
+"""
+Anotador local (offline, só CPU), com o mesmo formato de saída de google_vision.annotate_images:
+linhas ID/Class/Percent/Subclass. Usa um classificador de imagens exportado para ONNX (onnxruntime)
+ou TorchScript (torch) e, opcionalmente, o detector de rostos Haar que vem com o OpenCV.
+
+As bibliotecas só são importadas quando o anotador é usado. onnxruntime (modelos .onnx) e opencv-python
+(detecção de rostos) estão no requirements.txt; para modelos TorchScript (.pt/.pth) instale também o torch:
+    pip install torch
+
+O modelo e o arquivo de rótulos (um nome por linha, na ordem das saídas do modelo) ficam em
+LOCAL_MODEL_PATH e LOCAL_LABELS_PATH. Qualquer classificador do estilo ImageNet serve
+(entrada NCHW float32 de LOCAL_INPUT_SIZE pixels, normalizada com a média/desvio do ImageNet).
+O modelo padrão (MobileNetV2 do ONNX Model Zoo, ~14 MB) e os rótulos do ImageNet são baixados e conferidos com:
+    python -m computer_vision.local_vision
+"""
+import io
+import os
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageOps
+
+from computer_vision.submission import LoadedImage
+
+LOCAL_MODEL_PATH = 'models/classifier.onnx'
+LOCAL_LABELS_PATH = 'models/classifier-labels.txt'
+# De onde o modelo padrão e os rótulos são baixados (download_model)
+LOCAL_MODEL_URL = 'https://github.com/onnx/models/raw/main/validated/vision/classification/mobilenet/model/mobilenetv2-12.onnx'
+LOCAL_LABELS_URL = 'https://raw.githubusercontent.com/pytorch/hub/master/imagenet_classes.txt'
+# Quantidade máxima de rótulos por imagem e probabilidade mínima de um rótulo para virar tag
+LOCAL_TOP_K = 10
+LOCAL_SCORE_THRESHOLD = 0.05
+# Processos de inferência (cada um carrega o modelo uma vez e usa uma thread); None usa todos os núcleos
+LOCAL_WORKERS = None
+# Imagens por chamada do modelo
+LOCAL_INFERENCE_BATCH = 16
+# Pré-processamento do classificador: lado menor redimensionado para LOCAL_RESIZE e recorte central de LOCAL_INPUT_SIZE
+LOCAL_RESIZE = 256
+LOCAL_INPUT_SIZE = 224
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+# Detecção de rostos (OpenCV); False para não gerar as tags 'Face'
+LOCAL_DETECT_FACES = True
+
+
+def load_classifier(model_path: str, threads: int = None) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Função que recebe um lote (N, 3, H, W) float32 e devolve as saídas do modelo (N, classes).
+    O tipo do modelo vem da extensão: .onnx (onnxruntime) ou .pt/.pth (TorchScript).
+    threads: threads de cada inferência (None = padrão da biblioteca)
+    """
+    if model_path.endswith('.onnx'):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+        return lambda batch: session.run(None, {input_name: batch})[0]
+
+    if model_path.endswith(('.pt', '.pth')):
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        model = torch.jit.load(model_path, map_location='cpu').eval()
+
+        def classify(batch):
+            with torch.inference_mode():
+                return model(torch.from_numpy(batch)).numpy()
+        return classify
+
+    raise ValueError(f"Formato de modelo não suportado (use .onnx, .pt ou .pth): {model_path}")
+
+
+def load_labels(labels_path: str) -> List[str]:
+    with open(labels_path, encoding='utf-8') as labels_file:
+        return [line.strip() for line in labels_file if line.strip()]
+
+
+def check_labels(classify: Callable[[np.ndarray], np.ndarray], labels: List[str], model_path: str, labels_path: str) -> int:
+    """ Confere se há um rótulo para cada saída do modelo (uma inferência de uma imagem em branco); retorna a quantidade """
+    outputs = classify(np.zeros((1, 3, LOCAL_INPUT_SIZE, LOCAL_INPUT_SIZE), dtype=np.float32)).shape[1]
+    if len(labels) != outputs:
+        raise ValueError(
+            f"O arquivo de rótulos {labels_path} tem {len(labels)} rótulos, mas o modelo {model_path} tem {outputs} saídas"
+        )
+    return outputs
+
+
+def download_model(model_path: str = LOCAL_MODEL_PATH, labels_path: str = LOCAL_LABELS_PATH,
+                   model_url: str = LOCAL_MODEL_URL, labels_url: str = LOCAL_LABELS_URL) -> None:
+    """
+    Baixa o modelo e os rótulos, confere se o modelo carrega e tem uma saída por rótulo, e só então
+    os grava em model_path e labels_path (os arquivos anteriores não são tocados se algo falhar).
+    """
+    os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+    os.makedirs(os.path.dirname(labels_path) or '.', exist_ok=True)
+    temporary_model = model_path + '.download' + os.path.splitext(model_path)[1]
+    temporary_labels = labels_path + '.download'
+    try:
+        for url, temporary in [(model_url, temporary_model), (labels_url, temporary_labels)]:
+            print(f"Baixando {url}")
+            urllib.request.urlretrieve(url, temporary)
+        outputs = check_labels(load_classifier(temporary_model), load_labels(temporary_labels), model_url, labels_url)
+        os.replace(temporary_model, model_path)
+        os.replace(temporary_labels, labels_path)
+    finally:
+        for temporary in [temporary_model, temporary_labels]:
+            if os.path.isfile(temporary):
+                os.remove(temporary)
+    print(f"Modelo salvo em {model_path} e rótulos em {labels_path} ({outputs} classes)")
+
+
+def load_face_detector() -> Callable[[np.ndarray], int]:
+    """ Função que recebe uma imagem em tons de cinza (uint8) e devolve a quantidade de rostos """
+    import cv2
+    detector = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+    return lambda gray: len(detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24)))
+
+
+def preprocess(image: Image.Image, resize: int = LOCAL_RESIZE, size: int = LOCAL_INPUT_SIZE) -> np.ndarray:
+    """ Imagem RGB -> array (3, size, size) float32: redimensiona o lado menor, recorta o centro e normaliza """
+    scale = resize / min(image.size)
+    image = image.resize((max(size, round(image.size[0] * scale)), max(size, round(image.size[1] * scale))), Image.BILINEAR)
+    left, top = (image.size[0] - size) // 2, (image.size[1] - size) // 2
+    array = np.asarray(image.crop((left, top, left + size, top + size)), dtype=np.float32) / 255
+    return ((array - IMAGENET_MEAN) / IMAGENET_STD).transpose(2, 0, 1)
+
+
+def softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def top_labels(probabilities: np.ndarray, labels: List[str], top_k: int, threshold: float) -> List[List[tuple]]:
+    """ (rótulo, probabilidade) dos top_k rótulos de cada imagem com probabilidade >= threshold, do maior para o menor """
+    top_k = min(top_k, probabilities.shape[1])
+    best = np.argpartition(-probabilities, top_k - 1, axis=1)[:, :top_k]
+    result = []
+    for row, candidates in zip(probabilities, best):
+        candidates = candidates[np.argsort(-row[candidates], kind='stable')]
+        result.append([(labels[c], float(row[c])) for c in candidates if row[c] >= threshold])
+    return result
+
+
+class LocalTagger:
+    """ Classificador (e detector de rostos) carregado uma vez; tag() anota imagens já lidas """
+
+    def __init__(self, model_path: str = LOCAL_MODEL_PATH, labels_path: str = LOCAL_LABELS_PATH,
+                 top_k: int = LOCAL_TOP_K, threshold: float = LOCAL_SCORE_THRESHOLD,
+                 detect_faces: bool = LOCAL_DETECT_FACES, threads: int = None,
+                 inference_batch: int = LOCAL_INFERENCE_BATCH):
+        for path in [model_path, labels_path]:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(
+                    f"{path} não encontrado: baixe o modelo padrão com 'python -m computer_vision.local_vision' "
+                    f"ou ajuste LOCAL_MODEL_PATH/LOCAL_LABELS_PATH"
+                )
+        self.classify = load_classifier(model_path, threads)
+        self.labels = load_labels(labels_path)
+        check_labels(self.classify, self.labels, model_path, labels_path)
+        self.count_faces = load_face_detector() if detect_faces else None
+        self.top_k = top_k
+        self.threshold = threshold
+        self.inference_batch = inference_batch
+
+    def tag(self, images: List[LoadedImage]) -> List[dict]:
+        rows = []
+        for start in range(0, len(images), self.inference_batch):
+            batch_ids, inputs, faces = [], [], []
+            for file_id, path, content in images[start:start + self.inference_batch]:
+                try:
+                    with Image.open(io.BytesIO(content)) as image:
+                        image = ImageOps.exif_transpose(image).convert('RGB')
+                except Exception as e:
+                    print(f"Erro ao decodificar a imagem {path}: {e}")
+                    continue
+                batch_ids.append(file_id)
+                inputs.append(preprocess(image))
+                if self.count_faces is not None:
+                    faces.append(self.count_faces(np.asarray(image.convert('L'))))
+            if not batch_ids:
+                continue
+
+            scores = self.classify(np.stack(inputs))
+            # modelos que já devolvem probabilidades (linhas somando 1) não passam pelo softmax
+            probabilities = scores if np.allclose(scores.sum(axis=1), 1, atol=1e-3) and scores.min() >= 0 else softmax(scores)
+            for i, (file_id, image_labels) in enumerate(zip(batch_ids, top_labels(probabilities, self.labels, self.top_k, self.threshold))):
+                rows.extend({'ID': file_id, 'Class': label, 'Percent': score, 'Subclass': 'label'} for label, score in image_labels)
+                if faces and faces[i]:
+                    rows.append({'ID': file_id, 'Class': 'Face', 'Percent': 1.0, 'Subclass': 'face'})
+        return rows
+
+
+# Tagger de cada processo do pool (carregado uma vez por processo, em _init_worker)
+_tagger = None
+# Erro ao carregar o tagger no processo (modelo ausente, rótulos que não batem com o modelo, ...)
+_init_error = None
+
+
+def _init_worker(options: dict) -> None:
+    global _tagger, _init_error
+    try:
+        _tagger = LocalTagger(threads=1, **options)
+    except Exception as e:
+        # guardado para a primeira chamada: um erro no initializer só apareceria como BrokenProcessPool
+        _init_error = e
+
+
+def _tag_in_worker(images: List[LoadedImage]) -> List[dict]:
+    if _init_error is not None:
+        raise _init_error
+    return _tagger.tag(images)
+
+
+class LocalAnnotator:
+    """
+    Anotador local para computer_vision.submission.submit_batches (mesmo formato de google_vision.annotate_images).
+
+    top_k, threshold: até top_k rótulos por imagem, com probabilidade >= threshold ('Subclass' = 'label')
+    workers: processos de inferência; cada lote é dividido entre eles (1 = no processo atual)
+    detect_faces: acrescenta uma tag 'Face' ('Subclass' = 'face') às imagens com pelo menos um rosto
+
+    Use com in_flight=1 e images_per_minute=None no submit_batches: o paralelismo fica nos processos, não há cota.
+    O modelo é carregado na primeira chamada; close() encerra os processos de inferência (cada um com o modelo
+    carregado), que senão ficam ativos até o fim do programa.
+    """
+
+    def __init__(
+        self,
+        model_path: str = LOCAL_MODEL_PATH,
+        labels_path: str = LOCAL_LABELS_PATH,
+        top_k: int = LOCAL_TOP_K,
+        threshold: float = LOCAL_SCORE_THRESHOLD,
+        workers: int = LOCAL_WORKERS,
+        detect_faces: bool = LOCAL_DETECT_FACES,
+    ):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.options = dict(model_path=model_path, labels_path=labels_path, top_k=top_k, threshold=threshold,
+                            detect_faces=detect_faces)
+        self.tagger = None
+        self.pool = None
+
+    def __call__(self, images: List[LoadedImage]) -> pd.DataFrame:
+        if self.workers == 1:
+            if self.tagger is None:
+                self.tagger = LocalTagger(**self.options)
+            rows = self.tagger.tag(images)
+        else:
+            if self.pool is None:
+                # o modelo só é carregado nos processos; um erro ao carregá-lo volta na primeira chamada (_tag_in_worker)
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.options,))
+            part = -(-len(images) // self.workers)
+            parts = [images[i:i + part] for i in range(0, len(images), part)]
+            rows = [row for part_rows in self.pool.map(_tag_in_worker, parts) for row in part_rows]
+        return pd.DataFrame(rows, columns=['ID', 'Class', 'Percent', 'Subclass'])
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.tagger = None
+
+
+def local_annotator(
+    model_path: str = LOCAL_MODEL_PATH,
+    labels_path: str = LOCAL_LABELS_PATH,
+    top_k: int = LOCAL_TOP_K,
+    threshold: float = LOCAL_SCORE_THRESHOLD,
+    workers: int = LOCAL_WORKERS,
+    detect_faces: bool = LOCAL_DETECT_FACES,
+) -> LocalAnnotator:
+    """ Anotador local (ver LocalAnnotator); chame close() depois do envio """
+    return LocalAnnotator(model_path, labels_path, top_k, threshold, workers, detect_faces)
+
+
+if __name__ == "__main__":
+    download_model()
@@ -0,0 +1,82 @@
+"""
+Etapa offline: refaz as tabelas '1. Vision-*' (ou '1. GoogleVision-*', o nome antigo) a partir das respostas completas guardadas
+pelo ResponseArchive, sem chamar a API. Útil depois de mudar as regras de response_rows
+(ex.: FACE_MIN_LIKELIHOOD em google_vision.py). As quase duplicatas (computer_vision.dedup), que não têm respostas
+arquivadas, recebem de novo as linhas dos seus representantes.
+
+Uso: python -m computer_vision.reextract [pasta]   (padrão: outputs/Google)
+"""
+import os
+import sys
+from typing import List
+
+import pandas as pd
+
+from computer_vision.backends import table_dataset
+from computer_vision.dedup import load_duplicates, refresh_copies
+from computer_vision.response_archive import archive_dir, archive_files, read_batch
+from computer_vision.result_log import VISION_COLUMNS, VisionResultLog
+from pipeline.parallel import run_parallel
+from pipeline.storage import read_table, replace_table, table_exists
+
+
+def reextract_table(path_vision: str) -> str:
+    """
+    Refaz a tabela 'path_vision' (sem extensão) com as respostas do seu arquivo.
+    IDs que não estão no arquivo (anotados antes de ele existir) mantêm as linhas atuais.
+    """
+    # Import aqui: a biblioteca do Google só é necessária para ler as respostas
+    from google.cloud import vision
+    from computer_vision.google_vision import response_rows
+
+    # Lotes de uma execução interrompida entram na tabela antes
+    VisionResultLog(path_vision).consolidate()
+
+    responses = {}
+    for file in archive_files(archive_dir(path_vision)):
+        for file_id, data in read_batch(file):
+            responses[file_id] = data  # a resposta mais recente vale
+
+    rows = [
+        row
+        for file_id, data in responses.items()
+        for row in response_rows(vision.AnnotateImageResponse.deserialize(data), file_id)
+    ]
+    df = pd.DataFrame(rows, columns=VISION_COLUMNS)
+    if table_exists(path_vision):
+        data = read_table(path_vision)
+        data['ID'] = data['ID'].astype(str)
+        df = pd.concat([data.loc[~data['ID'].isin(responses.keys())], df], ignore_index=True)
+
+    output = replace_table(df, path_vision)
+    print(f"{len(responses)} respostas reextraídas para {output}")
+    return output
+
+
+def reextract_folder(folder: str, workers: int = None, datasets: List[str] = None, duplicates: pd.DataFrame = None):
+    """
+    Refaz, em paralelo, todas as tabelas da pasta que têm arquivo de respostas.
+    datasets: se informado, só essas tabelas (ex.: ['1. Vision-facebook-lula'])
+    duplicates: grupos de quase duplicatas (dedup.load_duplicates); as cópias dos representantes das tabelas
+                refeitas recebem as linhas novas
+    """
+    names = sorted(
+        file[:-len('.archive')] for file in os.listdir(folder)
+        if file.endswith('.archive') and os.path.isdir(os.path.join(folder, file))
+    )
+    if datasets is not None:
+        names = [name for name in names if name in datasets]
+    jobs = {name: {'path_vision': os.path.join(folder, name)} for name in names}
+    summary = run_parallel(reextract_table, jobs, workers, title='Reextração da visão computacional')
+
+    if duplicates is not None:
+        refresh_copies(duplicates, folder, [table_dataset(job['name']) for job in summary if not job['error']])
+    return summary
+
+
+if __name__ == "__main__":
+    duplicates_csv = "outputs/mapping/1. Duplicates.csv"
+    reextract_folder(
+        sys.argv[1] if len(sys.argv) > 1 else "outputs/Google", workers=None,
+        duplicates=load_duplicates(duplicates_csv) if os.path.isfile(duplicates_csv) else None,
+    )
@@ -0,0 +1,69 @@
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from computer_vision.backends import vision_table
+from computer_vision.result_log import VISION_COLUMNS
+from computer_vision.submission import LoadedImage
+from pipeline.storage import read_table, table_exists
+
+# Tempo de cada chamada do anotador de reprodução: REPLAY_LATENCY + REPLAY_LATENCY_PER_IMAGE por imagem,
+# variando aleatoriamente até +-REPLAY_JITTER (fração do tempo)
+REPLAY_LATENCY = 0.5
+REPLAY_LATENCY_PER_IMAGE = 0.01
+REPLAY_JITTER = 0.2
+
+
+def load_recorded(folder: str, datasets: List[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Linhas gravadas por ID, das tabelas de resultado dos datasets ('rede-perfil') na pasta.
+    Só as tabelas por rede e perfil são lidas (não as agregadas, como '1. Vision-full'); de cada dataset vale a
+    mesma tabela que a anotação usaria (vision_table): a de nome novo, ou a '1. GoogleVision-*' se só ela existir.
+    """
+    recorded = {}
+    for dataset in datasets:
+        path = vision_table(folder, dataset)
+        if not table_exists(path):
+            continue
+        df = read_table(path, columns=VISION_COLUMNS)
+        df['ID'] = df['ID'].astype(str)
+        for file_id, rows in df.groupby('ID', sort=False, observed=True):
+            recorded[file_id] = rows
+    return recorded
+
+
+def replay_annotator(
+    folder: str,
+    datasets: List[str],
+    latency: float = REPLAY_LATENCY,
+    latency_per_image: float = REPLAY_LATENCY_PER_IMAGE,
+    jitter: float = REPLAY_JITTER,
+    seed: int = 0,
+) -> Callable[[List[LoadedImage]], pd.DataFrame]:
+    """
+    Anotador que devolve as respostas já gravadas dos datasets (tabelas de resultado de 'folder', ex.: outputs/Google,
+    ver load_recorded), com uma latência sintética. Mesmo formato de google_vision.annotate_images, sem credenciais
+    nem rede: serve para testar a carga e a concorrência da etapa de anotação (in_flight, cota, tamanho dos lotes)
+    de ponta a ponta.
+    IDs sem resposta gravada voltam sem linhas (como uma imagem sem tags).
+    """
+    recorded = load_recorded(folder, datasets)
+    print(f"Anotador de reprodução: {len(recorded)} respostas gravadas em {folder}")
+    lock = threading.Lock()
+    generator = random.Random(seed)
+    empty = pd.DataFrame(columns=VISION_COLUMNS)
+
+    def annotate(images: List[LoadedImage]) -> pd.DataFrame:
+        with lock:
+            factor = 1 + generator.uniform(-jitter, jitter)
+        time.sleep(max(0.0, (latency + latency_per_image * len(images)) * factor))
+        frames = [recorded[file_id] for file_id, _, _ in images if file_id in recorded]
+        missing = len(images) - len(frames)
+        if missing:
+            print(f"Anotador de reprodução: {missing} de {len(images)} imagens sem resposta gravada")
+        return pd.concat(frames, ignore_index=True)[VISION_COLUMNS] if frames else empty.copy()
+
+    return annotate
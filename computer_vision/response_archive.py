@@ -0,0 +1,88 @@
+import itertools
+import os
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+
+def _write_varint(value: int) -> bytes:
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+class ResponseArchive:
+    """
+    Arquivo das respostas completas da API (AnnotateImageResponse serializada), para que as tabelas
+    '1. Vision-*' do Google possam ser refeitas sem a API (ver computer_vision/reextract.py).
+
+    Cada lote vira um arquivo 'batch-*.pb' na pasta do arquivo, no formato "delimitado" do protobuf:
+    para cada imagem, [tamanho (varint)][ID em utf-8][tamanho (varint)][resposta serializada].
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.prefix = time.strftime('%Y%m%d-%H%M%S')
+
+    def write(self, records: List[Tuple[str, bytes]]) -> str:
+        """ Grava um lote de (ID, resposta serializada). Retorna o caminho do arquivo """
+        if not records:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            path = os.path.join(self.directory, f"batch-{self.prefix}-{next(self.counter):06d}.pb")
+        data = bytearray()
+        for file_id, response in records:
+            file_id = str(file_id).encode('utf-8')
+            data += _write_varint(len(file_id)) + file_id + _write_varint(len(response)) + response
+        with open(path + '.tmp', 'wb') as obj:
+            obj.write(data)
+            obj.flush()
+            os.fsync(obj.fileno())
+        os.replace(path + '.tmp', path)
+        return path
+
+
+def archive_dir(path_vision: str) -> str:
+    """ Pasta do arquivo de respostas de uma tabela da visão computacional """
+    return f"{path_vision}.archive"
+
+
+def archive_files(directory: str) -> List[str]:
+    """ Arquivos de lote do arquivo, em ordem de gravação """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.pb')]
+
+
+def read_batch(path: str) -> Iterator[Tuple[str, bytes]]:
+    """ (ID, resposta serializada) de cada imagem de um arquivo de lote """
+    with open(path, 'rb') as obj:
+        data = obj.read()
+    position = 0
+    while position < len(data):
+        size, position = _read_varint(data, position)
+        file_id = data[position:position + size].decode('utf-8')
+        position += size
+        size, position = _read_varint(data, position)
+        yield file_id, data[position:position + size]
+        position += size
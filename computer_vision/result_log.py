@@ -0,0 +1,114 @@
+import json
+import os
+from typing import Set
+
+import pandas as pd
+
+from pipeline.storage import read_table, replace_table, table_exists
+
+VISION_COLUMNS = ['ID', 'Class', 'Percent', 'Subclass']
+
+
+def _append(path: str, text: str) -> None:
+    """
+    Acrescenta o texto ao arquivo e só retorna depois que ele estiver gravado no disco.
+    Se o arquivo terminar com uma linha incompleta (escrita interrompida), o texto começa em uma nova linha.
+    """
+    with open(path, 'ab+') as obj:
+        if obj.tell() > 0:
+            obj.seek(-1, os.SEEK_END)
+            if obj.read(1) != b'\n':
+                text = '\n' + text
+        obj.write(text.encode('utf-8'))
+        obj.flush()
+        os.fsync(obj.fileno())
+
+
+class VisionResultLog:
+    """
+    Gravação incremental dos resultados da visão computacional de uma tabela (ex.: '1. Vision-facebook-lula').
+
+    Cada lote é acrescentado, em uma única linha, ao log '<tabela>.log.jsonl'; depois disso os IDs do lote
+    são acrescentados ao checkpoint '<tabela>.done'. A tabela final só é montada uma vez, em consolidate().
+
+    Se a execução for interrompida, o log e o checkpoint continuam válidos: a próxima execução pula os IDs
+    do checkpoint e a consolidação aproveita os lotes já gravados. Uma linha incompleta no fim do log
+    (interrupção durante a escrita) é ignorada, e o lote correspondente é enviado de novo.
+    """
+
+    def __init__(self, path_vision: str):
+        self.path_vision = path_vision
+        self.log_path = f"{path_vision}.log.jsonl"
+        self.checkpoint_path = f"{path_vision}.done"
+
+    def completed_ids(self) -> Set[str]:
+        """ IDs já anotados (lidos do checkpoint; criado a partir da tabela existente na primeira vez) """
+        if not os.path.isfile(self.checkpoint_path):
+            ids = []
+            if table_exists(self.path_vision):
+                ids = read_table(self.path_vision, columns=['ID'])['ID'].astype(str).unique()
+            _append(self.checkpoint_path, ''.join(f"{file_id}\n" for file_id in ids))
+        with open(self.checkpoint_path, encoding='utf-8') as obj:
+            return {line.rstrip('\n') for line in obj if line.endswith('\n') and line.strip()}
+
+    def forget(self, ids) -> None:
+        """ Retira IDs do checkpoint (ex.: imagens alteradas), para que sejam anotados de novo """
+        ids = set(map(str, ids))
+        if not ids:
+            return
+        completed = self.completed_ids()
+        if not ids & completed:
+            return
+        temporary = f"{self.checkpoint_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as obj:
+            obj.write(''.join(f"{file_id}\n" for file_id in completed - ids))
+            obj.flush()
+            os.fsync(obj.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def append(self, results_df: pd.DataFrame) -> None:
+        """ Grava o resultado de um lote (linhas ID/Class/Percent/Subclass) """
+        if results_df.empty:
+            return
+        results_df = results_df[VISION_COLUMNS].astype({'ID': str})
+        ids = results_df['ID'].unique().tolist()
+        record = {'ids': ids, 'rows': results_df.values.tolist()}
+        _append(self.log_path, json.dumps(record, ensure_ascii=False, default=float) + '\n')
+        _append(self.checkpoint_path, ''.join(f"{file_id}\n" for file_id in ids))
+
+    def _logged_rows(self) -> pd.DataFrame:
+        """ Linhas dos lotes completos do log (se um ID aparecer em mais de um lote, vale o último) """
+        rows_by_id = {}
+        with open(self.log_path, encoding='utf-8') as obj:
+            for line in obj:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                batch_rows = {file_id: [] for file_id in record['ids']}
+                for row in record['rows']:
+                    batch_rows[row[0]].append(row)
+                rows_by_id.update(batch_rows)
+        rows = [row for file_rows in rows_by_id.values() for row in file_rows]
+        return pd.DataFrame(rows, columns=VISION_COLUMNS)
+
+    def consolidate(self) -> str:
+        """
+        Junta os lotes do log à tabela de resultados e apaga o log.
+        A tabela é gravada em um arquivo temporário e depois substituída, para nunca ficar pela metade.
+        Retorna o caminho da tabela, ou None se não havia nada a consolidar.
+        """
+        if not os.path.isfile(self.log_path):
+            return None
+
+        new_rows = self._logged_rows()
+        if table_exists(self.path_vision):
+            data = read_table(self.path_vision)
+            data['ID'] = data['ID'].astype(str)
+            data = data.loc[~data['ID'].isin(new_rows['ID'])]
+            new_rows = pd.concat([data, new_rows], ignore_index=True)
+
+        output = replace_table(new_rows, self.path_vision)
+        os.remove(self.log_path)
+        print(f"{len(new_rows)} linhas consolidadas em {output}")
+        return output
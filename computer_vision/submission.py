@@ -0,0 +1,244 @@
+import inspect
+import io
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import pandas as pd
+from PIL import Image, ImageOps
+
+# Quantidade de lotes enviados ao mesmo tempo para a API
+VISION_IN_FLIGHT = 4
+# Limite de imagens por minuto (a cota padrão do Google Vision é de 1800 imagens/minuto)
+VISION_IMAGES_PER_MINUTE = 1800
+# Novas tentativas de um lote quando a API responde com erro de cota, e espera inicial (dobra a cada tentativa)
+VISION_MAX_RETRIES = 6
+VISION_BACKOFF_SECONDS = 2.0
+
+# Antes do envio, imagens com o maior lado acima de VISION_MAX_EDGE pixels são reduzidas e regravadas em JPEG
+# com qualidade VISION_JPEG_QUALITY (None envia os arquivos originais). Leitura em VISION_LOAD_THREADS threads.
+VISION_MAX_EDGE = 1600
+VISION_JPEG_QUALITY = 85
+VISION_LOAD_THREADS = 4
+# Tamanho máximo (bytes de imagem) de um lote enviado; lotes maiores são divididos
+VISION_MAX_BATCH_BYTES = 8 * 1024 ** 2
+
+# Códigos de erro que indicam cota excedida/serviço sobrecarregado: o lote é reenviado depois de uma espera
+RETRY_STATUS_CODES = (429, 503)
+RETRY_STATUS_NAMES = ('RESOURCE_EXHAUSTED', 'UNAVAILABLE')
+
+# Imagem lida do disco: (ID, caminho do arquivo, conteúdo)
+LoadedImage = Tuple[str, str, bytes]
+
+
+def prepare_image(path: str, max_edge: int = VISION_MAX_EDGE, quality: int = VISION_JPEG_QUALITY) -> bytes:
+    """
+    Bytes a enviar para a API: a imagem reduzida para no máximo 'max_edge' pixels no maior lado e
+    regravada em JPEG. JPEGs que já são pequenos o bastante são enviados como estão.
+    """
+    with open(path, 'rb') as image_file:
+        content = image_file.read()
+    if not max_edge:
+        return content
+    with Image.open(io.BytesIO(content)) as image:
+        if image.format == 'JPEG' and max(image.size) <= max_edge:
+            return content
+        # JPEG: decodifica já em escala reduzida (1/2, 1/4 ou 1/8), bem mais rápido que decodificar tudo
+        scale = max_edge / max(image.size)
+        image.draft('RGB', (int(image.size[0] * scale), int(image.size[1] * scale)))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        output = io.BytesIO()
+        image.convert('RGB').save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def load_images(
+    image_df: pd.DataFrame,
+    max_edge: int = VISION_MAX_EDGE,
+    quality: int = VISION_JPEG_QUALITY,
+    threads: int = VISION_LOAD_THREADS,
+) -> List[LoadedImage]:
+    """
+    Lê (e reduz, ver prepare_image) as imagens de um lote (colunas 'ID' e 'File') em várias threads,
+    pulando os arquivos que não puderam ser lidos
+    """
+    def load(file_id, path):
+        try:
+            return file_id, path, prepare_image(path, max_edge, quality)
+        except FileNotFoundError:
+            print(f"Arquivo não encontrado, pulando: {path}")
+        except Exception as e:
+            print(f"Erro ao ler o arquivo {path}: {e}")
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        images = executor.map(load, image_df['ID'], image_df['File'])
+        return [image for image in images if image is not None]
+
+
+def split_by_bytes(images: List[LoadedImage], max_bytes: int = VISION_MAX_BATCH_BYTES) -> Iterator[List[LoadedImage]]:
+    """ Divide um lote em partes de no máximo 'max_bytes' bytes de imagem (uma imagem maior que isso vai sozinha) """
+    batch, size = [], 0
+    for image in images:
+        if batch and max_bytes and size + len(image[2]) > max_bytes:
+            yield batch
+            batch, size = [], 0
+        batch.append(image)
+        size += len(image[2])
+    if batch:
+        yield batch
+
+
+class RateLimiter:
+    """
+    Distribui as chamadas no tempo para não passar de 'per_minute' imagens por minuto.
+    Compartilhado entre as threads; hold() faz todas esperarem (usado quando a API avisa que a cota acabou).
+    """
+
+    def __init__(self, per_minute: float = None):
+        self.interval = 60 / per_minute if per_minute else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: int = 1) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + amount * self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def hold(self, seconds: float) -> None:
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + seconds)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """ True para erros de cota/sobrecarga (google.api_core: ResourceExhausted, ServiceUnavailable; grpc: RpcError) """
+    code = getattr(error, 'code', None)
+    if callable(code):
+        code = code()
+    return code in RETRY_STATUS_CODES or getattr(code, 'name', None) in RETRY_STATUS_NAMES
+
+
+def charges_quota(annotate: Callable) -> bool:
+    """
+    True se a função de anotação recebe o parâmetro 'acquire' (ex.: google_vision.annotate_images): ela mesma
+    desconta da cota só as imagens que realmente envia (as que vieram do cache de anotações não contam)
+    """
+    try:
+        return 'acquire' in inspect.signature(annotate).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def annotate_with_retry(
+    annotate: Callable[[List[LoadedImage]], pd.DataFrame],
+    images: List[LoadedImage],
+    limiter: RateLimiter,
+    max_retries: int = VISION_MAX_RETRIES,
+    backoff: float = VISION_BACKOFF_SECONDS,
+) -> Tuple[pd.DataFrame, int]:
+    """ Envia um lote respeitando o limite de taxa; em erro de cota espera (backoff exponencial) e tenta de novo """
+    charged_by_annotate = charges_quota(annotate)
+    for attempt in range(max_retries + 1):
+        try:
+            if charged_by_annotate:
+                return annotate(images, acquire=limiter.acquire), attempt
+            limiter.acquire(len(images))
+            return annotate(images), attempt
+        except Exception as error:
+            if not is_quota_error(error) or attempt == max_retries:
+                raise
+            delay = min(backoff * 2 ** attempt, 64) + random.uniform(0, backoff)
+            print(f"Cota da API excedida ({error}); nova tentativa em {delay:.1f}s")
+            limiter.hold(delay)
+
+
+def submit_batches(
+    batches: Iterable[pd.DataFrame],
+    annotate: Callable[[List[LoadedImage]], pd.DataFrame],
+    on_result: Callable[[pd.DataFrame], None],
+    in_flight: int = VISION_IN_FLIGHT,
+    images_per_minute: float = VISION_IMAGES_PER_MINUTE,
+    max_retries: int = VISION_MAX_RETRIES,
+    backoff: float = VISION_BACKOFF_SECONDS,
+    max_batch_bytes: int = VISION_MAX_BATCH_BYTES,
+    load: Callable[[pd.DataFrame], List[LoadedImage]] = load_images,
+) -> Dict[str, Any]:
+    """
+    Envia os lotes de imagens com até 'in_flight' lotes aguardando a API ao mesmo tempo.
+
+    batches: lotes com as colunas 'ID' e 'File'
+    annotate: função que recebe as imagens lidas de um lote e devolve as linhas ID/Class/Percent/Subclass
+              (computer_vision.google_vision.annotate_images, ou computer_vision.fake_vision.fake_annotator para testes).
+              Se ela tiver o parâmetro 'acquire', recebe a função do limite de taxa e a chama só para as imagens
+              enviadas (ver charges_quota); senão o lote inteiro é descontado antes da chamada
+    on_result: recebe o resultado de cada lote, sempre na thread principal (pode salvar em arquivo sem lock)
+    max_batch_bytes: lotes com mais bytes de imagem que isso são divididos antes do envio
+    load: função que lê as imagens de um lote (padrão: load_images, que reduz as imagens grandes)
+
+    Os bytes do próximo lote são lidos enquanto os anteriores esperam a resposta.
+    Um lote que falha (depois das novas tentativas) é só informado: suas imagens ficam para a próxima execução.
+    Retorna um resumo com a quantidade de lotes, imagens, bytes enviados, novas tentativas, falhas,
+    o tempo total e o tempo de cada lote.
+    """
+    batches = iter(batches)
+    limiter = RateLimiter(images_per_minute)
+    summary = {'batches': 0, 'images': 0, 'bytes': 0, 'retries': 0, 'failed': 0, 'time': 0.0, 'batch_times': []}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=max(1, in_flight)) as sender:
+        def read_next():
+            batch = next(batches, None)
+            return None if batch is None else reader.submit(load, batch)
+
+        def send(images):
+            batch_start = time.perf_counter()
+            results_df, retries = annotate_with_retry(annotate, images, limiter, max_retries, backoff)
+            return results_df, retries, time.perf_counter() - batch_start
+
+        reading = read_next()
+        ready = deque()
+        sending = {}
+        while reading is not None or ready or sending:
+            # Completa a janela de lotes em voo; a leitura do lote seguinte começa logo em seguida
+            while len(sending) < max(1, in_flight) and (ready or reading is not None):
+                if not ready:
+                    ready.extend(split_by_bytes(reading.result(), max_batch_bytes))
+                    reading = read_next()
+                    continue
+                images = ready.popleft()
+                sending[sender.submit(send, images)] = images
+            if not sending:
+                continue
+
+            done, _ = wait(sending, return_when=FIRST_COMPLETED)
+            for future in done:
+                images = sending.pop(future)
+                summary['batches'] += 1
+                try:
+                    results_df, retries, batch_time = future.result()
+                except Exception as error:
+                    summary['failed'] += len(images)
+                    print(f"Erro ao enviar lote de {len(images)} imagens ({images[0][1]} ...): {error}")
+                    continue
+                summary['images'] += len(images)
+                summary['bytes'] += sum(len(content) for _, _, content in images)
+                summary['retries'] += retries
+                summary['batch_times'].append(batch_time)
+                on_result(results_df)
+                print(f"Lote de {len(images)} imagens concluído em {batch_time:.1f}s ({summary['images']} imagens até agora)")
+
+    summary['time'] = time.perf_counter() - start
+    rate = summary['images'] / summary['time'] * 60 if summary['time'] else 0
+    print(
+        f"Visão computacional: {summary['images']} imagens ({summary['bytes'] / 1024 ** 2:.1f} MB) em "
+        f"{summary['batches']} lotes, {summary['time']:.1f}s ({rate:.0f} imagens/min), "
+        f"{summary['retries']} novas tentativas, {summary['failed']} imagens com falha"
+    )
+    return summary
@@ -1,46 +1,43 @@
 import os
 import pandas as pd
-from typing import List
+from typing import Callable
 # from computer_vision.google_vision import load_labels # Import para o código antigo
-from computer_vision.google_vision import process_images_batch
+from computer_vision.submission import submit_batches, VISION_IN_FLIGHT, VISION_IMAGES_PER_MINUTE, VISION_MAX_BATCH_BYTES
+from computer_vision.backends import get_backend
+from computer_vision.result_log import VisionResultLog
+from computer_vision.dedup import copy_annotations
+from computer_vision.file_index import scan_images
 
-def load_data(path: str, extension: str) -> List[str] : 
-  """ extension: '.jpg' or '.mp4' or '.jpeg' """
-  if not os.path.isdir(path):
-      print(f"AVISO: O diretório de entrada não foi encontrado: '{path}'. Pulando esta combinação de perfil/rede.")
-      return []
-      
-  data = list(filter(
-    lambda item: item.find(extension) >= 0,
-    [ path+'/'+item for item in os.listdir(path)],
-  ))
-  
-  return data
+def create_file_id(path_files, file_csv: str, perfil: str, index_path: str = None, full_scan: bool = False) -> pd.DataFrame:
+  """
+    Writes the mapping file (columns ID and File) of the images of 'path_files', searched recursively
+    (extensions in computer_vision/file_index.py, in any case).
+    index_path: persistent index of the folder (default: file_csv with '.index.json'); only the folders changed
+                since the last run are listed again, and the mapping file is only rewritten if its contents changed
+    full_scan: also checks the files of the unchanged folders (finds images overwritten in place)
+    Returns the delta since the last run: columns ID, File and Change ('new', 'removed' or 'modified')
+  """
+  if index_path is None:
+    index_path = f"{os.path.splitext(file_csv)[0]}.index.json"
+  if not os.path.isdir(path_files):
+    print(f"AVISO: O diretório de entrada não foi encontrado: '{path_files}'. Pulando esta combinação de perfil/rede.")
 
-def extractID(file: str, exetension: str, path: str) -> str:
-  file = file.replace(exetension, '')
-  file = file.replace(path+'/', '')
-  return file
+  data, delta = scan_images(path_files, index_path, perfil, full=full_scan)
 
-def create_file_id(path_files, file_csv: str, perfil: str):
-  
-  files : List[str]= []
-  files.extend(load_data(path_files, '.jpg'))
-
-  data = []
-  for file in files:
-    data.append({'File': file, 'ID':extractID(file, '.jpg', path_files)})
-      
-  # Garante que o DataFrame sempre tenha as colunas 'ID' e 'File', mesmo que esteja vazio
-  data = pd.DataFrame(data, columns=['ID', 'File'])
-  
   if data.empty:
-      print(f"AVISO: Nenhuma imagem encontrada em '{path_files}'. Criando arquivo de mapeamento vazio para este perfil/rede.")
-      data.to_csv(file_csv, index=False) # Salva um DataFrame vazio com cabeçalhos
-      return
+    print(f"AVISO: Nenhuma imagem encontrada em '{path_files}'. Criando arquivo de mapeamento vazio para este perfil/rede.")
+  elif not delta.empty:
+    counts = delta['Change'].value_counts()
+    print(f"{path_files}: {len(data)} imagens ({counts.get('new', 0)} novas, {counts.get('removed', 0)} removidas, "
+          f"{counts.get('modified', 0)} alteradas)")
 
-  data["ID"] = data["ID"].apply(lambda x: x.replace(perfil, ""))
-  data[["ID", "File"]].to_csv(file_csv, index=False)
+  # Garante que o arquivo sempre tenha as colunas 'ID' e 'File', mesmo que esteja vazio.
+  # A comparação é com o arquivo gravado, não com o delta: na primeira execução com o índice (ou com a pasta
+  # ausente) o delta pode estar vazio e o arquivo antigo ainda ter linhas de outra varredura.
+  current = pd.read_csv(file_csv, dtype=str) if os.path.isfile(file_csv) else None
+  if current is None or list(current.columns) != ["ID", "File"] or not current.equals(data[["ID", "File"]].astype(str)):
+    data[["ID", "File"]].to_csv(file_csv, index=False)
+  return delta
 
 # def send_to_google(data_entry: pd.DataFrame, path: str, vision: int) -> None:
 #   """
@@ -63,64 +60,92 @@ def create_file_id(path_files, file_csv: str, perfil: str):
 #       data.to_excel(path + ".xlsx", index=False)
 
 
-def save_vision_results(df: pd.DataFrame, path: str):
-    """Salva os resultados da visão computacional em CSV e Excel."""
-    output_path_csv = path
-    if not output_path_csv.endswith('.csv'):
-        output_path_csv += '.csv'
-    
-    output_path_xlsx = output_path_csv.replace('.csv', '.xlsx')
-
-    if os.path.isfile(output_path_csv):
-        existing_data = pd.read_csv(output_path_csv)
-        df = pd.concat([existing_data, df], ignore_index=True)
-
-    df.to_csv(output_path_csv, index=False)
-    df.to_excel(output_path_xlsx, index=False)
-      
 def send_imagens_API(
   file_id: str,
   metadada: pd.DataFrame,
-  vision: int =1,
-  path_vision: str='Vision.csv',
-  fake: bool = True
+  vision: str = "google",
+  path_vision: str='Vision',
+  fake: bool = True,
+  annotate: Callable = None,
+  in_flight: int = VISION_IN_FLIGHT,
+  images_per_minute: float = VISION_IMAGES_PER_MINUTE,
+  batch_size: int = 100,
+  max_batch_bytes: int = VISION_MAX_BATCH_BYTES,
+  duplicates: pd.DataFrame = None,
   ) -> None:
   """ 
-    vision: 1 for google or 2 for amazon
-    path: path file vision in csv
+    vision: name of the backend in computer_vision/backends.py ("google", "local", "fake" or "replay");
+            the old codes 1 (google) and 3 (local) are also accepted
+    path_vision: path of the vision table (without extension), see computer_vision.backends.vision_table
+    fake: if True, no image is sent (reanalysis of the existing results)
+    annotate: function that annotates a batch of loaded images (default: the one of the 'vision' backend).
+              Ex.: computer_vision.fake_vision.fake_annotator() to test without credentials
+    in_flight: number of batches waiting for the API at the same time
+    images_per_minute: rate limit (API quota)
+    batch_size, max_batch_bytes: a batch has at most batch_size images and max_batch_bytes bytes
+      (images are downscaled before sending, see computer_vision/submission.py)
+    duplicates: images of this table that are near-duplicates of another image (computer_vision/dedup.py, copies_of).
+      They are not sent: they get the annotations of their representative, which must already be annotated
+      (only when fake is False; a reanalysis never changes the vision tables)
   """
   
-  path_vision += '.csv'
-  if vision == 1: 
-    if not os.path.isfile(path_vision):
-      data = pd.DataFrame([], columns=['ID', 'Class', 'Percent','Subclass',])
-    else:
-      data = pd.read_csv(path_vision)     
-      data['ID'] = data['ID'].apply(str)
-  elif vision == 2:
-    if not os.path.isfile(path_vision):
-      data = pd.DataFrame([], columns=['ID', 'Class', 'Percent','Subclass',])
-    else:
-      data = pd.read_csv(path_vision)
-      data['ID'] = data['ID'].apply(str)
+  # Resultados gravados lote a lote; o checkpoint diz quais IDs já foram anotados
+  # (não é preciso ler a tabela inteira de resultados)
+  result_log = VisionResultLog(path_vision)
+  completed = result_log.completed_ids()
       
-  data_file_id = pd.read_csv(file_id)
-  data_file_id['ID'] == data_file_id['ID'].apply(str)
+  data_file_id = pd.read_csv(file_id, dtype={'ID': str})
   data_file_id = data_file_id.loc[data_file_id['ID'].isin(metadada['ID'])]
 
-  data_entry = data_file_id.loc[~data_file_id['ID'].isin(data['ID'])]
+  data_entry = data_file_id.loc[~data_file_id['ID'].isin(completed)]
+
+  copies = None
+  if duplicates is not None:
+    # Quase duplicatas: só o representante de cada grupo vai para a visão computacional
+    copies = duplicates.loc[duplicates['ID'].isin(data_entry['ID'])]
+    data_entry = data_entry.loc[~data_entry['ID'].isin(copies['ID'])]
   
-  k=100
+  k=batch_size
+
+  backend = None
+  if not fake and len(data_entry) > 0 and annotate is None:
+    try:
+      backend = get_backend(vision)
+    except ValueError as e:
+      print(f"AVISO: {e}; nenhuma imagem enviada.")
+    else:
+      annotate = backend.create(path_vision)
+      if not backend.rate_limited:
+        # sem cota: o paralelismo fica no próprio backend
+        in_flight, images_per_minute = 1, None
+
+  if not fake and len(data_entry) > 0 and annotate is not None:
+    # Lógica nova com processamento em lote: vários lotes enviados ao mesmo tempo,
+    # e os resultados acrescentados ao log conforme cada lote termina
+    print(f"Enviando {len(data_entry)} imagens em lotes de {k} ({in_flight} lotes simultâneos)...")
+    try:
+      submit_batches(
+        (data_entry.iloc[i:i+k] for i in range(0, len(data_entry), k)),
+        annotate,
+        on_result=result_log.append,
+        in_flight=in_flight,
+        images_per_minute=images_per_minute,
+        max_batch_bytes=max_batch_bytes,
+      )
+    finally:
+      # O anotador criado pelo backend é encerrado (ex.: processos de inferência do anotador local)
+      if backend is not None and hasattr(annotate, 'close'):
+        annotate.close()
+    # A chamada para a função antiga seria dentro de um loop por lote:
+    # send_to_google(data_entry[d-k: d], path=path_vision, vision=vision)
+    if backend is not None and backend.report is not None:
+      backend.report()
+
+  # Monta a tabela final uma única vez (também recupera os lotes de uma execução interrompida)
+  result_log.consolidate()
 
-  if not fake:
-    for i in range(0, len(data_entry), k):
-      # Lógica nova com processamento em lote
-      batch = data_entry.iloc[i:i+k]
-      print(f"Processando lote de {len(batch)} imagens... Restam {len(data_entry) - (i+len(batch))} imagens.")
-      if vision == 1:
-        results_df = process_images_batch(batch)
-        if not results_df.empty:
-          save_vision_results(results_df, path_vision)
-      # A chamada para a função antiga seria aqui, dentro do loop:
-      # send_to_google(data_entry[d-k: d], path=path_vision, vision=vision)
- 
+  if not fake and copies is not None and len(copies) > 0:
+    # Só quando há envio: na reanálise (fake=True) as tabelas da visão computacional não são alteradas.
+    # Representantes desta tabela acabaram de ser consolidados; os das outras tabelas já foram anotados antes
+    if copy_annotations(copies, os.path.dirname(path_vision), result_log):
+      result_log.consolidate()
@@ -0,0 +1,179 @@
+import datetime
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, List
+
+from pipeline.storage import EXTENSIONS, find_table, strip_extension
+
+
+class StageCache:
+    """
+    Cache of the pipeline stages, kept in a JSON manifest.
+
+    The key of a stage is a hash of the contents of its input files plus its parameters.
+    A stage is skipped when the key did not change and the outputs recorded in its last run
+    are still there, unchanged. As the outputs of a stage are the inputs of the next ones,
+    only the stages downstream of a change are recomputed.
+
+    Hashes of the files are remembered by (size, modification time), so unchanged files
+    are not read again.
+
+    The declared outputs of a stage are removed before it runs again: a rerun that legitimately
+    writes nothing (e.g. no test when the target is normally distributed) does not leave the
+    output of an older run behind for the next stages.
+    """
+
+    def __init__(self, manifest_path: str, enabled: bool = True):
+        self.manifest_path = manifest_path
+        self.enabled = enabled
+        self.manifest = {'stages': {}, 'files': {}}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as obj:
+                self.manifest.update(json.load(obj))
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+
+    # ---- hashes ----
+
+    def file_hash(self, path: str) -> str:
+        """ sha256 of a file (or of the listing of a directory: names, sizes and dates) """
+        if os.path.isdir(path):
+            entries = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file in sorted(files):
+                    stat = os.stat(os.path.join(root, file))
+                    entries.append((os.path.relpath(os.path.join(root, file), path), stat.st_size, stat.st_mtime_ns))
+            return hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+
+        stat = os.stat(path)
+        remembered = self.manifest['files'].get(path)
+        if remembered and remembered[0] == stat.st_size and remembered[1] == stat.st_mtime_ns:
+            return remembered[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as obj:
+            for block in iter(lambda: obj.read(1 << 20), b''):
+                sha.update(block)
+        self.manifest['files'][path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def _resolve(self, path: str) -> str:
+        """ Path of an existing file/directory, also accepting table names without extension """
+        if os.path.exists(path):
+            return path
+        try:
+            return find_table(path)
+        except FileNotFoundError:
+            return None
+
+    def key(self, inputs: List[str], params: Dict[str, Any] = None) -> str:
+        """ Hash of the input files and the parameters of a stage """
+        items = []
+        for path in inputs:
+            file = self._resolve(path)
+            items.append((path, self.file_hash(file) if file else None))
+        items.append(json.dumps(params or {}, sort_keys=True, default=str))
+        return hashlib.sha256(json.dumps(items).encode()).hexdigest()
+
+    # ---- stages ----
+
+    def clear_outputs(self, outputs: List[str], keep: List[str] = None) -> None:
+        """ Removes the files of the outputs (tables in every format), except the ones in 'keep' """
+        keep = {strip_extension(path) for path in keep or []}
+        for path in outputs:
+            if strip_extension(path) in keep:
+                continue
+            if os.path.isfile(path):
+                os.remove(path)
+            for extension in EXTENSIONS.values():
+                if os.path.isfile(strip_extension(path) + extension):
+                    os.remove(strip_extension(path) + extension)
+
+    def is_fresh(self, stage: str, inputs: List[str], params: Dict[str, Any] = None) -> bool:
+        """ True if the stage ran before with the same inputs/parameters and its outputs are unchanged """
+        entry = self.manifest['stages'].get(stage)
+        if not self.enabled or entry is None or entry['key'] != self.key(inputs, params):
+            return False
+        for path, hash in entry['outputs'].items():
+            file = self._resolve(path)
+            if file is None or self.file_hash(file) != hash:
+                return False
+        return True
+
+    def store(self, stage: str, inputs: List[str], outputs: List[str], params: Dict[str, Any] = None) -> None:
+        """ Records a stage that has just run, with the outputs it produced """
+        recorded = {}
+        for path in outputs:
+            file = self._resolve(path)
+            if file is not None:
+                recorded[path] = self.file_hash(file)
+        self.manifest['stages'][stage] = {
+            'key': self.key(inputs, params),
+            'outputs': recorded,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def run(
+        self, stage: str, function: Callable, inputs: List[str], outputs: List[str], params: Dict[str, Any] = None,
+        keep: List[str] = None,
+    ) -> Any:
+        """
+        Runs 'function()' unless the stage is fresh. Returns the result of the function, or None if skipped.
+        keep: outputs that the function updates instead of rewriting (e.g. the tag vocabulary), not removed before it runs
+        """
+        if self.is_fresh(stage, inputs, params):
+            self.hits.append(stage)
+            print(f"[cache] '{stage}' sem alterações, etapa pulada")
+            return None
+        self.misses.append(stage)
+        self.clear_outputs(outputs, keep)
+        result = function()
+        self.store(stage, inputs, outputs, params)
+        self.save()
+        return result
+
+    def pending(
+        self, stage: str, jobs: Dict[str, List[str]], params: Dict[str, Any] = None, outputs: Dict[str, List[str]] = None
+    ) -> List[str]:
+        """
+        For stages that run once per dataset (with pipeline.parallel.run_parallel).
+        jobs: dictionary with dataset:inputs
+        outputs: dictionary with dataset:outputs; the outputs of the datasets to recompute are removed
+        Returns the datasets that must be recomputed; call store_all() with the summary after running them.
+        """
+        stale = []
+        for name, inputs in jobs.items():
+            if self.is_fresh(f"{stage}/{name}", inputs, params):
+                self.hits.append(f"{stage}/{name}")
+            else:
+                self.misses.append(f"{stage}/{name}")
+                self.clear_outputs((outputs or {}).get(name, []))
+                stale.append(name)
+        print(f"[cache] '{stage}': {len(jobs) - len(stale)} dataset(s) sem alterações, {len(stale)} a recalcular")
+        return stale
+
+    def store_all(
+        self, stage: str, jobs: Dict[str, List[str]], summary: List[Dict[str, Any]], params: Dict[str, Any] = None
+    ) -> None:
+        """
+        Records the datasets of a run_parallel summary. The result of each job is the path of the
+        table it wrote (or None, if it wrote nothing). Jobs that failed are not recorded, so they run again.
+        """
+        for job in summary:
+            if job['error'] or job['name'] not in jobs:
+                continue
+            outputs = [job['result']] if job['result'] else []
+            self.store(f"{stage}/{job['name']}", jobs[job['name']], outputs, params)
+        self.save()
+
+    def save(self) -> None:
+        """ Writes the manifest, with the hits and misses of the current run """
+        self.manifest['last_run'] = {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+        with open(self.manifest_path, 'w') as obj:
+            obj.write(json.dumps(self.manifest, indent=2))
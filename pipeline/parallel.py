@@ -0,0 +1,60 @@
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _timed_call(function: Callable, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """ Runs one job, capturing the result (or the error) and the wall time """
+    start = time.perf_counter()
+    try:
+        result = function(**kwargs)
+        error = None
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    return {'result': result, 'error': error, 'time': time.perf_counter() - start}
+
+
+def run_parallel(
+    function: Callable, jobs: Dict[str, Dict[str, Any]], workers: Optional[int] = 1, title: str = ''
+) -> List[Dict[str, Any]]:
+    """
+    Runs 'function(**kwargs)' for every job, in a process pool.
+
+    jobs: dictionary with name:kwargs of each job (e.g. one job per dataset file)
+    workers: number of processes. 1 runs the jobs in the current process; None uses all cores
+
+    An error in one job does not stop the others: it is printed and kept in the summary.
+    Returns one entry per job, in the same order as 'jobs', with the keys
+    'name', 'result', 'error' and 'time' (wall time in seconds).
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(jobs)))
+
+    start = time.perf_counter()
+    if workers == 1:
+        outcomes = [_timed_call(function, kwargs) for kwargs in jobs.values()]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_timed_call, function, kwargs) for kwargs in jobs.values()]
+            outcomes = [future.result() for future in futures]
+    total_time = time.perf_counter() - start
+
+    summary = [{'name': name, **outcome} for name, outcome in zip(jobs.keys(), outcomes)]
+    print_summary(summary, total_time, workers, title)
+    return summary
+
+
+def print_summary(summary: List[Dict[str, Any]], total_time: float, workers: int, title: str = '') -> None:
+    """ Prints the wall time of each job and the errors, if any """
+    print(f"\n### {title or 'Jobs'}: {len(summary)} job(s) with {workers} worker(s) in {total_time:.1f}s")
+    for job in summary:
+        status = 'ERRO' if job['error'] else 'ok'
+        print(f"  {job['name']:<40} {job['time']:8.1f}s  {status}")
+    for job in summary:
+        if job['error']:
+            print(f"\nErro em '{job['name']}':\n{job['error']}")
+    print()
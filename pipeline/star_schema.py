@@ -0,0 +1,125 @@
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy import sparse
+
+from pipeline.storage import EXTENSIONS, find_table, read_table, save_table, strip_extension, table_exists
+from pipeline.vocabulary import TAGS_TABLE, TagVocabulary
+
+# Normalized posts are stored as a star schema, one pair of tables per dataset:
+#   '2. Normalized-<dataset>': one row per post (metadata and normalized targets); row i is post_idx i
+#   '2. Post_Tags-<dataset>':  (post_idx, tag_idx) int32 pairs, one per tag of each post
+# plus a copy of the global tag vocabulary '2. Tags' (see pipeline/vocabulary.py), shared by all the
+# datasets of the folder.
+POSTS_PREFIX = "2. Normalized-"
+POST_TAGS_PREFIX = "2. Post_Tags-"
+
+
+def dataset_name(path: str) -> str:
+    """ 'outputs/normalize_posts/2. Normalized-full' -> 'full' """
+    return strip_extension(os.path.basename(path)).replace(POSTS_PREFIX, '')
+
+
+def dataset_tables(folder: str, name: str) -> List[str]:
+    """ Tables (without extension) that make up the dataset 'name': posts, (post, tag) pairs and the vocabulary """
+    return [
+        os.path.join(folder, POSTS_PREFIX + name),
+        os.path.join(folder, POST_TAGS_PREFIX + name),
+        os.path.join(folder, TAGS_TABLE),
+    ]
+
+
+class NormalizedPosts:
+    """
+    Normalized posts of one dataset.
+    - posts:   DataFrame with one row per post
+    - post_idx, tag_idx: int32 arrays with the (post, tag) pairs
+    - tags:    vocabulary; tags[tag_idx] is the name ('Class') of the tag
+    """
+
+    def __init__(self, posts: pd.DataFrame, post_idx: np.ndarray, tag_idx: np.ndarray, tags: np.ndarray):
+        self.posts = posts
+        self.post_idx = post_idx
+        self.tag_idx = tag_idx
+        self.tags = tags
+
+    def incidence(self, format: str = 'csr') -> sparse.spmatrix:
+        """ Binary post x tag matrix (columns in vocabulary order) """
+        matrix = sparse.coo_matrix(
+            (np.ones(len(self.post_idx), dtype=np.float64), (self.post_idx, self.tag_idx)),
+            shape=(len(self.posts), len(self.tags)),
+        )
+        return matrix.asformat(format)
+
+    def encode(self, names) -> np.ndarray:
+        """ Codes of the tag names (-1 for names that are not in the vocabulary) """
+        return pd.Index(self.tags).get_indexer(pd.Series(names, dtype=object)).astype(np.int32)
+
+    def select_tags(self, codes: np.ndarray) -> 'NormalizedPosts':
+        """ Same posts, keeping only the pairs of the tags in 'codes' """
+        keep = np.isin(self.tag_idx, codes)
+        return NormalizedPosts(self.posts, self.post_idx[keep], self.tag_idx[keep], self.tags)
+
+    def present_tags(self) -> np.ndarray:
+        """ Codes of the tags that appear in the dataset, ordered by tag name """
+        codes = np.unique(self.tag_idx)
+        return codes[np.argsort(self.tags[codes], kind='stable')]
+
+    def long(self, columns: List[str] = None) -> pd.DataFrame:
+        """
+        The old one row per (post, tag) format: the post columns (all, or 'columns') plus 'Class'.
+        Only for the analyses that really need it; built on demand.
+        """
+        posts = self.posts if columns is None else self.posts[columns]
+        df = posts.iloc[self.post_idx].reset_index(drop=True)
+        df['Class'] = self.tags[self.tag_idx]
+        return df
+
+
+def _read_int_columns(path: str, columns: List[str]) -> List[np.ndarray]:
+    """ int32 columns of a table; parquet files are memory-mapped and not copied """
+    file = find_table(path)
+    if file.endswith(EXTENSIONS["parquet"]):
+        table = pq.read_table(file, columns=columns, memory_map=True).combine_chunks()
+        return [table.column(column).chunk(0).to_numpy() if table.num_rows else np.empty(0, np.int32) for column in columns]
+    df = read_table(file, columns=columns)
+    return [df[column].to_numpy(np.int32) for column in columns]
+
+
+def read_normalized(path: str, columns: List[str] = None) -> NormalizedPosts:
+    """
+    Loads the dataset '2. Normalized-<dataset>' (path with or without extension).
+    columns: post columns to read (default: all)
+    Tables of older runs, with one row per (post, tag), are also accepted.
+    """
+    folder = os.path.dirname(path)
+    name = dataset_name(path)
+    path_pairs = os.path.join(folder, POST_TAGS_PREFIX + name)
+
+    if table_exists(path_pairs) and table_exists(os.path.join(folder, TAGS_TABLE)):
+        posts = read_table(path, columns=columns)
+        post_idx, tag_idx = _read_int_columns(path_pairs, ['post_idx', 'tag_idx'])
+        return NormalizedPosts(posts, post_idx, tag_idx, TagVocabulary.load(folder).names)
+
+    # formato antigo: uma linha por (post, tag)
+    df = read_table(path, columns=None if columns is None else list(dict.fromkeys(['ID', 'Class'] + columns)))
+    df['ID'] = df['ID'].astype(str)
+    posts = df.drop(columns='Class').drop_duplicates('ID')
+    tags = np.sort(df['Class'].dropna().unique()).astype(object)
+    pairs = df[['ID', 'Class']].dropna().drop_duplicates()
+    post_idx = pd.Index(posts['ID']).get_indexer(pairs['ID']).astype(np.int32)
+    tag_idx = np.searchsorted(tags, pairs['Class'].to_numpy()).astype(np.int32)
+    posts = posts.reset_index(drop=True)
+    return NormalizedPosts(posts if columns is None else posts[columns], post_idx, tag_idx, tags)
+
+
+def save_normalized(folder: str, name: str, posts: pd.DataFrame, post_idx: np.ndarray, tag_idx: np.ndarray) -> List[str]:
+    """ Saves the posts and (post, tag) pairs of a dataset. The vocabulary is saved once, with TagVocabulary.save """
+    pairs = pd.DataFrame({'post_idx': post_idx.astype(np.int32), 'tag_idx': tag_idx.astype(np.int32)})
+    return [
+        save_table(posts.reset_index(drop=True), os.path.join(folder, POSTS_PREFIX + name)),
+        save_table(pairs, os.path.join(folder, POST_TAGS_PREFIX + name)),
+    ]
@@ -0,0 +1,139 @@
+import os
+from typing import List
+
+import pandas as pd
+
+
+# Format of the intermediate tables written between the pipeline stages.
+# Options: "parquet" (default), "feather" or "csv" (the old text format)
+INTERMEDIATE_FORMAT = "parquet"
+
+# Columns stored with a fixed type, so the next stage does not have to guess it again
+STRING_COLUMNS = ['ID']
+CATEGORICAL_COLUMNS = ['Class', 'Subclass']
+
+EXTENSIONS = {
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "csv": ".csv",
+    "excel": ".xlsx",
+}
+
+
+def strip_extension(path: str) -> str:
+    """ Removes the extension of a table file, if it is one of the known formats """
+    for extension in EXTENSIONS.values():
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+
+def table_path(path: str) -> str:
+    """ File name of the table 'path' (with or without extension) in the intermediate format """
+    return strip_extension(path) + EXTENSIONS[INTERMEDIATE_FORMAT]
+
+
+def find_table(path: str) -> str:
+    """
+    Finds the file of the table 'path' (with or without extension).
+    The intermediate format is preferred; tables of older runs (csv or xlsx) are also accepted.
+    """
+    path_base = strip_extension(path)
+    formats = [INTERMEDIATE_FORMAT] + [f for f in EXTENSIONS.keys() if f != INTERMEDIATE_FORMAT]
+    if path != path_base and os.path.isfile(path):
+        return path
+    for format in formats:
+        if os.path.isfile(path_base + EXTENSIONS[format]):
+            return path_base + EXTENSIONS[format]
+    raise FileNotFoundError(f"Tabela não encontrada: '{path_base}' ({', '.join(EXTENSIONS.values())})")
+
+
+def table_exists(path: str) -> bool:
+    try:
+        find_table(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _typed(df: pd.DataFrame) -> pd.DataFrame:
+    """ Sets the types of the known columns and makes mixed object columns writable as text """
+    df = df.copy()
+    for column in df.columns:
+        if column in STRING_COLUMNS:
+            df[column] = df[column].astype(str)
+        elif column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype(str).where(df[column].notna()).astype('category')
+        elif df[column].dtype == object and df[column].dropna().map(type).nunique() > 1:
+            df[column] = df[column].astype(str).where(df[column].notna())
+    return df
+
+
+def save_table(df: pd.DataFrame, path: str) -> str:
+    """ Saves the dataframe in the intermediate format. 'path' may have any extension (or none) """
+    output = table_path(path)
+    df = _typed(df)
+    if INTERMEDIATE_FORMAT == "parquet":
+        df.to_parquet(output, index=False)
+    elif INTERMEDIATE_FORMAT == "feather":
+        df.reset_index(drop=True).to_feather(output)
+    else:
+        df.to_csv(output, index=False)
+    return output
+
+
+def replace_table(df: pd.DataFrame, path: str) -> str:
+    """ Like save_table, but writes to a temporary file first: the table is never left half-written """
+    temporary = save_table(df, strip_extension(path) + ".tmp")
+    output = table_path(path)
+    os.replace(temporary, output)
+    return output
+
+
+def read_table(path: str, columns: List[str] = None, categories: bool = False) -> pd.DataFrame:
+    """
+    Reads a table saved by save_table (or an older csv/xlsx file).
+    categories: if False, the categorical columns are returned as plain strings,
+    as the stages expect (e.g. pd.get_dummies over a category creates all the columns)
+    """
+    file = find_table(path)
+    if file.endswith(EXTENSIONS["parquet"]):
+        df = pd.read_parquet(file, columns=columns)
+    elif file.endswith(EXTENSIONS["feather"]):
+        df = pd.read_feather(file, columns=columns)
+    elif file.endswith(EXTENSIONS["excel"]):
+        df = pd.read_excel(file, usecols=columns)
+    else:
+        df = pd.read_csv(file, usecols=columns, dtype={column: str for column in STRING_COLUMNS})
+
+    if not categories:
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object)
+    return df
+
+
+def list_tables(folder: str, prefix: str = '') -> List[str]:
+    """ Sorted names (without extension) of the tables in 'folder' that start with 'prefix' """
+    names = set()
+    for file in os.listdir(folder):
+        name = strip_extension(file)
+        if name != file and file.startswith(prefix) and not file.startswith('.'):
+            names.add(name)
+    return sorted(names)
+
+
+def export_excel(folders: List[str]) -> None:
+    """
+    Report stage: writes an .xlsx copy of every table in the given folders.
+    Excel files are only needed for the manual analysis (e.g. refinement of the clusters).
+    """
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name in list_tables(folder):
+            file = find_table(os.path.join(folder, name))
+            if file.endswith(EXTENSIONS["excel"]):
+                continue
+            read_table(file).to_excel(os.path.join(folder, name + EXTENSIONS["excel"]), index=False)
+            print(f"Relatório salvo em {os.path.join(folder, name + EXTENSIONS['excel'])}")
@@ -0,0 +1,60 @@
+import os
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from pipeline.storage import read_table, save_table, table_exists
+
+# Global tag vocabulary: every tag name ('Class') gets a stable int32 code, 'tag_idx'.
+# It is built while the vision tables are cleaned (pre_processing.clean), saved as
+# '<output>/pre_processing/2. Tags' and only grows: a code never changes between runs.
+# The stages join and filter on the codes; the names are decoded only for the reports.
+TAGS_TABLE = "2. Tags"
+
+
+class TagVocabulary:
+    """ names[tag_idx] is the name of the tag """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names = np.asarray(list(names), dtype=object)
+        self._index = pd.Index(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def encode(self, values: Iterable[str], add: bool = False) -> np.ndarray:
+        """
+        Codes of the tag names (-1 for missing values).
+        add: new names get the next codes, in order of appearance; otherwise unknown names are -1
+        """
+        values = pd.Series(values, dtype=object)
+        codes = self._index.get_indexer(values)
+        if add:
+            new = pd.unique(values[(codes < 0) & values.notna().to_numpy()])
+            if len(new):
+                self.names = np.concatenate([self.names, np.asarray(new, dtype=object)])
+                self._index = pd.Index(self.names)
+                codes = self._index.get_indexer(values)
+        return codes.astype(np.int32)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """ Names of the codes (the reports) """
+        return self.names[np.asarray(codes)]
+
+    def save(self, folder: str) -> str:
+        return save_table(
+            pd.DataFrame({'tag_idx': np.arange(len(self.names), dtype=np.int32), 'Class': self.names}),
+            os.path.join(folder, TAGS_TABLE),
+        )
+
+    @classmethod
+    def load(cls, folder: str) -> 'TagVocabulary':
+        """ Vocabulary saved in 'folder' (empty if there is none yet) """
+        path = os.path.join(folder, TAGS_TABLE)
+        if not table_exists(path):
+            return cls()
+        df = read_table(path).sort_values('tag_idx')
+        if not np.array_equal(df['tag_idx'].to_numpy(), np.arange(len(df))):
+            raise ValueError(f"Vocabulário de tags inválido (códigos fora de sequência): {path}")
+        return cls(df['Class'])
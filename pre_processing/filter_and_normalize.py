@@ -1,19 +1,27 @@
+import numpy as np
 import pandas as pd
 import os
 from typing import Dict, Tuple, List
 import json
-from sklearn.preprocessing import MinMaxScaler
 
-def clean(df: pd.DataFrame, vision: str) -> Tuple[pd.DataFrame, pd.DataFrame]: 
+from computer_vision.backends import VISION_TABLE_PREFIX
+from pipeline.star_schema import save_normalized
+from pipeline.storage import read_table, save_table
+from pipeline.vocabulary import TagVocabulary
+
+def clean(df: pd.DataFrame, vision: str, vocabulary: TagVocabulary = None) -> Tuple[pd.DataFrame, pd.DataFrame]: 
   """ 
+  vocabulary: vocabulário global de tags; se informado, as tags novas entram nele e
+              a tabela ganha a coluna 'tag_idx' com o código de cada tag
   retorno: Tuple(dataframe, texts)
   """
-  # Retirando os textos que são extraidos da visão do Google 
+  # Retirando os textos que são extraidos pela visão computacional (Subclass 'text'; só o Google gera, mas
+  # as respostas gravadas dele também passam pelo backend 'replay')
   # Remove os labels duplicados deixando o que possue maior confiança
   df_text = pd.DataFrame(columns=df.columns)
   new_df = pd.DataFrame(columns=df.columns)
   
-  if(vision == "Google"):
+  if "Subclass" in df.columns:
     df_text = df.loc[df["Subclass"] == "text"]
     new_df =  df.loc[df["Subclass"] != "text"]
   else:
@@ -21,17 +29,21 @@ def clean(df: pd.DataFrame, vision: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
   new_df.loc[:,"ID"] = new_df["ID"].astype(str)
   
   new_df = new_df.sort_values("Percent").drop_duplicates(["ID", "Class"])
+  if vocabulary is not None:
+    new_df = new_df.assign(tag_idx=vocabulary.encode(new_df["Class"], add=True))
   
   return new_df, df_text
   
 def pre_processing(
-  vision: str, list_dfs: Dict[str, str], filter_data: pd.DataFrame, output_path: str, save: bool =True
+  vision: str, list_dfs: Dict[str, str], filter_data: pd.DataFrame, output_path: str, save: bool =True,
+  quantile: float = .25
   ) -> Dict[str, str]:
   """ 
     vision: Visão computacional
-    list_dfs: lista com nome:caminho do arquivo
+    list_dfs: lista com nome:caminho da tabela (sem extensão)
     filter_data: dataframe para filtrar IDs do
     output_path: diretório para salvar labels removidos 
+    quantile: corte de confiança; labels abaixo desse quantil de 'Percent' são removidos
   """
   # Retira o primeiro quartil
   # Limpa o Dataframe
@@ -41,9 +53,11 @@ def pre_processing(
   new_list = {}
   if (output_path[-1] == "/" or output_path[-1] == "\\"):
     output_path = output_path[0:len(output_path)-1]
+  # Vocabulário global de tags: os códigos das execuções anteriores são mantidos
+  vocabulary = TagVocabulary.load(output_path+"/pre_processing")
   for path in list_dfs.keys():
-    df = pd.read_csv(list_dfs[path])
-    df_clean, df_text = clean(df, vision)
+    df = read_table(list_dfs[path])
+    df_clean, df_text = clean(df, vision, vocabulary)
     
     # Filtra os IDs com base no filter_data
     df_clean = df_clean.loc[df_clean['ID'].isin(filter_data['ID'])]
@@ -54,13 +68,14 @@ def pre_processing(
     info[path]["Quantidade de labels inicialmente"] = int(df_clean.shape[0])  
     info[path]["Quantas labels unicas tinha"] = len(df_clean["Class"].unique())
     
-    info[path]["Primeiro quartil"] = f"de 0 a {float(df_clean['Percent'].quantile(.25))}"
+    corte = df_clean['Percent'].quantile(quantile)
+    info[path]["Primeiro quartil"] = f"de 0 a {float(corte)}"
     
     # Removendo o primeiro quartil de confiança
-    retiradas = df_clean.loc[df_clean["Percent"] < df_clean['Percent'].quantile(.25)]
-    df_clean = df_clean.loc[df_clean["Percent"] >= df_clean['Percent'].quantile(.25)]
+    retiradas = df_clean.loc[df_clean["Percent"] < corte]
+    df_clean = df_clean.loc[df_clean["Percent"] >= corte]
     
-    info[path]["Primeiro quartil depois do filtro"] = f"de 0 a {df_clean['Percent'].quantile(.25)}"
+    info[path]["Primeiro quartil depois do filtro"] = f"de 0 a {df_clean['Percent'].quantile(quantile)}"
     info[path]["Quantas labels unicas restaram"] = len(df_clean["Class"].unique())
     info[path]["Quantidade de labels depois"] = int(df_clean.shape[0])
     info[path]["Quantidade de Ids depois"] = int(len(df_clean["ID"].unique()))  
@@ -69,8 +84,7 @@ def pre_processing(
     retiradas = pd.concat([retiradas, df_text])
     if (not os.path.isdir(output_path+"/labels_removed")):
       os.mkdir(output_path+"/labels_removed")
-    retiradas.to_excel(f"{output_path}/labels_removed/2. {vision}Vision-removidas-{path}.xlsx", index=False)
-    retiradas.to_csv(f"{output_path}/labels_removed/2. {vision}-removidas-{path}.csv", index=False)
+    save_table(retiradas, f"{output_path}/labels_removed/2. {vision}-removidas-{path}")
 
     # Salvando informações da filtragem
     with open(f'{output_path}/info-{vision}.json', 'w') as obj:
@@ -80,16 +94,31 @@ def pre_processing(
     if(save):
       if (not os.path.isdir(output_path+"/pre_processing")):
         os.mkdir(output_path+"/pre_processing")
-      df_clean.to_csv(f"{output_path}/pre_processing/2. Pre-Processing-{path}.csv", index=False)
-      df_clean.to_excel(f"{output_path}/pre_processing/2. Pre-Processing-{path}.xlsx", index=False)
+      save_table(df_clean, f"{output_path}/pre_processing/2. Pre-Processing-{path}")
       new_list[path] = f'{output_path}/pre_processing/2. Pre-Processing-{path}'
+
+  if(save):
+    vocabulary.save(output_path+"/pre_processing")
       
   return new_list
 
 def save_files(df: pd.DataFrame, output: str):
-  """ Save DataFrames in csv and xlsx """
-  df.to_csv(f"{output}.csv", index=False)
-  df.to_excel(f"{output}.xlsx", index=False)
+  """ Save DataFrames in the intermediate format (see pipeline.storage) """
+  save_table(df, output)
+
+def match_names(values: pd.Series, names: List[str]) -> np.ndarray:
+  """ 
+    Matriz (valores x nomes): True quando o nome está contido no valor (sem diferenciar maiúsculas).
+    Um valor pode conter mais de um nome. A comparação é feita só uma vez por valor distinto
+    (ex.: poucos autores para milhares de posts)
+  """
+  categorical = pd.Categorical(values)
+  lookup = np.array([
+    [name.lower() in str(category).lower() for name in names]
+    for category in categorical.categories
+  ] + [[False] * len(names)], dtype=bool).reshape(-1, len(names))
+  # código -1 (valor vazio) aponta para a última linha de lookup
+  return lookup[categorical.codes]
 
 def normalized(path: str, column: str, perfis: List[str], redes: List[str], outputs_path)-> pd.DataFrame:
   df = pd.read_excel(path)
@@ -99,59 +128,60 @@ def normalized(path: str, column: str, perfis: List[str], redes: List[str], outp
   if (not os.path.isdir(f"{outputs_path}/normalize_posts")):
     os.mkdir(f"{outputs_path}/normalize_posts")
   
-  new_df = pd.DataFrame(columns=df.columns)
-  data = pd.read_csv(os.path.join(outputs_path, "pre_processing", "2. Pre-Processing-full.csv"))
+  data = read_table(os.path.join(outputs_path, "pre_processing", "2. Pre-Processing-full"), columns=['ID', 'tag_idx', 'Subclass'])
   data = data.loc[data["Subclass"] != 'text']
   data["ID"] = data["ID"].apply(str)
   
-  for perfil in perfis:
-    # Separando apenas o perfil
-    flag_perfil = df["Autor"].apply(lambda row: row.lower().find(perfil.lower()) >= 0 )
-    for rede in redes:
-      # Separando perfil e rede
-      flag_rede = df["Rede"].apply(lambda row: row.lower().find(rede.lower()) >= 0 )
-      df_perfil_rede = df.loc[(flag_perfil) & (flag_rede)]
-      
-      # Normalizando a coluna especificada
-      MinMax_perfil_rede = MinMaxScaler()
-      df_perfil_rede.insert(
-        len(df_perfil_rede.columns), f"{column} Normalizadas", 
-        MinMax_perfil_rede.fit_transform(df_perfil_rede[[column]])
-      )
-      df_perfil_rede.loc[:, f"{column} Normalizadas"] = df_perfil_rede[f"{column} Normalizadas"].round(7)
-
-      # Merge com as tags
-      data_perfil_rede = pd.merge(df_perfil_rede, data[['ID', 'Class']], how='inner', on="ID")
-      
-      # Salvando a rede-perfil
-      save_files(data_perfil_rede, f"{outputs_path}/normalize_posts/2. Normalized-{rede}-{perfil}")
-      
-      if(new_df.empty):
-        new_df = df_perfil_rede
-      else:
-        new_df = pd.concat([new_df, df_perfil_rede])
-    
-    # Salvando apenas o autor
-    flag_autor = new_df["Autor"].apply(lambda autor: autor.lower().find(perfil.lower()) >= 0) 
-    
-    data_perfil = pd.merge(new_df.loc[flag_autor], data[['ID', 'Class']], how='inner', on="ID")
-    
-    save_files(data_perfil, f"{outputs_path}/normalize_posts/2. Normalized-{perfil}")
-    
+  # Perfil e rede de cada post, de uma vez só. Como antes, um post entra em todo perfil e toda rede
+  # cujo nome está no autor/rede (uma cópia da linha para cada par perfil-rede)
+  pares_perfil_rede = match_names(df["Autor"], perfis).T[:, None, :] & match_names(df["Rede"], redes).T[None, :, :]
+  # Ordem dos posts: perfil, depois rede (a mesma das tabelas geradas antes), mantendo a ordem da planilha
+  codigo_perfil, codigo_rede, linhas = np.nonzero(pares_perfil_rede)
+  new_df = df.iloc[linhas]
+
+  # Normalizando a coluna especificada dentro de cada perfil-rede
+  # (mesma conta do MinMaxScaler: x * escala - min * escala, com escala = 1 / (max - min))
+  grupos = new_df[column].groupby([codigo_perfil, codigo_rede])
+  minimo = grupos.transform('min')
+  amplitude = grupos.transform('max') - minimo
+  escala = 1 / amplitude.where(amplitude != 0, 1)
+  new_df = new_df.assign(**{f"{column} Normalizadas": (new_df[column] * escala + (-minimo * escala)).round(7)})
+
+  # Tabelas em estrela (ver pipeline/star_schema.py): uma linha por post, e os pares (post, tag) em inteiros.
+  # Só entram os posts com alguma tag, na mesma ordem de antes
+  data = data[['ID', 'tag_idx']]
+  data = data.loc[data['ID'].isin(new_df['ID'])]
+  com_tags = new_df['ID'].isin(data['ID']).to_numpy()
+  posts = new_df.loc[com_tags]
+  perfil_posts = codigo_perfil[com_tags]
+  rede_posts = codigo_rede[com_tags]
+
+  # pares na ordem do merge dos posts com as tags (posts na ordem acima, tags na ordem da tabela de tags),
+  # com os códigos do vocabulário global, que é copiado junto com as tabelas.
+  # IDs repetidos (na planilha ou em mais de um perfil/rede) recebem as tags do ID em cada linha, como no merge
+  pares = pd.merge(pd.DataFrame({'ID': posts['ID'].to_numpy(), 'post_idx': np.arange(len(posts))}), data, on='ID')
+  post_idx = pares['post_idx'].to_numpy()
+  tag_idx = pares['tag_idx'].to_numpy()
+
+  pasta = f"{outputs_path}/normalize_posts"
+  TagVocabulary.load(os.path.join(outputs_path, "pre_processing")).save(pasta)
+
+  recortes = {}
+  for i, perfil in enumerate(perfis):
+    for j, rede in enumerate(redes):
+      recortes[f"{rede}-{perfil}"] = (perfil_posts == i) & (rede_posts == j)
+    recortes[perfil] = perfil_posts == i
+  for j, rede in enumerate(redes):
+    recortes[rede] = rede_posts == j
+  # Tabela com todas as redes e todos os candidatos
+  recortes["full"] = np.ones(len(posts), dtype=bool)
+
+  for nome, recorte in recortes.items():
+    # renumera os posts do recorte (0, 1, 2, ...) e mantém só os pares desses posts
+    novo_indice = np.cumsum(recorte) - 1
+    pares = recorte[post_idx]
+    save_normalized(pasta, nome, posts.loc[recorte], novo_indice[post_idx[pares]], tag_idx[pares])
 
-  # Salvando cada rede
-  for rede in redes:
-    flag_rede = new_df["Rede"].apply(lambda row: row.lower().find(rede.lower()) >= 0 )
-    
-    data_rede = pd.merge(new_df.loc[flag_rede], data[['ID', 'Class']], how='inner', on="ID")
-    
-    save_files(data_rede, f"{outputs_path}/normalize_posts/2. Normalized-{rede}")
-  
-  # Salvando a tabela com todas as redes e todos os candidatos
-  
-  data_full = pd.merge(new_df, data[['ID', 'Class']], how='inner', on="ID")
-  
-  save_files(data_full, f"{outputs_path}/normalize_posts/2. Normalized-full")
   return new_df.copy()
   
 
@@ -160,21 +190,21 @@ def split_social_media(redes: List[str], perfis: List[str], vision: str, outputP
   df_rede = [pd.DataFrame() for x in range(len(redes))] 
   df_full = pd.DataFrame() 
   for i, key in enumerate(list_dfs.keys()):
-    el = pd.read_csv(list_dfs[key])
+    el = read_table(list_dfs[key])
     index = i%len(redes)
     df_rede[index] = pd.concat([el, df_rede[index]])
     df_full = pd.concat([df_full, el])
   
-  save_files(df_full, f"{outputPath}/{vision}/1. GoogleVision-full")
+  save_files(df_full, f"{outputPath}/{vision}/{VISION_TABLE_PREFIX}full")
   
-  list_dfs["full"] = f"{outputPath}/{vision}/1. GoogleVision-full.csv"
+  list_dfs["full"] = f"{outputPath}/{vision}/{VISION_TABLE_PREFIX}full"
 
   for perfil in perfis:
-    list_dfs[perfil] = f"{outputPath}/{vision}/1. GoogleVision-{perfil}.csv"
+    list_dfs[perfil] = f"{outputPath}/{vision}/{VISION_TABLE_PREFIX}{perfil}"
 
   for index, rede in enumerate(redes):
-    save_files(df_rede[index], f"{outputPath}/{vision}/1. GoogleVision-{rede}")
+    save_files(df_rede[index], f"{outputPath}/{vision}/{VISION_TABLE_PREFIX}{rede}")
     
-    list_dfs[rede] = f'{outputPath}/{vision}/1. GoogleVision-{rede}.csv'
+    list_dfs[rede] = f'{outputPath}/{vision}/{VISION_TABLE_PREFIX}{rede}'
     
   return list_dfs
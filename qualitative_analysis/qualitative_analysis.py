@@ -1,13 +1,20 @@
+import numpy as np
 import pandas as pd
+from scipy import sparse
 import researchpy as repr
 import statsmodels.api as sm
 import matplotlib.pyplot as plt
 import os
 import re
 
-def get_dummies_df(df):
+from pipeline.parallel import run_parallel
+from pipeline.star_schema import read_normalized
+from pipeline.storage import list_tables, read_table, save_table
+
+def get_dummies_df(df, sparse_columns=True):
     # Codificar one-hot (get dummies) para a coluna especificada no DataFrame principal
-    dummies = pd.get_dummies(df['Class'])
+    # (colunas esparsas por padrão: a tabela densa teria uma coluna por tag em cada linha)
+    dummies = pd.get_dummies(df['Class'], sparse=sparse_columns)
     dummies.columns = [f'Class_{column}' for column in dummies.columns]
 
     # Juntar os DataFrames codificados com o DataFrame principal
@@ -18,119 +25,219 @@ def get_dummies_df(df):
 
 
 def describe_class(df, df_classification, column_target):
+    """
+    Estatísticas do alvo dos posts com e sem cada tag.
+    df: dataframe com 'ID', column_target e as colunas 'Class_*' de get_dummies_df
+    """
     columns_classes = [coluna for coluna in df.columns if coluna.startswith('Class_')]
+    classes = np.array([column_class.split('Class_')[1] for column_class in columns_classes], dtype=object)  # Extrair o nome da classe
+
+    # um post por linha e a matriz de incidência (post x tag)
+    df_posts = df[['ID', column_target]].drop_duplicates().reset_index(drop=True)
+    dummies = df[columns_classes]
+    if len(columns_classes) and all(isinstance(dtype, pd.SparseDtype) for dtype in dummies.dtypes):
+        dummies = dummies.sparse.to_coo().tocsr()
+    else:
+        dummies = sparse.csr_matrix(dummies.to_numpy() == 1)
+    rows, columns = dummies.nonzero()
+    post_codes = pd.Index(df_posts['ID']).get_indexer(df['ID'].to_numpy()[rows])
+    incidence = sparse.csc_matrix(
+        (np.ones(len(rows), dtype=bool), (post_codes, columns)), shape=(len(df_posts), len(classes))
+    )
+
+    # Classificação de cada classe no df_classification (a primeira que aparecer)
+    df_classification = df_classification.drop_duplicates('Class')
+    positions = pd.Index(df_classification['Class']).get_indexer(classes)
+    classification = np.where(positions >= 0, df_classification['Classification'].to_numpy()[positions], 'Not Classified')
+
+    return describe_incidence(df_posts[column_target].to_numpy(), incidence, classes, classification)
+
+
+def _order_statistics(sorted_values, positions, sizes):
+    """ Mínimo, máximo e mediana (interpolação linear, como no numpy/pandas) a partir das posições ordenadas """
+    result = np.full((3, len(sizes)), np.nan)
+    valid = sizes > 0
+    positions = {name: position[valid] for name, position in positions.items()}
+    result[0, valid] = sorted_values[positions['min']]
+    result[1, valid] = sorted_values[positions['max']]
+
+    # mediana: índice virtual (n-1)/2 entre dois elementos, com a mesma conta do np.percentile
+    low, high = sorted_values[positions['low']], sorted_values[positions['high']]
+    gamma = np.where(sizes[valid] % 2 == 0, 0.5, 0.0)
+    diff = high - low
+    result[2, valid] = np.where(gamma >= 0.5, high - diff * (1 - gamma), low + diff * gamma)
+    return result
+
+
+def describe_incidence(values, incidence, tags, classification):
+    """
+    Mesmo resultado de describe_class, para todas as tags de uma vez.
+    values: alvo de cada post; incidence: matriz esparsa post x tag;
+    tags: nome de cada coluna; classification: classificação de cada coluna.
+
+    Contagens vêm dos totais da matriz (ausentes = total - presentes). Mínimo, máximo e mediana
+    saem de um único vetor ordenado: para os posts sem a tag, a k-ésima posição livre é achada
+    descontando as posições ocupadas pelos posts com a tag. Média e desvio padrão dos posts com a
+    tag são calculados em dois passos, como no pandas; os dos posts sem a tag saem dos totais menos
+    o grupo presente (iguais aos do pandas a menos de arredondamento).
+    """
+    values = np.asarray(values)
+    incidence = sparse.csc_matrix(incidence, dtype=bool)
+    incidence.sum_duplicates()
+    incidence.sort_indices()
+    n_posts, n_tags = incidence.shape
+    if n_tags == 0:
+        return pd.DataFrame([])
+
+    # posição de cada post no vetor ordenado pelo alvo
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order].astype(np.float64)
+    rank = np.empty(n_posts, dtype=np.int64)
+    rank[order] = np.arange(n_posts)
+
+    # posts com a tag: posições ordenadas dentro de cada coluna
+    n_true = np.diff(incidence.indptr)
+    column = np.repeat(np.arange(n_tags), n_true)
+    start = incidence.indptr[:-1]
+    true_positions = np.sort(rank[incidence.indices] + column * n_posts) - column * n_posts
+
+    def true_position(k):
+        return true_positions[start + np.minimum(k, np.maximum(n_true - 1, 0))]
+
+    # posts sem a tag: a j-ésima posição livre é j + (quantidade de posições ocupadas com lacuna <= j)
+    n_false = n_posts - n_true
+    gaps = true_positions - (np.arange(len(true_positions)) - np.repeat(start, n_true)) + column * (n_posts + 1)
+
+    def false_position(j):
+        j = np.minimum(j, np.maximum(n_false - 1, 0))
+        return j + np.searchsorted(gaps, j + np.arange(n_tags) * (n_posts + 1), side='right') - start
+
+    stats_true = _order_statistics(sorted_values, {
+        'min': true_position(0), 'max': true_position(n_true - 1),
+        'low': true_position((n_true - 1) // 2), 'high': true_position((n_true - 1) // 2 + 1),
+    }, n_true)
+    stats_false = _order_statistics(sorted_values, {
+        'min': false_position(0), 'max': false_position(n_false - 1),
+        'low': false_position((n_false - 1) // 2), 'high': false_position((n_false - 1) // 2 + 1),
+    }, n_false)
+
+    # média e soma dos quadrados dos desvios (m2) de cada grupo, sem percorrer os posts uma vez por tag:
+    # os presentes em dois passos sobre os valores da matriz; os ausentes pela combinação de variâncias
+    # (Chan et al.): m2_total = m2_presentes + m2_ausentes + (média_p - média_a)² * n_p * n_a / n
+    values = values.astype(np.float64)
+    total_sum = values.sum()
+    total_m2 = ((values - total_sum / n_posts) ** 2).sum()
+    values_true = values[incidence.indices]
+    sum_true = np.bincount(column, weights=values_true, minlength=n_tags)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_true = sum_true / n_true
+        mean_false = (total_sum - sum_true) / n_false
+        m2_true = np.bincount(column, weights=(values_true - mean_true[column]) ** 2, minlength=n_tags)
+        between = np.where((n_true > 0) & (n_false > 0), (mean_true - mean_false) ** 2 * n_true * n_false / n_posts, 0)
+        m2_false = np.maximum(total_m2 - m2_true - between, 0)
+
+        mean_std = np.empty((n_tags, 2, 2))
+        mean_std[:, 0, 0] = np.where(n_true > 0, mean_true, np.nan)
+        mean_std[:, 1, 0] = np.where(n_false > 0, mean_false, np.nan)
+        mean_std[:, 0, 1] = np.where(n_true > 1, np.sqrt(m2_true / (n_true - 1)), np.nan)
+        mean_std[:, 1, 1] = np.where(n_false > 1, np.sqrt(m2_false / (n_false - 1)), np.nan)
+
+    # duas linhas por tag: presente ('True') e ausente ('False')
+    return pd.DataFrame({
+        'Tag': np.repeat(np.asarray(tags, dtype=object), 2),
+        'Presence': np.tile(np.array(['True', 'False'], dtype=object), n_tags),
+        'Count': np.column_stack([n_true, n_false]).ravel().astype(np.float64),
+        'Median': np.column_stack([stats_true[2], stats_false[2]]).ravel(),
+        'Mean': mean_std[:, :, 0].ravel(),
+        'Std': mean_std[:, :, 1].ravel(),
+        'Min': np.column_stack([stats_true[0], stats_false[0]]).ravel(),
+        'Max': np.column_stack([stats_true[1], stats_false[1]]).ravel(),
+        'Classification': np.repeat(np.asarray(classification, dtype=object), 2),
+    })
+
+def save_result_class(path_df_class, path_df_comp, output_file_path, column_target, significance=None):
+    """ Estatísticas descritivas por classe de um par (teste estatístico, posts normalizados) """
+    # Carregar DataFrames dos arquivos correspondentes
+    df_class = read_table(path_df_class)
+    normalized = read_normalized(path_df_comp, columns=['ID', column_target])
+    
+    # Filtrar df_class com base no nível de significância da coluna 'ts'
+    if significance is not None:
+        df_class = df_class[df_class['P-Value - ts'] < significance]
+
+    # Classificação de cada tag, pelos códigos (a primeira linha de df_class com a tag)
+    class_codes = normalized.encode(df_class['Class'])
+    first = ~pd.Series(class_codes).duplicated().to_numpy() & (class_codes >= 0)
+    classification = np.full(len(normalized.tags), 'Not Classified', dtype=object)
+    classification[class_codes[first]] = df_class['Classification'].to_numpy()[first]
+
+    # Filtrar os posts com base em df_class: só as tags testadas, e só os posts que têm alguma delas
+    normalized = normalized.select_tags(class_codes)
+    posts = np.unique(normalized.post_idx)
+    tags = normalized.present_tags()
+    incidence = normalized.incidence('csr')[posts][:, tags]
+    
+    # Gerar estatísticas descritivas por classe
+    describe_classes = describe_incidence(
+        normalized.posts[column_target].to_numpy()[posts], incidence, normalized.tags[tags], classification[tags]
+    )
     
-    results = []
-
-    for column_class in columns_classes:
-        class_ = column_class.split('Class_')[1]  # Extrair o nome da classe
-
-        # Verificar se a classe existe no df_classification
-        if class_ in df_classification['Class'].values:
-            classification = df_classification.loc[df_classification['Class'] == class_, 'Classification'].values[0]
-        else:
-            classification = 'Not Classified'
-
-        all_ids_with_tag = df[df[column_class] == 1]['ID'].unique()
-        
-        describe_true = df[df['ID'].isin(all_ids_with_tag)][['ID', column_target]].drop_duplicates()
-        describe_true_stats = describe_true[column_target].describe()
-
-        describe_false =  df[~df['ID'].isin(all_ids_with_tag)][['ID', column_target]].drop_duplicates()
-        describe_false_stats = describe_false[column_target].describe()
-
-        results.append({
-            'Tag': class_,
-            'Presence': 'True',
-            'Count': describe_true_stats.get('count', 0),
-            'Median': describe_true_stats.get('50%', 0),
-            'Mean': describe_true_stats.get('mean', 0),
-            'Std': describe_true_stats.get('std', 0),
-            'Min': describe_true_stats.get('min', 0),
-            'Max': describe_true_stats.get('max', 0),
-            'Classification': classification
-        })
-        
-        results.append({
-            'Tag': class_,
-            'Presence': 'False',
-            'Count': describe_false_stats.get('count', 0),
-            'Median': describe_false_stats.get('50%', 0),
-            'Mean': describe_false_stats.get('mean', 0),
-            'Std': describe_false_stats.get('std', 0),
-            'Min': describe_false_stats.get('min', 0),
-            'Max': describe_false_stats.get('max', 0),
-            'Classification': classification
-        })
-
-    return pd.DataFrame(results)
-
-def save_results_class(pasta_df_class, pasta_df_comp, output_folder, column_target, significance=None):
+    # Salvar o resultado do describe_classes com o nome do arquivo inicial
+    output_file_path = save_table(describe_classes, output_file_path)
+
+    print(f"O resultado foi salvo em: {output_file_path}")
+    return output_file_path
+
+
+def save_results_class(pasta_df_class, pasta_df_comp, output_folder, column_target, significance=None, workers=1, datasets=None):
+    """
+    workers: quantidade de processos para processar os pares de arquivos em paralelo (None = todos os núcleos)
+    datasets: se informado, processa apenas esses datasets (ex.: ['full', 'facebook-lula'])
+    """
     # Listar arquivos nas pastas
     
-    files_df_class = [file for file in os.listdir(pasta_df_class) if file.endswith('.csv')]
-    files_df_comp = [file for file in os.listdir(pasta_df_comp) if file.endswith('.csv')]
+    files_df_class = list_tables(pasta_df_class)
+    files_df_comp = list_tables(pasta_df_comp, '2. Normalized')
     
     # Extrair "nomes base" dos arquivos
-    nomes_base_df_class = set(re.sub(r'^\d+\.\s?Statistical_Test-', '', file).replace('.csv', '') for file in files_df_class)
-    nomes_base_df_comp = set(re.sub(r'^\d+\.\s?Normalized-', '', file).replace('.csv', '') for file in files_df_comp)
+    nomes_base_df_class = set(re.sub(r'^\d+\.\s?Statistical_Test-', '', file) for file in files_df_class)
+    nomes_base_df_comp = set(re.sub(r'^\d+\.\s?Normalized-', '', file) for file in files_df_comp)
 
     # Encontrar nomes base comuns
-    comuns_nomes_base = nomes_base_df_class & nomes_base_df_comp
-
+    comuns_nomes_base = sorted(nomes_base_df_class & nomes_base_df_comp)
+    if datasets is not None:
+        comuns_nomes_base = [nome_base for nome_base in comuns_nomes_base if nome_base in datasets]
 
-    # Filtrar os dataframes
+    jobs = {}
     for nome_base in comuns_nomes_base:
         # Encontrar arquivos correspondentes nas duas pastas
-        arquivo_df_class = next((file for file in files_df_class if re.sub(r'^\d+\.\s?Statistical_Test-', '', file).replace('.csv', '') == nome_base), None)
-        arquivo_df_comp = next((file for file in files_df_comp if re.sub(r'^\d+\.\s?Normalized-', '', file).replace('.csv', '') == nome_base), None)
+        arquivo_df_class = next((file for file in files_df_class if re.sub(r'^\d+\.\s?Statistical_Test-', '', file) == nome_base), None)
+        arquivo_df_comp = next((file for file in files_df_comp if re.sub(r'^\d+\.\s?Normalized-', '', file) == nome_base), None)
 
         # Verificar se ambos os arquivos foram encontrados
         if arquivo_df_class and arquivo_df_comp:
-            # Carregar DataFrames dos arquivos correspondentes
-            df_class = pd.read_csv(os.path.join(pasta_df_class, arquivo_df_class))
-            df_comp = pd.read_csv(os.path.join(pasta_df_comp, arquivo_df_comp))
-            
-            # Filtrar df_class com base no nível de significância da coluna 'ts'
-            if significance is not None:
-                df_class = df_class[df_class['P-Value - ts'] < significance]
-
-            # Filtrar df_comp com base em df_class
-            df_comp = df_comp[df_comp['Class'].isin(df_class['Class'])]
-            df_class = df_class[df_class['Class'].isin(df_comp['Class'])]
-
-            # Aplicar one-hot encoding e junção
-            df_comp_encoded = get_dummies_df(df_comp)
-            
-            # Gerar estatísticas descritivas por classe
-            describe_classes = describe_class(df_comp_encoded, df_class, column_target)
-            
-            # Salvar o resultado do describe_classes com o nome do arquivo inicial
-            output_file_path = os.path.join(output_folder, f"{nome_base}")
-            
             # Salvar o resultado do describe_classes com o nome do arquivo inicial
-            output_file_path = os.path.join(output_folder, f"6. Qualitative_Analysis-{nome_base}.csv")
-            describe_classes.to_csv(output_file_path)
-            describe_classes.to_excel(output_file_path.replace('.csv', '.xlsx'))
+            jobs[nome_base] = {
+                'path_df_class': os.path.join(pasta_df_class, arquivo_df_class),
+                'path_df_comp': os.path.join(pasta_df_comp, arquivo_df_comp),
+                'output_file_path': os.path.join(output_folder, f"6. Qualitative_Analysis-{nome_base}"),
+                'column_target': column_target,
+                'significance': significance,
+            }
 
-            print(f"O resultado foi salvo em: {output_file_path}")                             
+    return run_parallel(save_result_class, jobs, workers, title='Análise qualitativa das classes')
 
 
 def describe_cluster(arc_cluster, arc_normalized, common_column, cluster, target, output):
     try:
-        if not arc_cluster.endswith('.xlsx'):
-            raise ValueError("O arquivo arc_cluster não possui a extensão .xlsx")
-
-        df_1 = pd.read_excel(arc_cluster)
+        # tabela de clusters em qualquer formato (parquet, csv ou o .xlsx do refinamento manual)
+        df_1 = read_table(arc_cluster)
     except Exception as e:
         print(f"Erro ao ler o arquivo arc_cluster: {str(e)}")
         return
 
     try:
-        if not arc_normalized.endswith('.csv'):
-            raise ValueError("O arquivo arc_normalized não possui a extensão .csv")
-
-        df_2 = pd.read_csv(arc_normalized)
+        df_2 = read_normalized(arc_normalized).long()
     except Exception as e:
         print(f"Erro ao ler o arquivo arc_normalized: {str(e)}")
         return
@@ -149,8 +256,7 @@ def describe_cluster(arc_cluster, arc_normalized, common_column, cluster, target
 
     output_filename = f"{output}/7. Qualitative_Analysis-{arc_normalized.split('2. Normalized-')[-1].split('.')[0]}"
 
-    describe_analysis.to_csv(output_filename + ".csv")
-    describe_analysis.to_excel(output_filename + ".xlsx")
+    save_table(describe_analysis.reset_index(), output_filename)
 
 def describe_cluster_folder(folder_cluster, folder_normalized, common_column, cluster, target, output):
     # try:
@@ -160,14 +266,14 @@ def describe_cluster_folder(folder_cluster, folder_normalized, common_column, cl
     #     if not os.path.isdir(folder_normalized):
     #         raise ValueError("O caminho fornecido para folder_normalized não é um diretório válido")
 
-        files_cluster = [f for f in os.listdir(folder_cluster) if f.endswith('.xlsx')]
-        files_normalized = [f for f in os.listdir(folder_normalized) if f.endswith('.xlsx')]
+        files_cluster = list_tables(folder_cluster)
+        files_normalized = list_tables(folder_normalized, '2. Normalized')
 
         for file_cluster in files_cluster:
             for file_normalized in files_normalized:
                 if file_cluster.split('-', 1)[1].split('.')[0] == file_normalized.split('-', 1)[1].split('.')[0]:
-                    df_1 = pd.read_excel(os.path.join(folder_cluster, file_cluster))
-                    df_2 = pd.read_excel(os.path.join(folder_normalized, file_normalized))
+                    df_1 = read_table(os.path.join(folder_cluster, file_cluster))
+                    df_2 = read_normalized(os.path.join(folder_normalized, file_normalized)).long()
 
                     df_2 = df_2[[common_column, target, 'ID']]
                     
@@ -195,8 +301,7 @@ def describe_cluster_folder(folder_cluster, folder_normalized, common_column, cl
                     # Salva o DataFrame
                     output_filename = f"{output}/7. Qualitative_Analysis-{file_normalized.split('2. Normalized-')[-1].split('.')[0]}"
 
-                    stats_df.to_csv(output_filename + ".csv")
-                    stats_df.to_excel(output_filename + ".xlsx")
+                    save_table(stats_df.rename_axis(cluster).reset_index(), output_filename)
                     break
     #         else:
     #             continue
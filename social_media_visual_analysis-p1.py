@@ -12,11 +12,19 @@ import datetime
 
 # Modulos
 from computer_vision.tagging import create_file_id, send_imagens_API
+from computer_vision.backends import VISION_TABLE_PREFIX, get_backend, vision_table
+from computer_vision.reextract import reextract_folder
+from computer_vision.result_log import VisionResultLog
+from computer_vision.dedup import find_duplicates, load_duplicates, copies_of, DEDUP_HASH, DEDUP_HASH_SIZE, DEDUP_MAX_DISTANCE
 from pre_processing.filter_and_normalize import pre_processing, normalized, split_social_media
 from word_cloud.generate import create_wordcloud
 from statistical_tests.statistical_tests import *
 from qualitative_analysis.qualitative_analysis import *
-from clustering.overlap_clustering import clusterize_tags
+from clustering.overlap_clustering import clusterize_tags_files, clustering_table, OVERLAP_METRIC, OVERLAP_BACKEND, CLUSTERING_BACKEND, WEIGHTED_CLUSTERS
+from pipeline.storage import read_table, save_table, export_excel, table_path
+from pipeline.cache import StageCache
+from pipeline.star_schema import dataset_tables
+from pipeline.vocabulary import TAGS_TABLE, TagVocabulary
 
 
 #Configurações de entrada e de redes
@@ -41,14 +49,51 @@ path_diferenca = "inputs/Posts_sem_fotos.xlsx"
 inputPath = "inputs"
 outputPath = "outputs"
 
-vision = "Google"
-#vision = "Amazon"
+# Backend da visão computacional (ver computer_vision/backends.py): "google", "local" (modelo offline),
+# "fake" (tags aleatórias, para testes) ou "replay" (respostas gravadas, para testes de carga sem rede)
+VISION_BACKEND = "google"
+# Pasta de saída do backend (ex.: outputs/Google); as tabelas se chamam '1. Vision-<dataset>'
+vision = get_backend(VISION_BACKEND).folder
 
 # Defina como True para enviar imagens para a API do Google Vision.
 # Defina como False para pular o envio e usar os resultados existentes (modo de reanálise).
 RUN_VISION_API = False
+# Quantidade de lotes de imagens aguardando a API ao mesmo tempo (ver computer_vision/submission.py)
+VISION_IN_FLIGHT = 4
+# Defina como True para refazer as tabelas da visão computacional a partir das respostas arquivadas,
+# sem chamar a API (ex.: depois de mudar as regras de extração em computer_vision/google_vision.py)
+REEXTRACT_VISION = False
+# Defina como True para detectar imagens quase duplicadas (o mesmo criativo em mais de uma rede): só uma imagem de
+# cada grupo é enviada e as outras recebem as mesmas tags. Grupos em "<outputPath>/mapping/1. Duplicates.csv"
+# (ver computer_vision/dedup.py). Só vale com RUN_VISION_API = True (e na reextração, com REEXTRACT_VISION)
+DEDUP_IMAGES = True
 # significance = 0.01
 
+# Quantidade de processos usados nas etapas por arquivo (testes estatísticos, análise qualitativa e clusterização).
+# 1 executa um arquivo por vez; None usa todos os núcleos da máquina.
+WORKERS = None
+
+# As tabelas intermediárias são salvas no formato definido em pipeline/storage.py (Parquet por padrão).
+# Defina como True para gerar também cópias .xlsx ao final (necessárias para o refinamento manual dos clusters).
+EXPORT_EXCEL = False
+
+# Cache das etapas: uma etapa só é recalculada se os seus arquivos de entrada, parâmetros ou código mudaram.
+# O registro (e os acertos/falhas da última execução) fica em "<outputPath>/cache-manifest.json".
+# Defina como False para recalcular tudo.
+USE_CACHE = True
+# Módulos de pipeline/ usados pelas etapas: entram nas entradas (e na chave do cache) de cada etapa,
+# para que uma mudança neles também recalcule as etapas. PARALLEL_MODULES: etapas executadas em processos
+PIPELINE_MODULES = ["pipeline/storage.py", "pipeline/vocabulary.py", "pipeline/star_schema.py"]
+PARALLEL_MODULES = PIPELINE_MODULES + ["pipeline/parallel.py"]
+
+# Parâmetros das etapas (também fazem parte da chave do cache)
+QUANTILE_CUT = .25
+CLUSTER_SIZE_RANGE = range(3, 10+1)
+TOP_N_CLUSTERINGS = 3
+# Testes estatísticos das tags: quantidade de permutações do alvo para os p-valores (ex.: 10000).
+# 0 usa os p-valores do scipy (aproximação normal / teste exato). Ver statistical_tests/statistical_tests.py
+PERMUTATIONS = 0
+
 """
 Premissas: já tem ter pastas com as imagens no padrão: rede/candidato
 Tem que ter uma planilha de metadados com o cabeçalho:
@@ -61,137 +106,233 @@ Tem que ter outra ("Posts_sem_fotos.xlsx") pra ele retirar da primeria
 #Entrada: Arquivos de imagens e planilha de metadados
 #Saída: Planilha de 2 colunas linkando o ID do post e o arquivo(caminho) correspondente
 
-superStartTime = datetime.datetime.now()
-print("Comecou tudo em ", superStartTime)
+# As etapas em paralelo criam novos processos, que importam este script:
+# por isso a execução fica protegida pelo bloco abaixo.
+if __name__ == "__main__":
+  superStartTime = datetime.datetime.now()
+  print("Comecou tudo em ", superStartTime)
 
-list_dfs = {}
+  list_dfs = {}
 
-METADATA = pd.read_excel(path_metadados)
-METADATA.loc[:,"ID Post"] = METADATA["ID Post"].astype(str)
-DIFERENCA = pd.read_excel(path_diferenca)
-DIFERENCA.loc[:,"ID"] = DIFERENCA["ID"].astype(str)
+  METADATA = pd.read_excel(path_metadados)
+  METADATA.loc[:,"ID Post"] = METADATA["ID Post"].astype(str)
+  DIFERENCA = pd.read_excel(path_diferenca)
+  DIFERENCA.loc[:,"ID"] = DIFERENCA["ID"].astype(str)
 
-data_filter = METADATA.loc[~METADATA['ID Post'].isin(DIFERENCA.loc[DIFERENCA['link funciona'] != 1]['ID'])]
-data_filter = data_filter.rename({"ID Post": 'ID'}, axis=1)
-data_filter.loc[:,"ID"] = data_filter["ID"].astype(str)
+  data_filter = METADATA.loc[~METADATA['ID Post'].isin(DIFERENCA.loc[DIFERENCA['link funciona'] != 1]['ID'])]
+  data_filter = data_filter.rename({"ID Post": 'ID'}, axis=1)
+  data_filter.loc[:,"ID"] = data_filter["ID"].astype(str)
  
 
-# Cria pasta de saida caso não esteja criada
-if(not os.path.isdir(outputPath)):
-  os.mkdir(outputPath)
-    
-for index, perfil in enumerate(perfis):
-  df_perfil = pd.DataFrame()
-  for rede in redes:
-    
-    # Mapeamento criando uma planilha com o ID e local das imagens
-    if(not os.path.isdir(f'{outputPath}/mapping')):
-      os.mkdir(f'{outputPath}/mapping')
+  # Cria pasta de saida caso não esteja criada
+  if(not os.path.isdir(outputPath)):
+    os.mkdir(outputPath)
+
+  cache = StageCache(f"{outputPath}/cache-manifest.json", enabled=USE_CACHE)
 
-    mapping_file_csv=f"{outputPath}/mapping/1. Mapping-File-id-{rede}-{perfil}.csv"
-    create_file_id(f"{inputPath}/{rede}/{perfil}", mapping_file_csv, arrobas[index])
+  duplicates_csv = f"{outputPath}/mapping/1. Duplicates.csv"
+  if REEXTRACT_VISION:
+    # As quase duplicatas da última anotação recebem de novo as tags dos representantes reextraídos
+    reextract_folder(
+      f"{outputPath}/{vision}", workers=WORKERS,
+      duplicates=load_duplicates(duplicates_csv) if DEDUP_IMAGES and os.path.isfile(duplicates_csv) else None,
+    )
     
-    # Enviar para a visão computacional gerar as tags
-    # 1 = Google, 2 é Amazon. Não está funcionando o da Amazon, só de de Gaby funciona
-    send_imagens_API(
-      mapping_file_csv,
-      vision=1,
-      path_vision=f'{outputPath}/{vision}/1. GoogleVision-{rede}-{perfil}',
-      metadada=data_filter,
-      fake = not RUN_VISION_API
+  # Mapeamento criando uma planilha com o ID e local das imagens
+  if(not os.path.isdir(f'{outputPath}/mapping')):
+    os.mkdir(f'{outputPath}/mapping')
+
+  # O mapeamento não passa pelo cache das etapas: create_file_id já é incremental (índice de cada pasta,
+  # '1. Mapping-File-id-<rede>-<perfil>.index.json') e devolve as imagens novas, removidas e alteradas
+  mapping_files, mapping_indexes = {}, []
+  for index, perfil in enumerate(perfis):
+    for rede in redes:
+      mapping_file_csv=f"{outputPath}/mapping/1. Mapping-File-id-{rede}-{perfil}.csv"
+      mapping_index=f"{outputPath}/mapping/1. Mapping-File-id-{rede}-{perfil}.index.json"
+      delta = create_file_id(f"{inputPath}/{rede}/{perfil}", mapping_file_csv, arrobas[index], index_path=mapping_index)
+      # Imagens alteradas desde a última execução são enviadas de novo para a visão computacional
+      VisionResultLog(vision_table(f'{outputPath}/{vision}', f'{rede}-{perfil}')).forget(
+        delta.loc[delta['Change'] == 'modified', 'ID']
+      )
+      mapping_files[f"{rede}-{perfil}"] = mapping_file_csv
+      mapping_indexes.append(mapping_index)
+
+  # Quase duplicatas entre todas as redes e perfis (na ordem da anotação abaixo).
+  # Só quando há envio: na reanálise (RUN_VISION_API = False) as tabelas já estão prontas e não há o que copiar
+  duplicates = None
+  if DEDUP_IMAGES and RUN_VISION_API:
+    cache.run(
+      "mapping/duplicates",
+      lambda: find_duplicates(mapping_files, duplicates_csv, ids=data_filter['ID'], workers=WORKERS),
+      inputs=list(mapping_files.values()) + mapping_indexes + [path_metadados, path_diferenca, "computer_vision/dedup.py"],
+      outputs=[duplicates_csv],
+      params={"hash": DEDUP_HASH, "hash_size": DEDUP_HASH_SIZE, "max_distance": DEDUP_MAX_DISTANCE},
     )
+    duplicates = load_duplicates(duplicates_csv)
+
+  for index, perfil in enumerate(perfis):
+    df_perfil = pd.DataFrame()
+    for rede in redes:
+      # Enviar para a visão computacional gerar as tags
+      path_vision = vision_table(f'{outputPath}/{vision}', f'{rede}-{perfil}')
+      send_imagens_API(
+        mapping_files[f"{rede}-{perfil}"],
+        vision=VISION_BACKEND,
+        path_vision=path_vision,
+        metadada=data_filter,
+        fake = not RUN_VISION_API,
+        in_flight=VISION_IN_FLIGHT,
+        duplicates=None if duplicates is None else copies_of(duplicates, f"{rede}-{perfil}"),
+      )
     
-    list_dfs[f"{rede}-{perfil}"] = f'{outputPath}/{vision}/1. GoogleVision-{rede}-{perfil}.csv'
+      list_dfs[f"{rede}-{perfil}"] = path_vision
     
-    # Separando perfil automaticamente
-    df_perfil = pd.concat([pd.read_csv(f'{outputPath}/{vision}/1. GoogleVision-{rede}-{perfil}.csv'), df_perfil])
+      # Separando perfil automaticamente
+      df_perfil = pd.concat([read_table(path_vision), df_perfil])
 
   
-  df_perfil.to_excel(f"{outputPath}/{vision}/1. GoogleVision-{perfil}.xlsx", index=False)
-  df_perfil.to_csv(f"{outputPath}/{vision}/1. GoogleVision-{perfil}.csv", index=False)
-
-# Separando os Datasets por redes e em full( todos os candidatos e redes)
-split_social_media(
-  redes=redes, 
-  perfis=perfis, 
-  vision=vision, 
-  outputPath=outputPath, 
-  list_dfs=list_dfs
-  ) 
-# Pre-processamento das labels
-
-""" 
-Precisa da visão computacional 'Google' ou 'Amazon'
-list_dfs: dicionário com chave = 'perfil-rede' e valor o caminho para o arquivo
-filter_data: faz um segunda verificação sobre os IDs imagens
-output_path: onde os arquivos serão gerados
-"""
-
-
-list_dfs_filter = pre_processing(
-  vision=vision, 
-  list_dfs=list_dfs, 
-  filter_data=data_filter, 
-  output_path=outputPath,
-  ) 
+    save_table(df_perfil, f"{outputPath}/{vision}/{VISION_TABLE_PREFIX}{perfil}")
+
+  # Separando os Datasets por redes e em full( todos os candidatos e redes)
+  split_social_media(
+    redes=redes, 
+    perfis=perfis, 
+    vision=vision, 
+    outputPath=outputPath, 
+    list_dfs=list_dfs
+    ) 
+  # Pre-processamento das labels
+
+  """ 
+  Precisa da visão computacional 'Google' ou 'Amazon'
+  list_dfs: dicionário com chave = 'perfil-rede' e valor o caminho para o arquivo
+  filter_data: faz um segunda verificação sobre os IDs imagens
+  output_path: onde os arquivos serão gerados
+  """
+
+  list_dfs_filter = {path: f'{outputPath}/pre_processing/2. Pre-Processing-{path}' for path in list_dfs.keys()}
+
+  cache.run(
+    "pre_processing",
+    lambda: pre_processing(
+      vision=vision, 
+      list_dfs=list_dfs, 
+      filter_data=data_filter, 
+      output_path=outputPath,
+      quantile=QUANTILE_CUT,
+      ),
+    inputs=list(list_dfs.values()) + [path_metadados, path_diferenca, "pre_processing/filter_and_normalize.py",
+                                      "computer_vision/backends.py", *PIPELINE_MODULES],
+    outputs=list(list_dfs_filter.values()) + [f'{outputPath}/labels_removed/2. {vision}-removidas-{path}' for path in list_dfs.keys()]
+            + [f"{outputPath}/pre_processing/{TAGS_TABLE}"],
+    params={"vision": vision, "quantile": QUANTILE_CUT},
+    # o vocabulário é ampliado a cada execução (os códigos antigos são mantidos), não apagado
+    keep=[f"{outputPath}/pre_processing/{TAGS_TABLE}"],
+  )
 
 
-# Normalizando dados
-normalized(
-  path= "inputs/Post-filtrado.xlsx",
-  column= "Curtidas",
-  perfis= perfis,
-  redes= redes,
-  outputs_path= 'outputs'
-)
+  # Normalizando dados
+  cache.run(
+    "normalized",
+    lambda: normalized(
+      path= "inputs/Post-filtrado.xlsx",
+      column= "Curtidas",
+      perfis= perfis,
+      redes= redes,
+      outputs_path= 'outputs'
+    ),
+    inputs=["inputs/Post-filtrado.xlsx", f"{outputPath}/pre_processing/2. Pre-Processing-full", f"{outputPath}/pre_processing/{TAGS_TABLE}",
+            "pre_processing/filter_and_normalize.py", "computer_vision/backends.py", *PIPELINE_MODULES],
+    outputs=[table for path in list_dfs.keys() for table in dataset_tables(f"{outputPath}/normalize_posts", path)],
+    params={"column": "Curtidas", "perfis": perfis, "redes": redes},
+  )
 
 
-for path_df in list_dfs_filter.keys():
-  df = pd.read_csv(list_dfs_filter[path_df]+".csv")
-  #Criando a nuvem de palavras
-  create_wordcloud(
-    df=df, 
-    path=path_df, 
-    output=outputPath
-  )
+  for path_df in list_dfs_filter.keys():
+    #Criando a nuvem de palavras
+    cache.run(
+      f"wordcloud/{path_df}",
+      lambda: create_wordcloud(
+        df=read_table(list_dfs_filter[path_df], columns=['tag_idx']), 
+        path=path_df, 
+        output=outputPath,
+        vocabulary=TagVocabulary.load(f"{outputPath}/pre_processing")
+      ),
+      inputs=[list_dfs_filter[path_df], f"{outputPath}/pre_processing/{TAGS_TABLE}", "word_cloud/generate.py",
+            *PIPELINE_MODULES],
+      outputs=[f"{outputPath}/wordcloud/{path_df}.jpg", table_path(f"{outputPath}/wordcloud/{path_df}")],
+    )
 
 
-path_normalized = f'{outputPath}/normalize_posts'
-path_results_statistical = f'{outputPath}/statistical_tests/classes'
-path_results_qualitative = f'{outputPath}/qualitative_analysis/classes'
+  path_normalized = f'{outputPath}/normalize_posts'
+  path_results_statistical = f'{outputPath}/statistical_tests/classes'
+  path_results_qualitative = f'{outputPath}/qualitative_analysis/classes'
 
-if (not os.path.isdir(path_results_statistical)):
-  os.mkdir(path_results_statistical)
-  
-if (not os.path.isdir(path_results_qualitative)):
-  os.mkdir(path_results_qualitative)
+  os.makedirs(path_results_statistical, exist_ok=True)
+  os.makedirs(path_results_qualitative, exist_ok=True)
   
-# column_target = 'Curtidas Normalizadas'
-column_target = 'Curtidas'
-
-# From the normalized data, we will store the values of the Mann-Whitney statistical test, 
-# according to the desired column, in the current case: 'Curtidas Normalizadas'.
-process_files(path_normalized, path_results_statistical, column_target)
-save_results_class(pasta_df_class=path_results_statistical, pasta_df_comp=path_normalized, output_folder=path_results_qualitative, column_target=column_target)
-
-# Cria várias opções de clusterizações das tags com diferentes quantidades de "grupos"
-# São escolhidas as "top_n_clusterings" quantidades de maior sillhouette score
-# Também são geradas arquivos dos gráficos dos sillhouette scores para cada quantidade de grupos considerada
-paths_statisticals = os.listdir(path_results_statistical)
-paths_statisticals = [ path.replace("4. Statistical_Test-", "") for path in filter(lambda path: path.find(".csv") >= 0, paths_statisticals)]
-
-for file in paths_statisticals:
-    clusterize_tags(f"{outputPath}/statistical_tests/classes/4. Statistical_Test-{file}", 
-                    f"{outputPath}/normalize_posts/2. Normalized-{file}",
-                    f"{outputPath}/clustering/", 
-                    f"{file}",
-                    top_n_clusterings=3)
-
-
-# Depois da clusterização: fazer análise manual dos clusters
-# Ler "clustering_howto.md" para mais detalhes
-
-superEndTime = datetime.datetime.now()
-superDiffTime = superEndTime - superStartTime
-print("Terminou tudo em ", superEndTime)
-print("Demorou total: ", superDiffTime)
+  # column_target = 'Curtidas Normalizadas'
+  column_target = 'Curtidas'
+
+  # From the normalized data, we will store the values of the Mann-Whitney statistical test, 
+  # according to the desired column, in the current case: 'Curtidas Normalizadas'.
+  jobs = {
+    path: [*dataset_tables(path_normalized, path), "statistical_tests/statistical_tests.py", *PARALLEL_MODULES]
+    for path in list_dfs.keys()
+  }
+  params = {"column_target": column_target, "permutations": PERMUTATIONS}
+  # saídas apagadas antes de recalcular: um dataset normal (Shapiro) não grava teste, e o resultado antigo não pode ficar
+  outputs = {path: [f"{path_results_statistical}/4. Statistical_Test-{path}"] for path in list_dfs.keys()}
+  summary = process_files(path_normalized, path_results_statistical, column_target, workers=WORKERS,
+                          datasets=cache.pending("statistical_tests", jobs, params, outputs), permutations=PERMUTATIONS)
+  cache.store_all("statistical_tests", jobs, summary, params)
+
+  jobs = {
+    path: [f"{path_results_statistical}/4. Statistical_Test-{path}", *dataset_tables(path_normalized, path),
+           "qualitative_analysis/qualitative_analysis.py", *PARALLEL_MODULES]
+    for path in list_dfs.keys()
+  }
+  params = {"column_target": column_target}
+  outputs = {path: [f"{path_results_qualitative}/6. Qualitative_Analysis-{path}"] for path in list_dfs.keys()}
+  summary = save_results_class(pasta_df_class=path_results_statistical, pasta_df_comp=path_normalized, output_folder=path_results_qualitative, column_target=column_target, workers=WORKERS,
+                               datasets=cache.pending("qualitative_analysis", jobs, params, outputs))
+  cache.store_all("qualitative_analysis", jobs, summary, params)
+
+  # Cria várias opções de clusterizações das tags com diferentes quantidades de "grupos"
+  # São escolhidas as "top_n_clusterings" quantidades de maior sillhouette score
+  # Também são geradas arquivos dos gráficos dos sillhouette scores para cada quantidade de grupos considerada
+  jobs = {
+    path: [f"{path_results_statistical}/4. Statistical_Test-{path}", *dataset_tables(path_normalized, path),
+           "clustering/overlap_clustering.py", *PARALLEL_MODULES]
+    for path in list_dfs.keys()
+  }
+  params = {"cluster_size_range": list(CLUSTER_SIZE_RANGE), "top_n_clusterings": TOP_N_CLUSTERINGS,
+            "overlap_metric": OVERLAP_METRIC, "overlap_backend": OVERLAP_BACKEND, "weighted_clusters": WEIGHTED_CLUSTERS,
+            "clustering_backend": CLUSTERING_BACKEND}
+  outputs = {path: [clustering_table(f"{outputPath}/clustering/", path)] for path in list_dfs.keys()}
+  summary = clusterize_tags_files(path_results_statistical, path_normalized, f"{outputPath}/clustering/",
+                                  cluster_size_range=CLUSTER_SIZE_RANGE, top_n_clusterings=TOP_N_CLUSTERINGS, workers=WORKERS,
+                                  datasets=cache.pending("clustering", jobs, params, outputs))
+  cache.store_all("clustering", jobs, summary, params)
+
+
+  # Relatórios em Excel (desligado por padrão)
+  if EXPORT_EXCEL:
+    export_excel([
+      f"{outputPath}/{vision}",
+      f"{outputPath}/pre_processing",
+      f"{outputPath}/normalize_posts",
+      f"{outputPath}/wordcloud",
+      path_results_statistical,
+      path_results_qualitative,
+      f"{outputPath}/clustering",
+    ])
+
+  # Depois da clusterização: fazer análise manual dos clusters
+  # Ler "clustering_howto.md" para mais detalhes
+
+  superEndTime = datetime.datetime.now()
+  superDiffTime = superEndTime - superStartTime
+  print("Terminou tudo em ", superEndTime)
+  print("Demorou total: ", superDiffTime)
+  print(f"Cache: {len(cache.hits)} etapa(s) reaproveitada(s), {len(cache.misses)} recalculada(s)")
@@ -8,7 +8,8 @@ Script para selecionar e salvar imagens de amostra para cada cluster refinado.
 """
 import os
 import datetime
-from clustering.change_images import copy_images_to_cluster_folders
+from clustering.change_images import copy_images_to_cluster_folders, load_mapping
+from pipeline.storage import list_tables
 
 superStartTime = datetime.datetime.now()
 print("Comecou tudo em ", superStartTime)
@@ -23,20 +24,24 @@ path_normalized_posts = 'outputs/normalize_posts'
 path_images = 'inputs'
 save_output = 'outputs/clustering/saved_images'
 
-# Filtra apenas os arquivos .xlsx, ignorando arquivos ocultos como .DS_Store
-files_to_process = [f for f in os.listdir(path_refined_clustering) if f.endswith('.xlsx')]
+# Tabelas de clusters em qualquer formato (.xlsx do refinamento manual, parquet ou csv), ignorando arquivos ocultos como .DS_Store
+files_to_process = list_tables(path_refined_clustering)
+
+# Mapeamento ID do post -> imagem, lido uma vez para todos os arquivos
+mapping = load_mapping()
 
 for file in files_to_process:
     print(f"Processando arquivo de cluster: {file}")
     # Extrai o nome base do arquivo (ex: 'full', 'lula') para usar como nome da pasta de saída.
-    output_folder_name = file.replace('5. Clusterings-', '').replace('.xlsx', '')
+    output_folder_name = file.replace('5. Clusterings-', '')
     copy_images_to_cluster_folders(
         n=30,
         path_input_clustering=os.path.join(path_refined_clustering, file),
-        path_input_normalized=os.path.join(path_normalized_posts, file.replace("5. Clusterings-", "2. Normalized-").replace(".xlsx", ".csv")),
+        path_input_normalized=os.path.join(path_normalized_posts, file.replace("5. Clusterings-", "2. Normalized-")),
         output_folder=output_folder_name,
         column_name=cluster_column_name,
         path_output=save_output,
+        mapping=mapping,
     )
 
 superEndTime = datetime.datetime.now()
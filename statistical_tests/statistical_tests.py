@@ -2,9 +2,23 @@ import pandas as pd
 from matplotlib import pyplot as plt
 import seaborn as sns
 from scipy import stats
+from scipy import sparse
 from scipy.stats import shapiro
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from math import comb
+
+from pipeline.parallel import run_parallel
+from pipeline.star_schema import read_normalized
+from pipeline.storage import list_tables, read_table, save_table
+
+# Modo de permutação: quantidade de permutações do alvo usadas nos p-valores (0 = aproximação normal/teste exato do scipy)
+PERMUTATIONS = 0
+# Permutações por bloco (limita a memória a posts x PERMUTATION_CHUNK valores) e semente das permutações
+PERMUTATION_CHUNK = 500
+PERMUTATION_SEED = 0
 
 def mannwhitney_ts(grupo_true, grupo_false):
     statistic, p_value_mannwhitneyu = stats.mannwhitneyu(grupo_true, grupo_false, alternative='two-sided')
@@ -54,72 +68,353 @@ def df_mannwhitney(df, column_target):
         
     return result
 
-def process_files(input_folder, output_folder, column_target):
+@lru_cache(maxsize=None)
+def mannwhitney_exact_sf(m, n):
+    """
+    P(U >= k), para k = 0..m*n, da distribuição exata de U sem empates (grupos de tamanho m e n).
+    As contagens de U são os coeficientes do binomial gaussiano [m+n, m]_q, calculados com
+    inteiros exatos multiplicando por (1 - q^(n+i)) e dividindo por (1 - q^i), para i = 1..m.
+    """
+    m, n = int(m), int(n)
+    counts = np.zeros(m*n + 1, dtype=object)
+    counts[0] = 1
+    for i in range(1, m+1):
+        previous = counts.copy()
+        counts[n+i:] -= previous[:len(counts)-(n+i)]
+        for r in range(i):
+            counts[r::i] = np.cumsum(counts[r::i])
+
+    tail = np.cumsum(counts[::-1])[::-1]
+    return (tail / comb(m + n, m)).astype(float)
+
+def df_mannwhitney_batch(df, column_target):
+    """
+    Mesmo resultado de df_mannwhitney, mas testando todas as tags de uma vez.
+    df: dataframe com as colunas [column_target, 'ID', 'Class'] (sem as dummies).
+    """
+    df_posts = df[['ID', column_target]].drop_duplicates().reset_index(drop=True)
+    tags = np.sort(df['Class'].dropna().unique())   # mesma ordem das colunas de pd.get_dummies
+
+    # matriz de incidência (post x tag)
+    df_pairs = df[['ID', 'Class']].dropna().drop_duplicates()
+    df_pairs = df_pairs.merge(df_posts[['ID']].reset_index(), on='ID')
+    tag_codes = np.searchsorted(tags, df_pairs['Class'].to_numpy())
+    incidence = sparse.csc_matrix(
+        (np.ones(len(df_pairs)), (df_pairs['index'].to_numpy(), tag_codes)),
+        shape=(len(df_posts), len(tags))
+    )
+    return mannwhitney_incidence(df_posts[column_target].to_numpy(), incidence, tags)
+
+def mannwhitney_pvalues(U1, n1, n2, tie_term):
+    """
+    P-valores (bilateral, 'greater' e 'less') do Mann-Whitney para vários testes de uma vez, como no scipy.
+    U1: estatística U do primeiro grupo; n1, n2: tamanhos dos grupos; tie_term: soma de (t³ - t) dos empates
+    """
+    U1, n1, n2 = np.asarray(U1, dtype=np.float64), np.asarray(n1), np.asarray(n2)
+    tie_term = np.broadcast_to(tie_term, U1.shape)
+    n = n1 + n2
+    U2 = n1*n2 - U1
+
+    # aproximação normal com correção de empates e de continuidade (como no scipy)
+    mu = n1*n2/2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(n1*n2/12 * ((n + 1) - tie_term/(n*(n-1))))
+
+    def p_value(U, f):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (U - mu - 0.5) / s
+        return np.clip(stats.norm.sf(z) * f, 0, 1)
+
+    p_values_ts = p_value(np.maximum(U1, U2), 2)
+    p_values_greater = p_value(U1, 1)
+    p_values_less = p_value(U2, 1)
+
+    # para grupos pequenos sem empates o scipy usa o teste exato: a distribuição de U
+    # é calculada uma vez por tamanho de grupo e reaproveitada entre os testes
+    exact = (n1 > 0) & (n2 > 0) & (np.minimum(n1, n2) <= 8) & (tie_term == 0)
+    for j in np.flatnonzero(exact):
+        sf = mannwhitney_exact_sf(min(n1[j], n2[j]), max(n1[j], n2[j]))
+        u1, u2 = int(round(U1[j])), int(round(U2[j]))
+        p_values_ts[j] = min(1.0, 2 * sf[max(u1, u2)])
+        p_values_greater[j] = sf[u1]
+        p_values_less[j] = sf[u2]
+
+    return p_values_ts, p_values_greater, p_values_less
+
+def mannwhitney_results(names, p_values_ts, p_values_greater, p_values_less, key='Class'):
+    """ Uma linha por teste, com a classificação pelo corte de 0.01 """
+    result = []
+    for name, p_value_ts, p_value_greater, p_value_less in zip(names, p_values_ts, p_values_greater, p_values_less):
+        statistical_classification = 'none'
+        if p_value_ts < 0.01:
+            statistical_classification = 'greater' if p_value_greater < 0.01 else 'less' if p_value_less < 0.01 else 'INVALID-RESULT'
+
+        result.append({
+            key: name,
+            'P-Value - ts': p_value_ts,
+            'P-Value - greater': p_value_greater,
+            'P-Value - less': p_value_less,
+            'Classification': statistical_classification
+        })
+
+    return result
 
-    # Listar arquivos na pasta de entrada
-    files = os.listdir(input_folder)
+def mannwhitney_incidence(values, incidence, tags, key='Class', permutations=0, workers=1):
+    """
+    Teste de Mann-Whitney de cada tag (coluna de 'incidence') contra as demais.
+    values: alvo de cada post; incidence: matriz esparsa post x tag; tags: nome de cada coluna.
+    key: nome da coluna com o nome do grupo no resultado
+    permutations: se > 0, os p-valores são os de permutação (ver mannwhitney_permutation), com 'workers' processos
+
+    O alvo de cada post é ranqueado uma única vez: os grupos com e sem a tag sempre
+    somam todos os posts, então os ranks (e a correção de empates) são os mesmos para
+    todas as tags. A soma dos ranks de cada tag vem de um produto com a matriz esparsa
+    post x tag, e os três p-valores saem da mesma estatística U.
+    """
+    incidence = sparse.csc_matrix(incidence)
+    values = np.asarray(values)
+
+    if permutations:
+        # os p-valores assintóticos/exatos não são usados: só o teste de permutação é feito
+        p_values = mannwhitney_permutation(values, incidence, permutations, workers=workers)
+        return mannwhitney_results(tags, *p_values, key=key)
+
+    ranks = stats.rankdata(values)
+    _, ties = np.unique(values, return_counts=True)
+
+    n = len(values)
+    n1 = np.asarray(incidence.sum(axis=0)).ravel().astype(np.int64)
+    n2 = n - n1
+    R1 = incidence.T @ ranks
+    U1 = R1 - n1*(n1+1)/2
+
+    p_values_ts, p_values_greater, p_values_less = mannwhitney_pvalues(U1, n1, n2, (ties**3 - ties).sum())
+
+    # grupos vazios (tag presente em todos os posts, ou em nenhum) ficam com o comportamento do scipy
+    for j in np.flatnonzero((n1 == 0) | (n2 == 0)):
+        with_tag = incidence[:, j].toarray().ravel() > 0
+        group_true, group_false = values[with_tag], values[~with_tag]
+        p_values_ts[j] = mannwhitney_ts(group_true, group_false)[1]
+        p_values_greater[j] = mannwhitney_greater(group_true, group_false)[1]
+        p_values_less[j] = mannwhitney_less(group_true, group_false)[1]
+
+    return mannwhitney_results(tags, p_values_ts, p_values_greater, p_values_less, key)
+
+def _pair_statistics(counts, pairs):
+    """
+    U, tamanhos e termo de empates de cada par (a, b) de grupos.
+    counts: matriz grupo x valor distinto do alvo (quantos posts do grupo têm cada valor, em ordem crescente)
+
+    Os ranks da união de cada par saem das contagens acumuladas: o rank médio de um valor é
+    (posts do par com valor menor) + (posts do par com esse valor + 1) / 2. As contas são feitas
+    com inteiros (o dobro das somas), sem erro de arredondamento.
+    """
+    group_a, group_b = counts[pairs[:, 0]], counts[pairs[:, 1]]
+    pooled = group_a + group_b
+    below = np.cumsum(pooled, axis=1) - pooled
+    n1, n2 = group_a.sum(axis=1), group_b.sum(axis=1)
+    R1_twice = (group_a * (2*below + pooled + 1)).sum(axis=1)
+    U1 = (R1_twice - n1*(n1+1)) / 2
+    tie_term = (pooled**3 - pooled).sum(axis=1)
+    return U1, n1, n2, tie_term
+
+def mannwhitney_pairs(values, membership, pairs, workers=1, chunk_size=256):
+    """
+    Teste de Mann-Whitney de vários pares de grupos de posts (ex.: cluster contra cluster).
+    values: alvo de cada post; membership: matriz (post x grupo) com os posts de cada grupo
+    (um post pode estar em mais de um grupo, e então entra nas duas amostras do par);
+    pairs: array (quantidade de pares, 2) com os índices dos grupos de cada par.
+    workers: threads para processar os blocos de 'chunk_size' pares em paralelo.
+
+    A matriz grupo x valor do alvo é montada uma vez; cada par só soma duas linhas dela.
+    Retorna os p-valores (bilateral, 'greater' e 'less') de cada par.
+    """
+    values = np.asarray(values)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    membership = sparse.csr_matrix(membership)
+    membership.sum_duplicates()
+    membership = (membership != 0).astype(np.int64)
+
+    distinct, value_codes = np.unique(values, return_inverse=True)
+    by_value = sparse.csr_matrix(
+        (np.ones(len(values), dtype=np.int64), (np.arange(len(values)), value_codes)), shape=(len(values), len(distinct))
+    )
+    counts = (membership.T @ by_value).toarray()
+
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        statistics = [_pair_statistics(counts, chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            statistics = list(executor.map(lambda chunk: _pair_statistics(counts, chunk), chunks))
+
+    if not statistics:
+        return np.empty(0), np.empty(0), np.empty(0)
+    U1, n1, n2, tie_term = (np.concatenate(columns) for columns in zip(*statistics))
+    return mannwhitney_pvalues(U1, n1, n2, tie_term)
+
+def fdr_bh(p_values):
+    """ P-valores ajustados pelo procedimento de Benjamini-Hochberg (controle da taxa de falsas descobertas) """
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if len(valid) == 0:
+        return adjusted
+    order = valid[np.argsort(p_values[valid], kind='stable')]
+    scaled = p_values[order] * len(valid) / np.arange(1, len(valid) + 1)
+    adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1)
+    return adjusted
+
+def _permutation_counts(ranks, incidence, observed, size, seed, chunk):
+    """
+    Quantas das 'size' permutações do bloco 'chunk' têm soma de ranks (centrada) tão extrema quanto a observada,
+    para cada tag: (bilateral, 'greater', 'less'). As permutações de um bloco dependem só de (seed, chunk).
+    """
+    rng = np.random.default_rng([seed, chunk])
+    shuffled = rng.permuted(np.broadcast_to(ranks, (size, len(ranks))), axis=1)
+    permuted = incidence.T @ shuffled.T     # tags x permutações
+    return (
+        (np.abs(permuted) >= np.abs(observed)[:, None]).sum(axis=1),
+        (permuted >= observed[:, None]).sum(axis=1),
+        (permuted <= observed[:, None]).sum(axis=1),
+    )
+
+def mannwhitney_permutation(values, incidence, permutations=PERMUTATIONS, chunk_size=PERMUTATION_CHUNK, seed=PERMUTATION_SEED, workers=1):
+    """
+    P-valores de permutação do Mann-Whitney de cada tag (coluna de 'incidence') contra as demais.
+
+    A soma dos ranks de uma tag é comparada com a das mesmas 'permutations' permutações do alvo entre os
+    posts, para todas as tags de uma vez: cada bloco de 'chunk_size' permutações é uma matriz
+    (permutações x posts) de ranks embaralhados, multiplicada pela matriz post x tag. A memória fica
+    limitada ao tamanho do bloco, e as somas são de inteiros, então as comparações são exatas.
+    workers: processos para os blocos (None = todos os núcleos); o resultado não depende disso.
+    Retorna (bilateral, 'greater', 'less'), com p = (1 + permutações tão extremas) / (1 + permutations).
+    """
+    incidence = sparse.csr_matrix(incidence)
+    incidence.sum_duplicates()
+    incidence = (incidence != 0).astype(np.float64)
+    # ranks dobrados e centrados (inteiros de média zero): a soma de uma tag é > 0 quando o alvo dela é maior
+    ranks = 2 * stats.rankdata(values) - (len(values) + 1)
+    observed = incidence.T @ ranks
+
+    sizes = [min(chunk_size, permutations - start) for start in range(0, permutations, chunk_size)]
+    if workers == 1 or len(sizes) <= 1:
+        counts = [_permutation_counts(ranks, incidence, observed, size, seed, chunk) for chunk, size in enumerate(sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_permutation_counts, ranks, incidence, observed, size, seed, chunk)
+                       for chunk, size in enumerate(sizes)]
+            counts = [future.result() for future in futures]
+
+    return tuple((1 + sum(count[k] for count in counts)) / (1 + permutations) for k in range(3))
+
+def process_file(file_path, output_folder, column_target, permutations=PERMUTATIONS, workers=1):
+    """
+    Teste de Mann-Whitney de todas as tags de uma tabela '2. Normalized-*'.
+    permutations: se > 0, p-valores de permutação (com 'workers' processos); senão, os do scipy.
+    As colunas 'FDR - *' têm os p-valores ajustados por Benjamini-Hochberg entre todas as tags do arquivo.
+    """
+    file = os.path.basename(file_path)
+    
+    # Ler a tabela (um post por linha) e os pares post-tag
+    normalized = read_normalized(file_path, columns=['ID', column_target])
+    values = normalized.posts[column_target].to_numpy()
+    
+    # Realizar o teste de Shapiro-Wilk
+    stat, p_valor = stats.shapiro(values)
     
-    for file in files:
-        # Verificar se o arquivo é CSV
-        if file.endswith('.csv'):
-            file_path = os.path.join(input_folder, file)
-            
-            # Ler o arquivo CSV
-            df = pd.read_csv(file_path)
-            df_reduced = df[['ID', column_target]].drop_duplicates()
-            
-            # Realizar o teste de Shapiro-Wilk
-            stat, p_valor = stats.shapiro(df_reduced[column_target])
-            
-            # Exibir os resultados
-            print(f'Arquivo: {file}')
-            print(f'Estatística de teste: {stat:.4f}')
-            print(f'Valor p: {p_valor:.9f}')
-
-            # Interpretar o resultado
-            significance = 0.05
-            if p_valor > significance:
-                print("Os dados parecem ser normalmente distribuídos (não rejeitamos H0)")
-            else:
-                df = df[[column_target, 'ID', 'Class']]
-                df = df.drop_duplicates()
-                dummy_categorias = pd.get_dummies(df['Class'])
-                df = pd.concat([df, dummy_categorias], axis=1)
-                mw = df_mannwhitney(df, column_target)
-                df_mw = pd.DataFrame(mw)
-
-                df_mw['Classification'] = 'none'
-                df_mw.loc[(df_mw['P-Value - ts'] < 0.01) & (df_mw['P-Value - greater'] < 0.01), 'Classification'] = 'greater'
-                df_mw.loc[(df_mw['P-Value - ts'] < 0.01) & (df_mw['P-Value - less'] < 0.01), 'Classification'] = 'less'
-                
-                if file.startswith('2. Normalized'):
-                    new_name_file = file.replace('2. Normalized', '4. Statistical_Test-')
-                if file.startswith('2. Normalized-'):
-                    new_name_file = file.replace('2. Normalized-', '4. Statistical_Test-')
-
-                # Nome do arquivo de saída baseado no arquivo de entrada
-                output_file = os.path.join(output_folder, f'{new_name_file}')
-                
-                # Salvar o resultado no arquivo de saída
-                df_mw.to_csv(output_file, index=False)
-                df_mw.to_excel(output_file.replace('.csv', '.xlsx').replace('.csv', '.xlsx'), index=False)
-                print(f"Resultado salvo em {output_file}/n")
+    # Exibir os resultados
+    print(f'Arquivo: {file}')
+    print(f'Estatística de teste: {stat:.4f}')
+    print(f'Valor p: {p_valor:.9f}')
+
+    # Interpretar o resultado
+    significance = 0.05
+    if p_valor > significance:
+        print("Os dados parecem ser normalmente distribuídos (não rejeitamos H0)")
+    else:
+        # só as tags que aparecem no dataset, em ordem alfabética
+        tags = normalized.present_tags()
+        mw = mannwhitney_incidence(values, normalized.incidence('csc')[:, tags], normalized.tags[tags],
+                                   permutations=permutations, workers=workers)
+        df_mw = pd.DataFrame(mw)
+
+        df_mw['Classification'] = 'none'
+        df_mw.loc[(df_mw['P-Value - ts'] < 0.01) & (df_mw['P-Value - greater'] < 0.01), 'Classification'] = 'greater'
+        df_mw.loc[(df_mw['P-Value - ts'] < 0.01) & (df_mw['P-Value - less'] < 0.01), 'Classification'] = 'less'
+
+        # correção para múltiplas comparações (milhares de tags testadas)
+        for alternative in ['ts', 'greater', 'less']:
+            df_mw[f'FDR - {alternative}'] = fdr_bh(df_mw[f'P-Value - {alternative}'])
+        
+        if file.startswith('2. Normalized'):
+            new_name_file = file.replace('2. Normalized', '4. Statistical_Test-')
+        if file.startswith('2. Normalized-'):
+            new_name_file = file.replace('2. Normalized-', '4. Statistical_Test-')
+
+        # Nome do arquivo de saída baseado no arquivo de entrada
+        output_file = os.path.join(output_folder, f'{new_name_file}')
+        
+        # Salvar o resultado no arquivo de saída
+        output_file = save_table(df_mw, output_file)
+        print(f"Resultado salvo em {output_file}/n")
+        return output_file
+
+def process_files(input_folder, output_folder, column_target, workers=1, datasets=None, permutations=PERMUTATIONS):
+    """
+    workers: quantidade de processos para testar os arquivos em paralelo (None = todos os núcleos)
+    datasets: se informado, processa apenas esses datasets (ex.: ['full', 'facebook-lula'])
+    permutations: permutações por arquivo no modo de permutação (0 = p-valores do scipy)
+    """
+
+    # Listar as tabelas da pasta de entrada
+    files = list_tables(input_folder, '2. Normalized')
+
+    jobs = {
+        file.replace('2. Normalized-', ''): {'file_path': os.path.join(input_folder, file), 'output_folder': output_folder, 'column_target': column_target, 'permutations': permutations}
+        for file in files
+    }
+    if datasets is not None:
+        jobs = {name: job for name, job in jobs.items() if name in datasets}
+    if permutations and len(jobs) == 1:
+        # um arquivo só: os processos ficam com os blocos de permutações
+        for job in jobs.values():
+            job['workers'] = workers
+        workers = 1
+    return run_parallel(process_file, jobs, workers, title='Testes estatísticos')
+
+def cluster_membership(df, cluster, target):
+    """
+    Matriz post x cluster a partir das linhas (ID, cluster, alvo) de 'df'; um post pode estar em vários clusters.
+    Retorna (alvo de cada post, matriz esparsa, clusters na ordem em que aparecem em 'df')
+    """
+    post_codes, posts = pd.factorize(df['ID'])
+    cluster_codes, clusters = pd.factorize(df[cluster])
+    values = df[target].to_numpy()[np.unique(post_codes, return_index=True)[1]]
+    membership = sparse.csc_matrix(
+        (np.ones(len(df)), (post_codes, cluster_codes)), shape=(len(posts), len(clusters))
+    )
+    # várias tags do mesmo cluster num post contam uma vez só
+    membership.sum_duplicates()
+    membership.data[:] = 1
+    return values, membership, clusters.to_numpy()
+
+def classify(df):
+    """ Coluna 'Classification' pelo corte de 0.01 dos p-valores """
+    df['Classification'] = 'none'
+    df.loc[(df['P-Value - ts'] < 0.01) & (df['P-Value - greater'] < 0.01), 'Classification'] = 'greater'
+    df.loc[(df['P-Value - ts'] < 0.01) & (df['P-Value - less'] < 0.01), 'Classification'] = 'less'
+    return df
 
 def process_file_cluster(arc_cluster, arc_normalized, common_column, cluster, target, output):
     try:
-        if not arc_cluster.endswith('.csv'):
-            raise ValueError("O arquivo arc_cluster não possui a extensão .csv")
-
-        df_1 = pd.read_csv(arc_cluster)
+        df_1 = read_table(arc_cluster)
     except Exception as e:
         print(f"Erro ao ler o arquivo arc_cluster: {str(e)}")
         return
 
     try:
-        if not arc_normalized.endswith('.csv'):
-            raise ValueError("O arquivo arc_normalized não possui a extensão .csv")
-
-        df_2 = pd.read_csv(arc_normalized)
+        df_2 = read_normalized(arc_normalized).long()
     except Exception as e:
         print(f"Erro ao ler o arquivo arc_normalized: {str(e)}")
         return
@@ -129,8 +424,7 @@ def process_file_cluster(arc_cluster, arc_normalized, common_column, cluster, ta
     df_3 = pd.merge(df_2, df_1, on=common_column, how='left')
     df_3 = df_3.dropna()
     df_3 = df_3.drop_duplicates(subset=['ID'])
-    df_3 = df_3[[common_column, cluster, target]]
-    result = []
+    df_3 = df_3[['ID', common_column, cluster, target]]
 
     # Realizar o teste de Shapiro-Wilk
     stat, p_valor = stats.shapiro(df_3[target])
@@ -145,40 +439,24 @@ def process_file_cluster(arc_cluster, arc_normalized, common_column, cluster, ta
     if p_valor > significance:
         print("Os dados parecem ser normalmente distribuídos (não rejeitamos H0)")
     else:
-        clusters = df_3[cluster].unique()
-        for i in clusters:
-            group_true = df_3[df_3[cluster] == i][target]
-            group_false = df_3[df_3[cluster] != i][target]
-
-            stat_ts, p_value_ts = mannwhitney_ts(group_true, group_false)
-            stat_greater, p_value_greater = mannwhitney_greater(group_true, group_false)
-            stat_less, p_value_less = mannwhitney_less(group_true, group_false)
-
-            # Aplicar as condições e criar a coluna 'Classification'
-            statistical_classification = 'none' 
-            if p_value_ts < 0.01:
-                statistical_classification = 'greater' if p_value_greater < 0.01 else 'less' if p_value_less < 0.01 else 'INVALID-RESULT'
-
-            result.append({
-                'Cluster': i,
-                'P-Value - ts': p_value_ts,
-                'P-Value - greater': p_value_greater,
-                'P-Value - less': p_value_less,
-                'Classification': statistical_classification
-            })
-        
-        df = pd.DataFrame(result)
-        df['Classification'] = 'none'
-        df.loc[(df['P-Value - ts'] < 0.01) & (df['P-Value - greater'] < 0.01), 'Classification'] = 'greater'
-        df.loc[(df['P-Value - ts'] < 0.01) & (df['P-Value - less'] < 0.01), 'Classification'] = 'less'
+        # cada post fica em um único cluster: cada cluster contra os demais posts
+        values, membership, clusters = cluster_membership(df_3, cluster, target)
+        df = classify(pd.DataFrame(mannwhitney_incidence(values, membership, clusters, key='Cluster')))
         
         output_filename = f"{output}/8. Statistical_Test_Cluster-{arc_normalized.split('2. Normalized-')[-1].split('.')[0]}"
 
-        df.to_csv(output_filename + ".csv")
-        df.to_excel(output_filename + ".xlsx")
+        save_table(df, output_filename)
 
+def stats_cluster_folder(folder_cluster, folder_normalized, common_column, cluster, target, output, output_clustervscluster, workers=1, permutations=0):
+    """
+    Testes de Mann-Whitney dos clusters de tags: cada cluster contra os demais posts ('8. Statistical_Test_Cluster-*')
+    e cada par de clusters ('8. Statistical_Test_Cluster_Cluster-*'). Um post entra em todos os clusters das suas tags.
+    workers: threads para testar os pares de clusters em paralelo
+    permutations: se > 0, p-valores de permutação nos testes de cada cluster contra os demais (ver mannwhitney_permutation)
 
-def stats_cluster_folder(folder_cluster, folder_normalized, common_column, cluster, target, output, output_clustervscluster):
+    A matriz post x cluster é montada uma vez por arquivo; os dois testes saem dela e do alvo de cada post,
+    sem filtrar a tabela de novo para cada cluster ou par.
+    """
     try:
         if not os.path.isdir(folder_cluster):
             raise ValueError("O caminho fornecido para folder_cluster não é um diretório válido")
@@ -186,14 +464,14 @@ def stats_cluster_folder(folder_cluster, folder_normalized, common_column, clust
         if not os.path.isdir(folder_normalized):
             raise ValueError("O caminho fornecido para folder_normalized não é um diretório válido")
 
-        files_cluster = [f for f in os.listdir(folder_cluster) if f.endswith('.xlsx')]
-        files_normalized = [f for f in os.listdir(folder_normalized) if f.endswith('.xlsx')]
+        files_cluster = list_tables(folder_cluster)
+        files_normalized = list_tables(folder_normalized, '2. Normalized')
 
         for file_cluster in files_cluster:
             for file_normalized in files_normalized:
                 if ('-'.join(file_cluster.split('-')[1:])) == ('-'.join(file_normalized.split('-')[1:])):
-                    df_1 = pd.read_excel(os.path.join(folder_cluster, file_cluster))
-                    df_2 = pd.read_excel(os.path.join(folder_normalized, file_normalized))
+                    df_1 = read_table(os.path.join(folder_cluster, file_cluster))
+                    df_2 = read_normalized(os.path.join(folder_normalized, file_normalized)).long()
 
                     df_2 = df_2[[common_column, target, 'ID']]
 
@@ -201,9 +479,6 @@ def stats_cluster_folder(folder_cluster, folder_normalized, common_column, clust
                     df_3 = df_3.dropna()
 
                     df_3 = df_3[['ID', common_column, cluster, target]]
-                    result = []
-                    result_ = []
-                    clusters_visited = []
 
                     # Realizar o teste de Shapiro-Wilk
                     stat, p_valor = stats.shapiro(df_3[target])
@@ -218,86 +493,27 @@ def stats_cluster_folder(folder_cluster, folder_normalized, common_column, clust
                     if p_valor > significance:
                         print("Os dados parecem ser normalmente distribuídos (não rejeitamos H0)")
                     else:
-                        clusters = df_3[cluster].unique()
-
-                        for i in clusters:
-                            
-                            all_ids_with_tag = df_3[df_3[cluster] == i]['ID'].unique()
-                            filter = df_3['ID'].isin(all_ids_with_tag)
-
-                            group_true = df_3[filter][['ID', target]]
-                            group_true = group_true.drop_duplicates()
-                            group_true = group_true[target]
-                            
-                            group_false = df_3[~filter][['ID', target]]
-                            group_false = group_false.drop_duplicates()
-                            group_false = group_false[target]
-
-                            stat_ts, p_value_ts = mannwhitney_ts(group_true, group_false)
-                            stat_greater, p_value_greater = mannwhitney_greater(group_true, group_false)
-                            stat_less, p_value_less = mannwhitney_less(group_true, group_false)
-
-                            # Aplicar as condições e criar a coluna 'Classification'
-                            statistical_classification = 'none' 
-                            if p_value_ts < 0.01:
-                                statistical_classification = 'greater' if p_value_greater < 0.01 else 'less' if p_value_less < 0.01 else 'INVALID-RESULT'
-
-                            result.append({
-                                'Cluster': i,
-                                'P-Value - ts': p_value_ts,
-                                'P-Value - greater': p_value_greater,
-                                'P-Value - less': p_value_less,
-                                'Classification': statistical_classification
-                            })
-
-                            
-                            for cluster_ in df_3[cluster].unique():
-                                if i != cluster_ and cluster_ not in clusters_visited:
-                                    all_ids_with_tag = df_3[df_3[cluster] == cluster_]['ID'].unique()
-                                    filter = df_3['ID'].isin(all_ids_with_tag)
-
-                                    group_false = df_3[filter][['ID', target]]
-                                    group_false = group_false.drop_duplicates()
-                                    group_false = group_false[target]
-
-                                    stat_ts, p_value_ts = mannwhitney_ts(group_true, group_false)
-                                    stat_greater, p_value_greater = mannwhitney_greater(group_true, group_false)
-                                    stat_less, p_value_less = mannwhitney_less(group_true, group_false)
-
-                                    # Aplicar as condições e criar a coluna 'Classification'
-                                    statistical_classification = 'none' 
-                                    if p_value_ts < 0.01:
-                                        statistical_classification = 'greater' if p_value_greater < 0.01 else 'less' if p_value_less < 0.01 else 'INVALID-RESULT'
-
-                                    result_.append({
-                                        'Cluster 1': i,
-                                        'Cluster 2': cluster_,
-                                        'P-Value - ts': p_value_ts,
-                                        'P-Value - greater': p_value_greater,
-                                        'P-Value - less': p_value_less,
-                                        'Classification': statistical_classification
-                                    })
-                            
-                            clusters_visited.append(i)
-                                    
-                        df = pd.DataFrame(result)
-                        df['Classification'] = 'none'
-                        df.loc[(df['P-Value - ts'] < 0.01) & (df['P-Value - greater'] < 0.01), 'Classification'] = 'greater'
-                        df.loc[(df['P-Value - ts'] < 0.01) & (df['P-Value - less'] < 0.01), 'Classification'] = 'less'
+                        values, membership, clusters = cluster_membership(df_3, cluster, target)
+
+                        # cada cluster contra os posts que não estão nele
+                        df = classify(pd.DataFrame(mannwhitney_incidence(values, membership, clusters, key='Cluster', permutations=permutations)))
 
                         output_filename = f"{output}/8. Statistical_Test_Cluster-{file_normalized.split('2. Normalized-')[-1].split('.')[0]}"
 
-                        df.to_csv(output_filename + ".csv")
-                        df.to_excel(output_filename + ".xlsx")
+                        save_table(df, output_filename)
+
+                        # cada par de clusters (i, j), com j depois de i na ordem em que aparecem
+                        pairs = np.column_stack(np.triu_indices(len(clusters), k=1))
+                        p_values = mannwhitney_pairs(values, membership, pairs, workers=workers)
+                        result_ = mannwhitney_results(clusters[pairs[:, 0]], *p_values, key='Cluster 1')
+                        for row, cluster_ in zip(result_, clusters[pairs[:, 1]]):
+                            row['Cluster 2'] = cluster_
 
-                        df_ = pd.DataFrame(result_)
-                        df_['Classification'] = 'none'
-                        df_.loc[(df_['P-Value - ts'] < 0.01) & (df_['P-Value - greater'] < 0.01), 'Classification'] = 'greater'
-                        df_.loc[(df_['P-Value - ts'] < 0.01) & (df_['P-Value - less'] < 0.01), 'Classification'] = 'less'
+                        df_ = pd.DataFrame(result_, columns=['Cluster 1', 'Cluster 2', 'P-Value - ts', 'P-Value - greater', 'P-Value - less', 'Classification'])
+                        df_ = classify(df_)
 
                         output_filename = f"{output_clustervscluster}/8. Statistical_Test_Cluster_Cluster-{file_normalized.split('2. Normalized-')[-1].split('.')[0]}"
 
-                        df_.to_csv(output_filename + ".csv")
-                        df_.to_excel(output_filename + ".xlsx")
+                        save_table(df_, output_filename)
     except Exception as e:
         print(f"Erro ao processar os arquivos: {str(e)}")
@@ -1,24 +1,42 @@
+import numpy as np
 import pandas as pd
 from wordcloud import WordCloud
 import matplotlib.pyplot as plt
 import os
 
-def count_labels(df:pd.DataFrame, output: str):
-  df_count = df.groupby(['Class']).size().reset_index(name="Total")
+from pipeline.storage import save_table
+from pipeline.vocabulary import TagVocabulary
+
+def tag_counts(df: pd.DataFrame, vocabulary: TagVocabulary = None) -> pd.DataFrame:
+  """ 
+    Quantidade de labels de cada tag (colunas 'Class' e 'Total', em ordem alfabética).
+    Com o vocabulário, a contagem é feita sobre os códigos ('tag_idx') e os nomes só são lidos no final
+  """
+  if vocabulary is None or 'tag_idx' not in df.columns:
+    return df.groupby(['Class']).size().reset_index(name="Total")
+  totals = np.bincount(df['tag_idx'].to_numpy(), minlength=len(vocabulary))
+  codes = np.flatnonzero(totals)
+  df_count = pd.DataFrame({'Class': vocabulary.decode(codes), 'Total': totals[codes]})
+  return df_count.sort_values('Class').reset_index(drop=True)
+
+def count_labels(df:pd.DataFrame, output: str, vocabulary: TagVocabulary = None) -> pd.DataFrame:
+  df_count = tag_counts(df, vocabulary)
   df_count.sort_values("Total", ascending=False)
-  df_count.to_excel(f"{output}.xlsx", index=False)
+  # cópia .xlsx só no relatório final (EXPORT_EXCEL)
+  save_table(df_count, output)
+  return df_count
   
-def create_wordcloud(df: pd.DataFrame, path: str, output: str):
+def create_wordcloud(df: pd.DataFrame, path: str, output: str, vocabulary: TagVocabulary = None):
   output = f"{output}/wordcloud"
   if (not os.path.isdir(output)):
     os.mkdir(output)
-    
-  count_labels(
+  
+  classes = count_labels(
     df,
-    output=f"{output}/{path}"
+    output=f"{output}/{path}",
+    vocabulary=vocabulary
   )
   
-  classes = df.groupby('Class').size().reset_index(name="Total")
   classes['Class'] = classes['Class'].str.replace(' ', '_')
   key_value = {}
   for key, total in classes.values: